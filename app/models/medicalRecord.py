@@ -1,9 +1,10 @@
 from sqlalchemy import Column, Integer, String, Boolean, DateTime, Enum, text, ForeignKey, Float, TEXT, func
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import relationship, validates
 from app.shared.config.database import Base
 from app.models.interfaces import userRole
 from datetime import datetime
 from app.models.user import User
+from app.shared.utils.riskService import split_blood_pressure
 
 class MedicalRecord(Base):
     __tablename__ = 'medical_record'
@@ -13,6 +14,9 @@ class MedicalRecord(Base):
     doctor_id = Column(Integer, ForeignKey('user.id'), nullable=True)
     temperature = Column(Float, nullable=False)
     blood_pressure = Column(String(20), nullable=False)
+    # Valores numéricos derivados de blood_pressure ("sis/dia"), se llenan al escribir
+    systolic = Column(Float, nullable=True)
+    diastolic = Column(Float, nullable=True)
     oxygen_saturation = Column(Float, nullable=False)
     heart_rate = Column(Float, nullable=False)
     diagnosis = Column(TEXT, nullable=True)
@@ -22,4 +26,9 @@ class MedicalRecord(Base):
     updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now, nullable=False, server_default=func.now())
 
     patient = relationship("User", foreign_keys=[patient_id])
-    doctor = relationship("User", foreign_keys=[doctor_id])
\ No newline at end of file
+    doctor = relationship("User", foreign_keys=[doctor_id])
+
+    @validates("blood_pressure")
+    def _fill_blood_pressure_columns(self, key, value):
+        self.systolic, self.diastolic = split_blood_pressure(value) or (None, None)
+        return value
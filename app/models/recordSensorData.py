@@ -9,7 +9,9 @@ class RecordSensorData(Base):
     patient_id = Column(Integer, ForeignKey('user.id'), nullable=False)
     doctor_id = Column(Integer, ForeignKey('user.id'), nullable=True)
     temperature = Column(Float, nullable=True)
-    blood_pressure = Column(Float, nullable=True)
+    blood_pressure = Column(Float, nullable=True)  # Sistólica, se conserva por compatibilidad
+    systolic = Column(Float, nullable=True)
+    diastolic = Column(Float, nullable=True)
     oxygen_saturation = Column(Float, nullable=True)
     heart_rate = Column(Float, nullable=True)
     timestamp = Column(DateTime, default=datetime.now, nullable=False)
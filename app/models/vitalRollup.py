@@ -0,0 +1,57 @@
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Float, Index
+from app.shared.config.database import Base
+
+class VitalRollup(Base):
+    """Resumen de los expedientes de un paciente por hora o por día.
+
+    Solo guarda valores que se pueden sumar entre cubetas (conteos, sumas, sumas de
+    cuadrados, mínimos y máximos), así que un rango se responde combinando cubetas.
+    """
+    __tablename__ = 'vital_rollup'
+
+    patient_id = Column(Integer, ForeignKey('user.id'), primary_key=True)
+    doctor_id = Column(Integer, primary_key=True, default=0)  # 0 = expediente sin doctor
+    granularity = Column(String(4), primary_key=True)  # "hour" | "day"
+    bucket = Column(DateTime, primary_key=True)  # Inicio de la hora o del día
+    count = Column(Integer, nullable=False, default=0)
+    first_at = Column(DateTime, nullable=True)
+    last_at = Column(DateTime, nullable=True)
+
+    temperature_n = Column(Integer, nullable=False, default=0)
+    temperature_sum = Column(Float, nullable=False, default=0)
+    temperature_sumsq = Column(Float, nullable=False, default=0)
+    temperature_min = Column(Float, nullable=True)
+    temperature_max = Column(Float, nullable=True)
+
+    systolic_n = Column(Integer, nullable=False, default=0)
+    systolic_sum = Column(Float, nullable=False, default=0)
+    systolic_sumsq = Column(Float, nullable=False, default=0)
+    systolic_min = Column(Float, nullable=True)
+    systolic_max = Column(Float, nullable=True)
+
+    oxygen_saturation_n = Column(Integer, nullable=False, default=0)
+    oxygen_saturation_sum = Column(Float, nullable=False, default=0)
+    oxygen_saturation_sumsq = Column(Float, nullable=False, default=0)
+    oxygen_saturation_min = Column(Float, nullable=True)
+    oxygen_saturation_max = Column(Float, nullable=True)
+
+    heart_rate_n = Column(Integer, nullable=False, default=0)
+    heart_rate_sum = Column(Float, nullable=False, default=0)
+    heart_rate_sumsq = Column(Float, nullable=False, default=0)
+    heart_rate_min = Column(Float, nullable=True)
+    heart_rate_max = Column(Float, nullable=True)
+
+    # Registros que cumplen cada regla de RIESGOS_ESTADISTICAS
+    riesgo_taquicardia = Column(Integer, nullable=False, default=0)
+    riesgo_bradicardia = Column(Integer, nullable=False, default=0)
+    riesgo_fiebre = Column(Integer, nullable=False, default=0)
+    riesgo_hipotermia = Column(Integer, nullable=False, default=0)
+    riesgo_hipertension = Column(Integer, nullable=False, default=0)
+    riesgo_hipotension = Column(Integer, nullable=False, default=0)
+    riesgo_baja_saturacion = Column(Integer, nullable=False, default=0)
+    probabilidad_agitacion = Column(Integer, nullable=False, default=0)
+    probabilidad_shock = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        Index('ix_vital_rollup_doctor_bucket', 'doctor_id', 'granularity', 'bucket'),
+    )
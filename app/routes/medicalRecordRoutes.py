@@ -8,34 +8,40 @@ from app.models.user import User
 from app.models.doctorPatient import DoctorPatient
 
 from app.shared.config.database import SessionLocal
-from sqlalchemy.orm import Session, joinedload
-from app.shared.config.database import get_db
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload, selectinload
+from app.shared.config.database import get_async_db
 from app.shared.config.middleware.security import get_current_user
 
 from app.shared.services.stadisticsService import get_medical_record_statistics
+from app.shared.services import rollupService, statsCache
 from app.shared.utils.riskService import detectar_riesgos
 
 medicalRecordRouter = APIRouter()
 
+# doctor y patient van en las respuestas y una AsyncSession no puede cargarlos de forma perezosa
+CON_RELACIONES = (selectinload(MedicalRecord.doctor), selectinload(MedicalRecord.patient))
+
 # Ruta para crear un nuevo registro médico
 @medicalRecordRouter.post("/medicalRecords", response_model=medicalRecordResponseSchema, status_code=201, tags=["medical_records"])
-async def create_medical_record(medical_record: medicalRecordSchema, db: Session = Depends(get_db)):
-    patient = db.query(User).filter(User.id == medical_record.patient_id, User.role == 'patient').first()
+async def create_medical_record(medical_record: medicalRecordSchema, db: AsyncSession = Depends(get_async_db)):
+    patient = await db.scalar(select(User).where(User.id == medical_record.patient_id, User.role == 'patient'))
     if not patient:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Paciente no encontrado")
     
     # Verificar si se especificó a un doctor (y que no sea 0)
     if medical_record.doctor_id and medical_record.doctor_id != 0:
         # Verificar que el doctor existe
-        doctor = db.query(User).filter(User.id == medical_record.doctor_id, User.role == 'doctor').first()
+        doctor = await db.scalar(select(User).where(User.id == medical_record.doctor_id, User.role == 'doctor'))
         if not doctor:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Doctor no encontrado")
         
         # Verificar si ya existe la relación doctor-paciente
-        existing_relation = db.query(DoctorPatient).filter(
+        existing_relation = await db.scalar(select(DoctorPatient).where(
             DoctorPatient.doctor_id == medical_record.doctor_id,
             DoctorPatient.patient_id == medical_record.patient_id
-        ).first()
+        ))
         # Si no existe la relación, crearla automáticamente
         if not existing_relation:
             try:
@@ -44,9 +50,9 @@ async def create_medical_record(medical_record: medicalRecordSchema, db: Session
                     patient_id=medical_record.patient_id
                 )
                 db.add(new_relation)
-                db.flush()  # Flush para detectar errores antes del commit final
+                await db.flush()  # Flush para detectar errores antes del commit final
             except Exception as e:
-                db.rollback()
+                await db.rollback()
                 raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, 
                                 detail="Error al crear la relación doctor-paciente")
     
@@ -57,24 +63,27 @@ async def create_medical_record(medical_record: medicalRecordSchema, db: Session
             medical_record_data['doctor_id'] = None
         new_record = MedicalRecord(**medical_record_data)
         db.add(new_record)
-        db.commit() 
-        db.refresh(new_record)
+        await db.flush()
+        await db.run_sync(rollupService.acumular, [new_record])
+        await db.commit() 
+        await statsCache.invalidar_async((new_record.patient_id, new_record.doctor_id))
+        await db.refresh(new_record, ["doctor", "patient"])
         return new_record
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, 
                           detail="Error al crear el registro médico")
         
 # Ruta para obtener todos los registros médicos
 @medicalRecordRouter.get("/medicalRecords", response_model=list[medicalRecordResponseSchema], tags=["medical_records"], status_code=200)
-async def get_medical_records(db: Session = Depends(get_db)):
-    records = db.query(MedicalRecord).all()
+async def get_medical_records(db: AsyncSession = Depends(get_async_db)):
+    records = (await db.scalars(select(MedicalRecord).options(*CON_RELACIONES))).all()
     return records
 
 # Ruta para obtener un registro médico por ID
 @medicalRecordRouter.get("/medicalRecords/{record_id}", response_model=medicalRecordWithRisksResponseSchema, tags=["medical_records"], status_code=200)
-async def get_medical_record(record_id: int, db: Session = Depends(get_db)):
-    record = db.query(MedicalRecord).filter(MedicalRecord.id == record_id).first()
+async def get_medical_record(record_id: int, db: AsyncSession = Depends(get_async_db)):
+    record = await db.scalar(select(MedicalRecord).options(*CON_RELACIONES).where(MedicalRecord.id == record_id))
     if not record:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Registro médico no encontrado")
 
@@ -87,6 +96,8 @@ async def get_medical_record(record_id: int, db: Session = Depends(get_db)):
         doctor_id=record.doctor_id,
         temperature=record.temperature,
         blood_pressure=record.blood_pressure,
+        systolic=record.systolic,
+        diastolic=record.diastolic,
         oxygen_saturation=record.oxygen_saturation,
         heart_rate=record.heart_rate,
         diagnosis=record.diagnosis,
@@ -102,46 +113,61 @@ async def get_medical_record(record_id: int, db: Session = Depends(get_db)):
 
 # Ruta para obtener los registros médicos de un paciente específico
 @medicalRecordRouter.get("/patients/{patient_id}/medicalRecords", response_model=list[medicalRecordResponseSchema], tags=["medical_records"], status_code=200)
-async def get_patient_medical_records(patient_id: int, db: Session = Depends(get_db)):
-    records = db.query(MedicalRecord).filter(MedicalRecord.patient_id == patient_id).all()
+async def get_patient_medical_records(patient_id: int, db: AsyncSession = Depends(get_async_db)):
+    records = (await db.scalars(select(MedicalRecord).options(*CON_RELACIONES).where(MedicalRecord.patient_id == patient_id))).all()
     if not records:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No se encontraron registros médicos para este paciente")
     return records
 
 # Ruta para actualizar un registro médico
 @medicalRecordRouter.put("/medicalRecords/{record_id}", response_model=medicalRecordResponseSchema, tags=["medical_records"], status_code=200)
-async def update_medical_record(record_id: int, medical_record: medicalRecordSchema, db: Session = Depends(get_db)):
-    existing_record = db.query(MedicalRecord).filter(MedicalRecord.id == record_id).first()
+async def update_medical_record(record_id: int, medical_record: medicalRecordSchema, db: AsyncSession = Depends(get_async_db)):
+    existing_record = await db.scalar(select(MedicalRecord).where(MedicalRecord.id == record_id))
     if not existing_record:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Registro médico no encontrado")
 
+    anterior = (existing_record.patient_id, existing_record.doctor_id, existing_record.created_at)
     for key, value in medical_record.model_dump(exclude_unset=True).items():
         setattr(existing_record, key, value)
 
-    db.commit()
+    # Las cubetas del registro antes y después del cambio se recalculan
+    await db.flush()
+    await db.run_sync(rollupService.recalcular, *anterior)
+    actual = (existing_record.patient_id, existing_record.doctor_id, existing_record.created_at)
+    if actual != anterior:
+        await db.run_sync(rollupService.recalcular, *actual)
+    await db.commit()
+    await statsCache.invalidar_async(anterior[:2], actual[:2])
     # Recarga el registro con las relaciones
-    updated_record = db.query(MedicalRecord)\
-        .options(joinedload(MedicalRecord.doctor), joinedload(MedicalRecord.patient))\
-        .filter(MedicalRecord.id == record_id).first()
+    updated_record = await db.scalar(
+        select(MedicalRecord)
+        .options(joinedload(MedicalRecord.doctor), joinedload(MedicalRecord.patient))
+        .where(MedicalRecord.id == record_id)
+        .execution_options(populate_existing=True)
+    )
     return updated_record
 
 # Ruta para obtener los registros médicos de un doctor específico
 @medicalRecordRouter.get("/doctors/{doctor_id}/medicalRecords", response_model=list[medicalRecordResponseSchema], tags=["medical_records"], status_code=200)
-async def get_doctor_medical_records(doctor_id: int, db: Session = Depends(get_db)):
-    records = db.query(MedicalRecord).filter(MedicalRecord.doctor_id == doctor_id).all()
+async def get_doctor_medical_records(doctor_id: int, db: AsyncSession = Depends(get_async_db)):
+    records = (await db.scalars(select(MedicalRecord).options(*CON_RELACIONES).where(MedicalRecord.doctor_id == doctor_id))).all()
     if not records:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No se encontraron registros médicos para este doctor")
     return records
 
 # Ruta para eliminar un registro médico
 @medicalRecordRouter.delete("/medicalRecords/{record_id}", status_code=204, tags=["medical_records"])
-async def delete_medical_record(record_id: int, db: Session = Depends(get_db)):
-    record = db.query(MedicalRecord).filter(MedicalRecord.id == record_id).first()
+async def delete_medical_record(record_id: int, db: AsyncSession = Depends(get_async_db)):
+    record = await db.scalar(select(MedicalRecord).where(MedicalRecord.id == record_id))
     if not record:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Registro médico no encontrado")
     
-    db.delete(record)
-    db.commit()
+    anterior = (record.patient_id, record.doctor_id, record.created_at)
+    await db.delete(record)
+    await db.flush()
+    await db.run_sync(rollupService.recalcular, *anterior)
+    await db.commit()
+    await statsCache.invalidar_async(anterior[:2])
     return {"detail": "Registro médico eliminado exitosamente"}
 
 # Ruta para obtener los registros medicos dentro de un rango de fechas de un paciente
@@ -150,7 +176,7 @@ async def get_medical_records_by_date_range(
     patient_id: int, 
     start_date: str = Query(..., description="Formato: YYYY-MM-DD"), 
     end_date: str = Query(..., description="Formato: YYYY-MM-DD"), 
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     # Validar formato de fecha
     try:
@@ -165,11 +191,11 @@ async def get_medical_records_by_date_range(
 
     end = end + timedelta(days=1)
     # Buscar registros en el rango (incluyendo ambos extremos)
-    records = db.query(MedicalRecord).filter(
+    records = (await db.scalars(select(MedicalRecord).options(*CON_RELACIONES).where(
         MedicalRecord.patient_id == patient_id,
         MedicalRecord.created_at >= start,
         MedicalRecord.created_at < end
-    ).all()
+    ))).all()
 
     return records
 
@@ -179,7 +205,7 @@ async def get_doctor_medical_records_by_date_range(
     doctor_id: int, 
     start_date: str = Query(..., description="Formato: YYYY-MM-DD"), 
     end_date: str = Query(..., description="Formato: YYYY-MM-DD"), 
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     # Validar formato de fecha
     try:
@@ -194,10 +220,10 @@ async def get_doctor_medical_records_by_date_range(
 
     end = end + timedelta(days=1)
     # Buscar registros en el rango (incluyendo ambos extremos)
-    records = db.query(MedicalRecord).filter(
+    records = (await db.scalars(select(MedicalRecord).options(*CON_RELACIONES).where(
         MedicalRecord.patient_id == doctor_id,
         MedicalRecord.created_at >= start,
         MedicalRecord.created_at < end
-    ).all()
+    ))).all()
 
     return records
\ No newline at end of file
@@ -1,61 +1,111 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from datetime import timedelta
+from fastapi import APIRouter, Depends, HTTPException, status, Query
+from datetime import datetime, timedelta
+from typing import Optional
 
 from app.models.medicalRecord import MedicalRecord
-from app.routes.medicalRecordRoutes import get_patient_medical_records, get_doctor_medical_records
+from app.routes.medicalRecordRoutes import CON_RELACIONES
 from app.models.user import User
 
 from app.shared.config.database import SessionLocal
-from sqlalchemy.orm import Session, joinedload
-from app.shared.config.database import get_db
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
+from app.shared.config.database import get_async_db
 from app.shared.config.middleware.security import get_current_user
 
-from app.shared.services.stadisticsService import get_medical_record_statistics
+from app.shared.services.stadisticsService import get_statistics, get_doctor_patients_breakdown
+from app.shared.services import statsCache
 
 stadisticsRouter = APIRouter()
 
 
+# Las respuestas incluyen los expedientes como siempre; `limit`/`offset` los paginan
+# (el historial completo con relaciones crece sin límite) e include_records=false los omite
+async def _pagina_expedientes(db: AsyncSession, filtros, limit: Optional[int], offset: int):
+    consulta = select(MedicalRecord).options(*CON_RELACIONES).where(*filtros).order_by(MedicalRecord.id)
+    if limit is not None:
+        consulta = consulta.limit(limit)
+    if offset:
+        consulta = consulta.offset(offset)
+    return (await db.scalars(consulta)).all()
+
+def _filtros_rango(start_date: str, end_date: str):
+    return [
+        MedicalRecord.created_at >= datetime.fromisoformat(start_date),
+        MedicalRecord.created_at <= datetime.fromisoformat(end_date),
+    ]
+
+
 # Ruta para obtener la estadistica de un paciente en base a sus expedientes
 @stadisticsRouter.get("/stadistics/{patient_id}", status_code=200)
-async def get_patient_statistics(patient_id: int, db: Session = Depends(get_db)):
-    records = await get_patient_medical_records(patient_id, db)
-    if not records:
+async def get_patient_statistics(patient_id: int, include_records: bool = True,
+                                 limit: Optional[int] = Query(None, ge=1, le=1000), offset: int = Query(0, ge=0),
+                                 db: AsyncSession = Depends(get_async_db)):
+    stadistics = await statsCache.obtener("patient", patient_id, None, None, lambda: get_statistics(db, patient_id=patient_id))
+    if "error" in stadistics:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No se encontraron registros médicos para este paciente")
-    stadistics = await get_medical_record_statistics(db, records)
-    return { "data": stadistics, "records": records }
+    respuesta = { "data": stadistics }
+    if include_records:
+        respuesta["records"] = await _pagina_expedientes(db, [MedicalRecord.patient_id == patient_id], limit, offset)
+    return respuesta
 
 # Rutas para obtener las estadísticas de los pacientes de un doctor
 @stadisticsRouter.get("/stadistics/{doctor_id}/patients", tags=["stadistics"], status_code=200)
-async def get_doctor_patients_statistics(doctor_id: int, db: Session = Depends(get_db)):
-    records = await get_doctor_medical_records(doctor_id, db)
-    if not records:
+async def get_doctor_patients_statistics(doctor_id: int, include_records: bool = True,
+                                         limit: Optional[int] = Query(None, ge=1, le=1000), offset: int = Query(0, ge=0),
+                                         db: AsyncSession = Depends(get_async_db)):
+    stadistics = await statsCache.obtener("doctor", doctor_id, None, None, lambda: get_statistics(db, doctor_id=doctor_id))
+    if "error" in stadistics:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No se encontraron registros médicos para este doctor")
-    stadistics = await get_medical_record_statistics(db, records)
-    return { "data": stadistics, "records": records }
+    respuesta = { "data": stadistics }
+    if include_records:
+        respuesta["records"] = await _pagina_expedientes(db, [MedicalRecord.doctor_id == doctor_id], limit, offset)
+    return respuesta
 
 # Ruta para obtener la estadisica de los registros medicos dentro de un rango de fechas de un paciente
 @stadisticsRouter.get("/stadistics/{patient_id}/range", tags=["stadistics"], status_code=200)
-async def get_medical_records_by_date_range(patient_id: int, start_date: str, end_date: str, db: Session = Depends(get_db)):
-    records = db.query(MedicalRecord).filter(
-        MedicalRecord.patient_id == patient_id,
-        MedicalRecord.created_at >= start_date,
-        MedicalRecord.created_at <= end_date
-    ).all()
-    
-    if not records:
+async def get_medical_records_by_date_range(patient_id: int, start_date: str, end_date: str, include_records: bool = True,
+                                            limit: Optional[int] = Query(None, ge=1, le=1000), offset: int = Query(0, ge=0),
+                                            db: AsyncSession = Depends(get_async_db)):
+    # El agregado ya cuenta los registros del rango: sin registros devuelve "error"
+    stadistics = await statsCache.obtener(
+        "patient", patient_id, start_date, end_date,
+        lambda: get_statistics(db, patient_id=patient_id, start_date=start_date, end_date=end_date),
+    )
+    if "error" in stadistics:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No se encontraron registros médicos en el rango de fechas especificado")
-    
-    stadistics = await get_medical_record_statistics(db, records)
-    if not stadistics:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No se encontraron estadísticas para los registros médicos en el rango de fechas especificado")
 
-    return { "data": stadistics, "records": records }
+    respuesta = { "data": stadistics }
+    if include_records:
+        filtros = [MedicalRecord.patient_id == patient_id, *_filtros_rango(start_date, end_date)]
+        respuesta["records"] = await _pagina_expedientes(db, filtros, limit, offset)
+    return respuesta
 
 # Ruta para obtener las estadísticas de un doctor dentro de un rango de fechas
 @stadisticsRouter.get("/stadistics/{doctor_id}/patients/range", tags=["stadistics"], status_code=200)
-async def get_doctor_statistics_by_date_range(doctor_id: int, start_date: str, end_date: str, db: Session = Depends(get_db)):
-    records = await get_doctor_medical_records(doctor_id, db)
-    if not records:
+async def get_doctor_statistics_by_date_range(doctor_id: int, start_date: str, end_date: str, include_records: bool = True,
+                                              limit: Optional[int] = Query(None, ge=1, le=1000), offset: int = Query(0, ge=0),
+                                              db: AsyncSession = Depends(get_async_db)):
+    stadistics = await statsCache.obtener(
+        "doctor", doctor_id, start_date, end_date,
+        lambda: get_statistics(db, doctor_id=doctor_id, start_date=start_date, end_date=end_date),
+    )
+    if "error" in stadistics:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No se encontraron registros médicos para este doctor en el rango de fechas especificado")
+    respuesta = { "data": stadistics }
+    if include_records:
+        filtros = [MedicalRecord.doctor_id == doctor_id, *_filtros_rango(start_date, end_date)]
+        respuesta["records"] = await _pagina_expedientes(db, filtros, limit, offset)
+    return respuesta
+
+# Ruta para obtener las estadísticas de cada paciente de un doctor y el resumen de la cohorte
+@stadisticsRouter.get("/stadistics/{doctor_id}/patients/breakdown", tags=["stadistics"], status_code=200)
+async def get_doctor_patients_breakdown_statistics(doctor_id: int, start_date: Optional[str] = None, end_date: Optional[str] = None, db: AsyncSession = Depends(get_async_db)):
+    stadistics = await statsCache.obtener(
+        "doctor", doctor_id, start_date, end_date,
+        lambda: get_doctor_patients_breakdown(db, doctor_id, start_date, end_date),
+        variante="breakdown",
+    )
+    if "error" in stadistics:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No se encontraron registros médicos para este doctor")
-    stadistics = await get_medical_record_statistics(db, records, start_date, end_date)
-    return { "data": stadistics, "records": records }
\ No newline at end of file
+    return { "data": stadistics }
@@ -6,8 +6,9 @@ from app.models.user import User
 from app.models.doctorPatient import DoctorPatient
 from app.schemas.userSchema import userSchema, userCreateSchema, userResponseSchema, userLoginSchema, loginResponseSchema
 from app.shared.config.database import SessionLocal
-from sqlalchemy.orm import Session
-from app.shared.config.database import get_db
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.shared.config.database import get_async_db
 from app.shared.config.middleware.security import get_password_hash, get_current_user, verify_password, ACCESS_TOKEN_EXPIRE_MINUTES, create_access_token
 from app.shared.config.s3Files import upload_file_to_s3, upload_files_to_s3
 
@@ -17,12 +18,12 @@ userRouter = APIRouter()
 
 # Ruta para crear un nuevo usuario
 @userRouter.post("/users", response_model=userResponseSchema, status_code=201, tags=["users"])
-async def create_user(user: userCreateSchema, db: Session = Depends(get_db)):
+async def create_user(user: userCreateSchema, db: AsyncSession = Depends(get_async_db)):
     # Validación: solo mujeres pueden estar embarazadas
     if user.pregnant and (user.gender != 'female' and user.gender != userGender.FEMALE):
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Solo las mujeres pueden estar embarazadas.")
     # Verifiamos que el usuario no exista
-    existing_user = db.query(User).filter(User.email == user.email).first()
+    existing_user = await db.scalar(select(User).where(User.email == user.email))
     if existing_user:
         raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="El usuario ya existe con este correo electrónico.")
 
@@ -40,20 +41,20 @@ async def create_user(user: userCreateSchema, db: Session = Depends(get_db)):
         profile_picture=user.profile_picture
     )
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await db.commit()
+    await db.refresh(new_user)
     return new_user
 
 @userRouter.get("/users", response_model=list[userResponseSchema], tags=["users"], status_code=200)
-async def get_users(db: Session = Depends(get_db)):
-    users = db.query(User).where(User.deleted.is_(None)).all()  # Filtramos usuarios no eliminados
+async def get_users(db: AsyncSession = Depends(get_async_db)):
+    users = (await db.scalars(select(User).where(User.deleted.is_(None)))).all()  # Filtramos usuarios no eliminados
     if not users:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No se encontraron usuarios") 
     return users
  
 @userRouter.get("/users/{user_id}", response_model=userResponseSchema, tags=["users"], status_code=200)
-async def get_user(user_id: int, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.id == user_id).first()
+async def get_user(user_id: int, db: AsyncSession = Depends(get_async_db)):
+    user = await db.scalar(select(User).where(User.id == user_id))
     if not user:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Usuario no encontrado")
     return user
@@ -71,9 +72,9 @@ async def update_user(
     pregnant: Optional[bool] = Form(None),
     profile_picture: Optional[UploadFile] = File(None),
     
-    db: Session = Depends(get_db)):
+    db: AsyncSession = Depends(get_async_db)):
 
-    user = db.query(User).filter(User.id == user_id).first()
+    user = await db.scalar(select(User).where(User.id == user_id))
     if not user:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Usuario no encontrado")
     
@@ -94,7 +95,7 @@ async def update_user(
         user.lastname = lastname
     if email:
         # Validamos si el correo esta en uso
-        newEmail = db.query(User).filter(User.email == email).first()
+        newEmail = await db.scalar(select(User).where(User.email == email))
         if newEmail:
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Este correo electrónico ya está en uso.")
         user.email = email
@@ -109,25 +110,24 @@ async def update_user(
     if profile_picture:
         user.profile_picture = upload_file_to_s3(profile_picture)
 
-    db.commit()
-    db.refresh(user)
+    await db.commit()
+    await db.refresh(user)
     return user
 
 @userRouter.delete("/users/{user_id}", status_code=204, tags=["users"])
-async def delete_user(user_id: int, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.id == user_id).first()
+async def delete_user(user_id: int, db: AsyncSession = Depends(get_async_db)):
+    user = await db.scalar(select(User).where(User.id == user_id))
     if not user:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Usuario no encontrado")
     # Eliminamos compleamente el usuario
-    db.delete(user)
-    db.commit()
-    db.refresh(user)
+    await db.delete(user)
+    await db.commit()
     return {"detail": "Usuario eliminado exitosamente"}
 
 @userRouter.post("/users/login", response_model=loginResponseSchema, tags=["users"], status_code=200)
-async def login_user(user: userLoginSchema, db: Session = Depends(get_db)):
+async def login_user(user: userLoginSchema, db: AsyncSession = Depends(get_async_db)):
     # Buscar usuario por email
-    existing_user = db.query(User).filter(User.email == user.email).first()
+    existing_user = await db.scalar(select(User).where(User.email == user.email))
     
     # Verificar credenciales
     if not existing_user or not verify_password(user.password, existing_user.password):
@@ -165,7 +165,7 @@ async def get_current_user_info(current_user: User = Depends(get_current_user)):
 
 # ruta de prueb para subir archivos
 @userRouter.post("/users/upload", tags=["users"], status_code=200)
-async def upload_files(files: list[UploadFile] = File(...), db: Session = Depends(get_db)):
+async def upload_files(files: list[UploadFile] = File(...), db: AsyncSession = Depends(get_async_db)):
     if not files:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No se han subido archivos")
     
@@ -179,20 +179,20 @@ async def upload_files(files: list[UploadFile] = File(...), db: Session = Depend
 
 # Ruta para añadir un paciente a un doctor
 @userRouter.post("/doctors/{doctor_id}/patients/{patient_email}", status_code=201, tags=["users"])
-async def add_patient_to_doctor(doctor_id: int, patient_email: str, db: Session = Depends(get_db)):
-    doctor = db.query(User).filter(User.id == doctor_id, User.role == 'doctor').first()
+async def add_patient_to_doctor(doctor_id: int, patient_email: str, db: AsyncSession = Depends(get_async_db)):
+    doctor = await db.scalar(select(User).where(User.id == doctor_id, User.role == 'doctor'))
     if not doctor:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Doctor no encontrado")
 
-    patient = db.query(User).filter(User.email == patient_email, User.role == 'patient').first()
+    patient = await db.scalar(select(User).where(User.email == patient_email, User.role == 'patient'))
     if not patient:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Paciente no encontrado")
     
     # Verificar si la relación ya existe
-    existing_relation = db.query(DoctorPatient).filter(
+    existing_relation = await db.scalar(select(DoctorPatient).where(
         DoctorPatient.doctor_id == doctor_id,
         DoctorPatient.patient_id == patient.id
-    ).first()
+    ))
     
     if existing_relation:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="El paciente ya está asignado a este doctor")
@@ -200,87 +200,87 @@ async def add_patient_to_doctor(doctor_id: int, patient_email: str, db: Session
     # Crear nueva relación usando la tabla DoctorPatient
     new_relation = DoctorPatient(doctor_id=doctor_id, patient_id=patient.id)
     db.add(new_relation)
-    db.commit()
+    await db.commit()
     
     return {"detail": "Paciente añadido al doctor exitosamente"}
 
 # Ruta para obtener los pacientes de un doctor
 @userRouter.get("/doctors/{doctor_id}/patients", response_model=list[userResponseSchema], tags=["users"], status_code=200)
-async def get_doctor_patients(doctor_id: int, db: Session = Depends(get_db)):
-    doctor = db.query(User).filter(User.id == doctor_id, User.role == 'doctor').first()
+async def get_doctor_patients(doctor_id: int, db: AsyncSession = Depends(get_async_db)):
+    doctor = await db.scalar(select(User).where(User.id == doctor_id, User.role == 'doctor'))
     if not doctor:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Doctor no encontrado")
 
     # Obtener pacientes a través de la tabla DoctorPatient
-    patient_relations = db.query(DoctorPatient).filter(DoctorPatient.doctor_id == doctor_id).all()
+    patient_relations = (await db.scalars(select(DoctorPatient).where(DoctorPatient.doctor_id == doctor_id))).all()
     patient_ids = [relation.patient_id for relation in patient_relations]
-    patients = db.query(User).filter(User.id.in_(patient_ids), User.role == 'patient').all()
+    patients = (await db.scalars(select(User).where(User.id.in_(patient_ids), User.role == 'patient'))).all()
     
     return patients
 
 # Ruta para obtener los doctores de un paciente
 @userRouter.get("/patients/{patient_id}/doctors", response_model=list[userResponseSchema], tags=["users"], status_code=200)
-async def get_patient_doctors(patient_id: int, db: Session = Depends(get_db)):
-    patient = db.query(User).filter(User.id == patient_id, User.role == 'patient').first()
+async def get_patient_doctors(patient_id: int, db: AsyncSession = Depends(get_async_db)):
+    patient = await db.scalar(select(User).where(User.id == patient_id, User.role == 'patient'))
     if not patient:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Paciente no encontrado")
     # Obtener doctores a través de la tabla DoctorPatient
-    doctor_relations = db.query(DoctorPatient).filter(DoctorPatient.patient_id == patient_id).all()
+    doctor_relations = (await db.scalars(select(DoctorPatient).where(DoctorPatient.patient_id == patient_id))).all()
     doctor_ids = [relation.doctor_id for relation in doctor_relations]
-    doctors = db.query(User).filter(User.id.in_(doctor_ids), User.role == 'doctor').all()
+    doctors = (await db.scalars(select(User).where(User.id.in_(doctor_ids), User.role == 'doctor'))).all()
     return doctors
 
 # Ruta para obtener todos los doctores
 @userRouter.get("/doctors", response_model=list[userResponseSchema], tags=["users"], status_code=200)
-async def get_doctors(db: Session = Depends(get_db)):
-    doctors = db.query(User).filter(User.role == 'doctor', User.deleted.is_(None)).all()
+async def get_doctors(db: AsyncSession = Depends(get_async_db)):
+    doctors = (await db.scalars(select(User).where(User.role == 'doctor', User.deleted.is_(None)))).all()
     return doctors
 
 # Ruta para registrar a un nuevo usuario(paciente) como doctor y añadirlo automaticamente a su lista de pacientes
 @userRouter.post("/doctors/{doctor_id}/register/patient", response_model=userResponseSchema, tags=["users"], status_code=201)
-async def register_patient_as_doctor(user: userCreateSchema, doctor_id: int, db: Session = Depends(get_db)):
+async def register_patient_as_doctor(user: userCreateSchema, doctor_id: int, db: AsyncSession = Depends(get_async_db)):
     # Usamos la funcino para crear un nuevo usuario
     newUser = await create_user(user, db)
     # Añadir el nuevo paciente a la lista de pacientes del doctor
-    doctor = db.query(User).filter(User.id == doctor_id, User.role == 'doctor').first()
+    doctor = await db.scalar(select(User).where(User.id == doctor_id, User.role == 'doctor'))
     if not doctor:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Doctor no encontrado")
     new_relation = DoctorPatient(doctor_id=doctor_id, patient_id=newUser.id)
     db.add(new_relation)
-    db.commit()
-    db.refresh(new_relation)
+    await db.commit()
+    await db.refresh(new_relation)
     return newUser
     
     
 # Ruta para eliminar un paciente de un doctor
 @userRouter.delete("/doctors/{doctor_id}/patients/{patient_id}", status_code=204, tags=["users"])
-async def remove_patient_from_doctor(doctor_id: int, patient_id: int, db: Session = Depends(get_db)):
-    doctor = db.query(User).filter(User.id == doctor_id, User.role == 'doctor').first()
+async def remove_patient_from_doctor(doctor_id: int, patient_id: int, db: AsyncSession = Depends(get_async_db)):
+    doctor = await db.scalar(select(User).where(User.id == doctor_id, User.role == 'doctor'))
     if not doctor:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Doctor no encontrado")
 
-    patient = db.query(User).filter(User.id == patient_id, User.role == 'patient').first()
+    patient = await db.scalar(select(User).where(User.id == patient_id, User.role == 'patient'))
     if not patient:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Paciente no encontrado")
     
     # Eliminar la relación entre el doctor y el paciente
-    relation = db.query(DoctorPatient).filter(
+    relation = await db.scalar(select(DoctorPatient).where(
         DoctorPatient.doctor_id == doctor_id,
         DoctorPatient.patient_id == patient_id
-    ).first()
+    ))
     
     if not relation:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="La relación entre el doctor y el paciente no existe")
     
-    db.delete(relation)
-    db.commit()
+    await db.delete(relation)
+    await db.commit()
     
     return {"detail": "Paciente eliminado del doctor exitosamente"}
 
 # Get user by email
 @userRouter.get("/users/email/{email}", response_model=userResponseSchema, tags=["users"], status_code=200)
-async def get_user_by_email(email: str, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.email == email).first()
+async def get_user_by_email(email: str, db: AsyncSession = Depends(get_async_db)):
+    user = await db.scalar(select(User).where(User.email == email))
     if not user:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Usuario no encontrado")
     return user
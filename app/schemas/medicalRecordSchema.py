@@ -19,6 +19,8 @@ class medicalRecordSchema(BaseModel):
     
 class medicalRecordResponseSchema(medicalRecordSchema):
     id: int
+    systolic: Optional[float] = None
+    diastolic: Optional[float] = None
     created_at: datetime
     updated_at: datetime
     deleted: Optional[datetime] = None
@@ -1,8 +1,12 @@
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 import os
+import time
 from dotenv import load_dotenv
+from app.shared.config.metrics import DB_POOL_WAIT_SECONDS, observar_pool
 
 # Cargar variables de entorno desde el archivo .env
 load_dotenv()
@@ -27,11 +31,45 @@ except Exception as e:
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base() 
+observar_pool(engine)
+
+# Engine async para las rutas de la API (asyncpg en PostgreSQL, aiosqlite en desarrollo).
+# El engine síncrono sigue para el ciclo de agregación, los scripts y los hilos de trabajo.
+DRIVERS_ASYNC = {"postgresql": "postgresql+asyncpg", "sqlite": "sqlite+aiosqlite"}
+DB_ASYNC_POOL_SIZE = int(os.getenv("DB_ASYNC_POOL_SIZE", "20"))
+DB_ASYNC_MAX_OVERFLOW = int(os.getenv("DB_ASYNC_MAX_OVERFLOW", "80"))
+
+
+def crear_async_engine(url):
+    """Engine async sobre la misma base de datos que el engine síncrono"""
+    url = make_url(url)
+    url = url.set(drivername=DRIVERS_ASYNC.get(url.get_backend_name(), url.drivername))
+    opciones = {}
+    if url.get_backend_name() != "sqlite":
+        opciones = {"pool_size": DB_ASYNC_POOL_SIZE, "max_overflow": DB_ASYNC_MAX_OVERFLOW, "pool_pre_ping": True}
+    return create_async_engine(url, **opciones)
+
+
+async_engine = crear_async_engine(engine.url)
+# expire_on_commit=False: tras el commit los objetos se siguen leyendo sin ir a la base
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
 
 
 def get_db():
     db = SessionLocal()
     try:
+        # Tomar la conexión ahora para medir la espera del pool
+        inicio = time.perf_counter()
+        db.connection()
+        DB_POOL_WAIT_SECONDS.observe(time.perf_counter() - inicio)
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        inicio = time.perf_counter()
+        await db.connection()
+        DB_POOL_WAIT_SECONDS.observe(time.perf_counter() - inicio)
+        yield db
@@ -0,0 +1,81 @@
+from fastapi import Response
+from prometheus_client import Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, generate_latest
+
+# Métricas de Prometheus compartidas por main.py y websocket.py (cada proceso expone las suyas en /metrics).
+# Con INGEST_WORKERS > 0 los buffers y expedientes se miden dentro de los workers y no aparecen aquí.
+
+# Ingesta
+MESSAGES_CONSUMED = Counter(
+    "smartvitals_messages_consumed_total", "Mensajes consumidos de RabbitMQ", ["topic"]
+)
+MESSAGE_QUEUE_DEPTH = Gauge(
+    "smartvitals_message_queue_depth", "Mensajes pendientes en message_queue del websocket"
+)
+UNACKED_DELIVERIES = Gauge(
+    "smartvitals_unacked_deliveries", "Entregas de RabbitMQ esperando el commit de sus muestras"
+)
+BUFFER_PATIENTS = Gauge("smartvitals_buffer_patients", "Pacientes con ventana abierta en data_buffer")
+BUFFER_SAMPLES = Gauge("smartvitals_buffer_samples", "Muestras acumuladas en data_buffer")
+
+# Agregación y escritura
+WINDOW_CLOSE_SECONDS = Histogram(
+    "smartvitals_window_close_seconds", "Duración del cierre de un lote de ventanas de agregación",
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+WINDOW_CLOSE_DELAY_SECONDS = Histogram(
+    "smartvitals_window_close_delay_seconds", "Retraso entre la hora programada de cierre y el cierre real",
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+MEDICAL_RECORD_COMMIT_SECONDS = Histogram(
+    "smartvitals_medical_record_commit_seconds", "Duración del INSERT y commit de expedientes agregados",
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+SENSOR_WRITER_FLUSH_SECONDS = Histogram(
+    "smartvitals_sensor_writer_flush_seconds", "Duración de cada escritura en lote de datos crudos",
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+SENSOR_WRITER_PENDING = Gauge(
+    "smartvitals_sensor_writer_pending_rows", "Filas crudas esperando al escritor en lote"
+)
+
+# WebSocket
+WS_CONNECTIONS = Gauge("smartvitals_ws_connections", "WebSockets conectados a este worker")
+WS_SEND_SECONDS = Histogram(
+    "smartvitals_ws_send_seconds", "Duración de cada envío a un WebSocket",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1),
+)
+WS_DROPPED = Counter("smartvitals_ws_dropped_total", "Frames descartados o coalescidos por cola llena", ["reason"])
+
+# Base de datos
+DB_POOL_WAIT_SECONDS = Histogram(
+    "smartvitals_db_pool_wait_seconds", "Espera para obtener una conexión del pool en cada request",
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5),
+)
+DB_POOL_CHECKED_OUT = Gauge("smartvitals_db_pool_checked_out", "Conexiones del pool en uso")
+REQUEST_SQL_STATEMENTS = Histogram(
+    "smartvitals_request_sql_statements", "Sentencias SQL ejecutadas por request", ["route"],
+    buckets=(0, 1, 2, 3, 5, 10, 25, 50, 100, 250),
+)
+REQUEST_DB_SECONDS = Histogram(
+    "smartvitals_request_db_seconds", "Tiempo en la base de datos por request", ["route"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+
+# Caché de estadísticas
+STATS_CACHE_REQUESTS = Counter(
+    "smartvitals_stats_cache_requests_total", "Consultas a la caché de estadísticas", ["result"]
+)
+STATS_CACHE_INVALIDATIONS = Counter(
+    "smartvitals_stats_cache_invalidations_total", "Invalidaciones de estadísticas por cambios en expedientes"
+)
+
+
+def observar_pool(engine):
+    """Expone las conexiones en uso del pool del engine (si el pool lo soporta)"""
+    checkedout = getattr(engine.pool, "checkedout", None)
+    if checkedout is not None:
+        DB_POOL_CHECKED_OUT.set_function(checkedout)
+
+
+def metrics_response():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,201 @@
+"""
+Perfilado de SQL por request: cuántas sentencias, cuánto tiempo en la base de datos y
+cuánto tiempo total. Se alimenta de los eventos del engine de SQLAlchemy, así que
+cuenta también las cargas perezosas (lazy load) que disparan los response models.
+
+Los requests que superan los umbrales se registran en el log y en `solicitudes_lentas`
+con las huellas de sus sentencias (SQL sin literales); una misma huella repetida muchas
+veces en un request es la marca de un patrón N+1.
+"""
+import os
+import re
+import sys
+import time
+import random
+import logging
+import threading
+from collections import Counter, deque
+from contextvars import ContextVar
+from functools import lru_cache
+from sqlalchemy import event
+from app.shared.config.metrics import REQUEST_SQL_STATEMENTS, REQUEST_DB_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Umbrales para considerar lento un request
+SLOW_REQUEST_MS = float(os.getenv('SLOW_REQUEST_MS', '500'))
+SLOW_REQUEST_QUERIES = int(os.getenv('SLOW_REQUEST_QUERIES', '25'))
+# Fracción de requests perfilados con el muestreador de pila (0 = desactivado)
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_INTERVAL_MS = float(os.getenv('PROFILE_INTERVAL_MS', '5'))
+
+_RAIZ_PROYECTO = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+# Últimos requests lentos, para consultarlos sin revisar el log
+solicitudes_lentas = deque(maxlen=int(os.getenv('SLOW_REQUEST_HISTORY', '100')))
+
+_perfil_actual = ContextVar("perfil_sql", default=None)
+
+
+class PerfilRequest:
+    """Acumulado de un request; las sentencias pueden venir de varios hilos"""
+
+    __slots__ = ("statements", "db_seconds", "huellas", "hilos", "muestras")
+
+    def __init__(self):
+        self.statements = 0
+        self.db_seconds = 0.0
+        self.huellas = Counter()
+        self.hilos = {threading.get_ident()}
+        self.muestras = None
+
+
+_LITERALES = [
+    (re.compile(r"'(?:[^']|'')*'"), "?"),
+    (re.compile(r"%\(\w+\)s|:\w+|\$\d+|%s"), "?"),
+    (re.compile(r"\b\d+(?:\.\d+)?\b"), "?"),
+    (re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)"), "(?...)"),
+    (re.compile(r"\s+"), " "),
+]
+
+
+@lru_cache(maxsize=2048)
+def huella(statement):
+    """SQL normalizado (sin literales ni parámetros) para agrupar sentencias iguales"""
+    for patron, reemplazo in _LITERALES:
+        statement = patron.sub(reemplazo, statement)
+    return statement.strip()[:300]
+
+
+def _antes(conn, cursor, statement, parameters, context, executemany):
+    # En el contexto de ejecución y no en la conexión: una sentencia que falla no dispara
+    # after_cursor_execute y su inicio se descarta junto con el contexto
+    if context is not None:
+        context._perfil_inicio = time.perf_counter()
+
+
+def _despues(conn, cursor, statement, parameters, context, executemany):
+    perfil = _perfil_actual.get()
+    inicio = getattr(context, "_perfil_inicio", None)
+    if perfil is None or inicio is None:
+        return
+    perfil.statements += 1
+    perfil.db_seconds += time.perf_counter() - inicio
+    perfil.huellas[huella(statement)] += 1
+    perfil.hilos.add(threading.get_ident())
+
+
+def instrumentar_engine(engine):
+    """Registra los eventos de SQLAlchemy que alimentan el perfil del request en curso"""
+    if not event.contains(engine, "before_cursor_execute", _antes):
+        event.listen(engine, "before_cursor_execute", _antes)
+        event.listen(engine, "after_cursor_execute", _despues)
+
+
+class MuestreadorPila(threading.Thread):
+    """Muestreador estadístico: cada PROFILE_INTERVAL_MS toma la pila de los hilos del
+    request y cuenta la función del proyecto más interna en ejecución"""
+
+    def __init__(self, perfil):
+        super().__init__(daemon=True)
+        self.perfil = perfil
+        self.muestras = Counter()
+        self._detener = threading.Event()
+
+    def run(self):
+        while not self._detener.wait(PROFILE_INTERVAL_MS / 1000):
+            frames = sys._current_frames()
+            for ident in list(self.perfil.hilos):
+                frame = frames.get(ident)
+                if frame is not None:
+                    self.muestras[self._ubicacion(frame)] += 1
+
+    @staticmethod
+    def _ubicacion(frame):
+        interna = frame
+        while frame is not None:
+            if frame.f_code.co_filename.startswith(_RAIZ_PROYECTO):
+                interna = frame
+                break
+            frame = frame.f_back
+        codigo = interna.f_code
+        archivo = codigo.co_filename
+        archivo = os.path.relpath(archivo, _RAIZ_PROYECTO) if archivo.startswith(_RAIZ_PROYECTO) else os.path.basename(archivo)
+        return f"{archivo}:{interna.f_lineno} {codigo.co_name}"
+
+    def detener(self):
+        self._detener.set()
+        self.join()
+        return self.muestras.most_common(15)
+
+
+class QueryProfilerMiddleware:
+    """Middleware ASGI que mide cada request y agrega el encabezado Server-Timing"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        perfil = PerfilRequest()
+        token = _perfil_actual.set(perfil)
+        muestreador = None
+        if PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE:
+            muestreador = MuestreadorPila(perfil)
+            muestreador.start()
+        inicio = time.perf_counter()
+        estado = {"status": 500}
+
+        async def send_con_tiempos(message):
+            if message["type"] == "http.response.start":
+                estado["status"] = message["status"]
+                app_ms = (time.perf_counter() - inicio) * 1000
+                headers = list(message.get("headers", []))
+                headers.append((
+                    b"server-timing",
+                    f"db;dur={perfil.db_seconds * 1000:.1f};desc=\"{perfil.statements} queries\", app;dur={app_ms:.1f}".encode()
+                ))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_con_tiempos)
+        finally:
+            _perfil_actual.reset(token)
+            if muestreador is not None:
+                perfil.muestras = muestreador.detener()
+            self._registrar(scope, estado["status"], perfil, time.perf_counter() - inicio)
+
+    def _registrar(self, scope, status, perfil, segundos):
+        # Plantilla de la ruta (no el path concreto) para no multiplicar las series de métricas
+        ruta = getattr(scope.get("route"), "path", None) or "sin_ruta"
+        REQUEST_SQL_STATEMENTS.labels(ruta).observe(perfil.statements)
+        REQUEST_DB_SECONDS.labels(ruta).observe(perfil.db_seconds)
+
+        lento = segundos * 1000 >= SLOW_REQUEST_MS or perfil.statements >= SLOW_REQUEST_QUERIES
+        if not lento and perfil.muestras is None:
+            return
+        resumen = {
+            "method": scope.get("method"),
+            "route": ruta,
+            "path": scope.get("path"),
+            "status": status,
+            "wall_ms": round(segundos * 1000, 1),
+            "db_ms": round(perfil.db_seconds * 1000, 1),
+            "statements": perfil.statements,
+            "fingerprints": [
+                {"count": count, "sql": sql} for sql, count in perfil.huellas.most_common(10)
+            ],
+            "profile": [{"samples": n, "at": ubicacion} for ubicacion, n in perfil.muestras or []],
+            "timestamp": time.time(),
+        }
+        solicitudes_lentas.append(resumen)
+        repetidas = [f"{f['count']}x {f['sql'][:120]}" for f in resumen["fingerprints"] if f["count"] > 1]
+        logger.warning(
+            f"Request lento {resumen['method']} {resumen['path']}: {resumen['wall_ms']}ms, "
+            f"{perfil.statements} queries en {resumen['db_ms']}ms"
+            + (f"; repetidas: {' | '.join(repetidas[:3])}" if repetidas else "")
+        )
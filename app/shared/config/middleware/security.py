@@ -4,9 +4,11 @@ load_dotenv()
 from passlib.context import CryptContext
 from jose import jwt, JWTError
 from datetime import datetime, timedelta
-from fastapi import HTTPException, status
+from fastapi import Depends, HTTPException, status
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.models.user import User
-from app.shared.config.database import get_db
+from app.shared.config.database import get_async_db
 
 SECRET_KEY = os.getenv('SECRET_KEY')
 if not SECRET_KEY:
@@ -34,7 +36,7 @@ def create_access_token(data: dict, expires_delta=None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def get_current_user(token: str):
+async def get_current_user(token: str, db: AsyncSession = Depends(get_async_db)):
     """Obtiene el usuario actual a partir del token JWT proporcionado."""
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -49,8 +51,7 @@ def get_current_user(token: str):
     except JWTError:
         raise credentials_exception
 
-    db = next(get_db())
-    user = db.query(User).filter(User.email == email).first()
+    user = await db.scalar(select(User).where(User.email == email))
     if user is None:
         raise credentials_exception
     return user
@@ -0,0 +1,72 @@
+import os
+import asyncio
+import logging
+import aio_pika
+from dotenv import load_dotenv
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# Configuración de RabbitMQ
+RABBITMQ_HOST = os.getenv('RABBITMQ_HOST')
+RABBITMQ_USER = os.getenv('RABBITMQ_USER')
+RABBITMQ_PASSWORD = os.getenv('RABBITMQ_PASSWORD')
+RABBITMQ_PORT = int(os.getenv('RABBITMQ_PORT') or 5672)
+RABBITMQ_VIRTUAL_HOST = os.getenv('RABBITMQ_VIRTUAL_HOST', '/')
+EXCHANGE = 'amq.topic'
+TOPICS = ['temperatura', 'oxigeno', 'presion', 'ritmo_cardiaco', 'sensor', 'ecg']
+
+# Mensajes sin confirmar que el broker puede entregar a la vez. Como solo se confirman
+# tras el commit del escritor, debe cubrir al menos un intervalo de escritura de mensajes
+RABBITMQ_PREFETCH_COUNT = int(os.getenv('RABBITMQ_PREFETCH_COUNT', '2000'))
+# Confirmación en lote: cada cuántos mensajes o cuántos segundos se envía el ack acumulado
+RABBITMQ_ACK_BATCH_SIZE = int(os.getenv('RABBITMQ_ACK_BATCH_SIZE', '50'))
+RABBITMQ_ACK_INTERVAL = float(os.getenv('RABBITMQ_ACK_INTERVAL', '0.5'))
+# Reintentos de conexión con espera exponencial
+RABBITMQ_RECONNECT_MIN_DELAY = float(os.getenv('RABBITMQ_RECONNECT_MIN_DELAY', '1'))
+RABBITMQ_RECONNECT_MAX_DELAY = float(os.getenv('RABBITMQ_RECONNECT_MAX_DELAY', '60'))
+
+
+# Pool del publicador de configuración
+RABBITMQ_PUBLISHER_CONNECTIONS = int(os.getenv('RABBITMQ_PUBLISHER_CONNECTIONS', '2'))
+RABBITMQ_PUBLISHER_CHANNELS = int(os.getenv('RABBITMQ_PUBLISHER_CHANNELS', '10'))
+RABBITMQ_PUBLISH_TIMEOUT = float(os.getenv('RABBITMQ_PUBLISH_TIMEOUT', '5'))
+
+
+async def connect(robust=False):
+    """Abre una conexión asíncrona a RabbitMQ; `robust` reconecta sola al perderse"""
+    connect_fn = aio_pika.connect_robust if robust else aio_pika.connect
+    return await connect_fn(
+        host=RABBITMQ_HOST,
+        port=RABBITMQ_PORT,
+        login=RABBITMQ_USER,
+        password=RABBITMQ_PASSWORD,
+        virtualhost=RABBITMQ_VIRTUAL_HOST,
+        heartbeat=600,
+    )
+
+
+async def declare_topic_queues(channel, topics=TOPICS):
+    """Declara el exchange de sensores y enlaza una cola durable por topic"""
+    exchange = await channel.declare_exchange(EXCHANGE, aio_pika.ExchangeType.TOPIC, durable=True)
+    queues = {}
+    for topic in topics:
+        queue = await channel.declare_queue(topic, durable=True)
+        await queue.bind(exchange, routing_key=topic)
+        queues[topic] = queue
+    return exchange, queues
+
+
+async def run_with_backoff(session, name="RabbitMQ"):
+    """Ejecuta `session()` indefinidamente, reconectando con espera exponencial si falla"""
+    delay = RABBITMQ_RECONNECT_MIN_DELAY
+    while True:
+        try:
+            await session()
+            delay = RABBITMQ_RECONNECT_MIN_DELAY
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Conexión {name} perdida: {e}. Reintentando en {delay:.0f}s")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, RABBITMQ_RECONNECT_MAX_DELAY)
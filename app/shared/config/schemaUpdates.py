@@ -0,0 +1,108 @@
+"""
+Columnas numéricas systolic/diastolic de medical_record y record_sensor_data.
+
+create_all no agrega columnas a tablas existentes. Al arrancar, la API y el websocket
+solo revisan el catálogo y agregan las columnas que falten; el relleno de los registros
+anteriores corre una sola vez, cuando se agrega una columna. Para repetirlo a mano
+(p. ej. si se interrumpió):
+
+    python -m app.shared.config.schemaUpdates --backfill
+"""
+import argparse
+import logging
+
+from sqlalchemy import inspect, text
+
+from app.shared.utils.riskService import split_blood_pressure
+
+logger = logging.getLogger(__name__)
+
+_TABLAS = ("medical_record", "record_sensor_data")
+_COLUMNAS = ("systolic", "diastolic")
+
+# Rellena las columnas numéricas de los expedientes existentes a partir de "sis/dia"
+_BACKFILL_MEDICAL_RECORD = r"""
+    UPDATE medical_record
+    SET systolic = substring(blood_pressure from '^\s*(\d+(?:\.\d+)?)')::double precision,
+        diastolic = substring(blood_pressure from '^\s*\d+(?:\.\d+)?\s*/\s*(\d+(?:\.\d+)?)')::double precision
+    WHERE systolic IS NULL AND blood_pressure ~ '^\s*\d'
+"""
+
+_BACKFILL_RECORD_SENSOR_DATA = """
+    UPDATE record_sensor_data
+    SET systolic = blood_pressure
+    WHERE systolic IS NULL AND blood_pressure IS NOT NULL
+"""
+
+
+def _agregar_columnas(connection):
+    """Agrega las columnas que falten; devuelve True si agregó alguna"""
+    inspector = inspect(connection)
+    postgresql = connection.dialect.name == "postgresql"
+    agregadas = False
+    for tabla in _TABLAS:
+        if not inspector.has_table(tabla):
+            continue  # La crea create_all, ya con las columnas
+        existentes = {columna["name"] for columna in inspector.get_columns(tabla)}
+        for columna in _COLUMNAS:
+            if columna in existentes:
+                continue
+            # IF NOT EXISTS por si otro proceso la agrega al mismo tiempo
+            if postgresql:
+                connection.execute(text(f"ALTER TABLE {tabla} ADD COLUMN IF NOT EXISTS {columna} DOUBLE PRECISION"))
+            else:
+                connection.execute(text(f"ALTER TABLE {tabla} ADD COLUMN {columna} FLOAT"))
+            agregadas = True
+    return agregadas
+
+
+def _rellenar(connection):
+    """Rellena systolic/diastolic de los registros anteriores (idempotente)"""
+    inspector = inspect(connection)
+    if connection.dialect.name == "postgresql":
+        if inspector.has_table("medical_record"):
+            connection.execute(text(_BACKFILL_MEDICAL_RECORD))
+    elif inspector.has_table("medical_record"):
+        # Sin regex en SQL: el texto "sis/dia" se interpreta con el parser de la ingesta
+        pendientes = connection.execute(text(
+            "SELECT id, blood_pressure FROM medical_record WHERE systolic IS NULL AND blood_pressure IS NOT NULL"
+        )).all()
+        valores = []
+        for record_id, blood_pressure in pendientes:
+            parts = split_blood_pressure(blood_pressure)
+            if parts:
+                valores.append({"record_id": record_id, "systolic": parts[0], "diastolic": parts[1]})
+        if valores:
+            connection.execute(
+                text("UPDATE medical_record SET systolic = :systolic, diastolic = :diastolic WHERE id = :record_id"),
+                valores,
+            )
+    if inspector.has_table("record_sensor_data"):
+        connection.execute(text(_BACKFILL_RECORD_SENSOR_DATA))
+
+
+def ensure_blood_pressure_columns(engine):
+    """Agrega las columnas systolic/diastolic si faltan y, solo entonces, rellena los
+    registros anteriores; con las columnas ya presentes solo consulta el catálogo"""
+    with engine.begin() as connection:
+        if not _agregar_columnas(connection):
+            return
+        logger.info("Columnas systolic/diastolic agregadas; rellenando los registros anteriores")
+        _rellenar(connection)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Columnas numéricas de presión arterial")
+    parser.add_argument("--backfill", action="store_true", help="Vuelve a rellenar los registros con systolic nulo")
+    args = parser.parse_args()
+
+    from app.shared.config.database import engine
+    ensure_blood_pressure_columns(engine)
+    if args.backfill:
+        with engine.begin() as connection:
+            _rellenar(connection)
+        print("Columnas systolic/diastolic rellenadas")
+
+
+if __name__ == "__main__":
+    main()
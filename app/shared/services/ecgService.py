@@ -0,0 +1,103 @@
+import os
+import json
+import struct
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Frecuencia de muestreo asumida si el dispositivo no la informa (Hz)
+ECG_DEFAULT_SAMPLE_RATE = float(os.getenv('ECG_DEFAULT_SAMPLE_RATE', '250'))
+# Frecuencia de visualización por defecto de un suscriptor (Hz)
+ECG_DEFAULT_DISPLAY_RATE = float(os.getenv('ECG_DEFAULT_DISPLAY_RATE', '125'))
+
+# Chunk binario del dispositivo: patient_id, sample_rate, timestamp de la primera muestra,
+# seguido de las muestras en float32 little-endian
+ECG_CHUNK_HEADER = struct.Struct("<Ifd")
+
+# Frame binario hacia el cliente:
+# formato, patient_id, sample_rate efectiva, timestamp inicial, escala, número de muestras.
+# Con int16 el valor real es muestra * escala; con float32 la escala es 1.
+ECG_FRAME_HEADER = struct.Struct("<BIfdfI")
+FORMATO_FLOAT32 = 1
+FORMATO_INT16 = 2
+FORMATOS = {"float32": FORMATO_FLOAT32, "int16": FORMATO_INT16}
+
+# Desfase de decimación por (patient_id, factor) para que los chunks se unan sin saltos;
+# todos los suscriptores con el mismo factor comparten las mismas muestras
+_fases = {}
+
+
+def parse_chunk(body):
+    """Decodifica un chunk de ECG (JSON o binario) en (patient_id, sample_rate, timestamp, muestras)"""
+    if body[:1] == b"{":
+        data = json.loads(body)
+        return (
+            int(data["patient_id"]),
+            float(data.get("sample_rate") or ECG_DEFAULT_SAMPLE_RATE),
+            float(data.get("timestamp") or 0.0),
+            np.asarray(data.get("samples", []), dtype=np.float32),
+        )
+    patient_id, sample_rate, timestamp = ECG_CHUNK_HEADER.unpack_from(body)
+    muestras = np.frombuffer(body, dtype="<f4", offset=ECG_CHUNK_HEADER.size)
+    return patient_id, sample_rate or ECG_DEFAULT_SAMPLE_RATE, timestamp, muestras
+
+
+def factor_decimacion(sample_rate, display_rate):
+    """Cada cuántas muestras se conserva una para no superar la frecuencia pedida"""
+    if not display_rate or display_rate >= sample_rate:
+        return 1
+    return max(1, int(round(sample_rate / display_rate)))
+
+
+def decimar(patient_id, muestras, factor):
+    """Toma una de cada `factor` muestras continuando la fase del chunk anterior.
+
+    Devuelve también el índice de la primera muestra conservada.
+    """
+    if factor == 1:
+        return muestras, 0
+    inicio = _fases.get((patient_id, factor), 0)
+    _fases[(patient_id, factor)] = (inicio - len(muestras)) % factor
+    return muestras[inicio::factor], inicio
+
+
+def codificar(patient_id, sample_rate, timestamp, muestras, formato):
+    """Empaqueta las muestras en un frame binario float32 o int16 escalado"""
+    if formato == FORMATO_INT16:
+        pico = float(np.max(np.abs(muestras))) if len(muestras) else 0.0
+        escala = pico / 32767 if pico else 1.0
+        datos = np.round(muestras / escala).astype("<i2")
+    else:
+        escala = 1.0
+        datos = muestras.astype("<f4", copy=False)
+    cabecera = ECG_FRAME_HEADER.pack(formato, patient_id, sample_rate, timestamp, escala, len(datos))
+    return cabecera + datos.tobytes()
+
+
+def frames_para_suscriptores(patient_id, sample_rate, timestamp, muestras, suscriptores):
+    """Genera un frame por cada suscriptor de un chunk de ECG.
+
+    `suscriptores` es {destino: (display_rate, formato)}. Cada combinación distinta de
+    factor de decimación y formato se codifica una sola vez y se comparte.
+    """
+    codificados = {}
+    frames = []
+    for destino, (display_rate, formato) in suscriptores.items():
+        factor = factor_decimacion(sample_rate, display_rate)
+        clave = (factor, formato)
+        if clave not in codificados:
+            if (factor, None) not in codificados:
+                codificados[(factor, None)] = decimar(patient_id, muestras, factor)
+            decimadas, inicio = codificados[(factor, None)]
+            codificados[clave] = codificar(
+                patient_id, sample_rate / factor, timestamp + inicio / sample_rate, decimadas, formato
+            )
+        frames.append((destino, codificados[clave]))
+    return frames
+
+
+def olvidar_paciente(patient_id):
+    """Descarta el estado de decimación de un paciente sin suscriptores"""
+    for clave in [clave for clave in _fases if clave[0] == patient_id]:
+        del _fases[clave]
@@ -0,0 +1,92 @@
+import os
+import json
+import uuid
+import logging
+import aio_pika
+from app.shared.config.rabbitmq import connect
+
+logger = logging.getLogger(__name__)
+
+# "local" para un solo worker; "rabbitmq" para repartir mensajes entre varios workers/hosts
+FANOUT_BUS = os.getenv('FANOUT_BUS', 'local')
+FANOUT_EXCHANGE = os.getenv('FANOUT_EXCHANGE', 'smartvitals.fanout')
+
+# Identificador de este worker (para los logs y el diagnóstico)
+WORKER_ID = uuid.uuid4().hex[:8]
+
+
+class InProcessBus:
+    """Bus dentro del mismo proceso: entrega directamente al handler, sin serializar"""
+
+    def __init__(self):
+        self._handler = None
+
+    async def start(self, handler):
+        self._handler = handler
+
+    async def publish(self, kind, payload):
+        if self._handler is not None:
+            self._handler(kind, payload)
+
+    async def close(self):
+        self._handler = None
+
+
+class RabbitMQBus:
+    """Bus sobre un exchange fanout: cada worker tiene su propia cola exclusiva y recibe
+    todo lo publicado por cualquier worker (incluido él mismo).
+
+    `connect_fn` permite usar un broker local o un doble de prueba en lugar del real.
+    """
+
+    def __init__(self, exchange_name=FANOUT_EXCHANGE, connect_fn=connect):
+        self.exchange_name = exchange_name
+        self._connect = connect_fn
+        self._connection = None
+        self._exchange = None
+        self._handler = None
+
+    async def start(self, handler):
+        self._handler = handler
+        self._connection = await self._connect(robust=True)
+        channel = await self._connection.channel()
+        self._exchange = await channel.declare_exchange(self.exchange_name, aio_pika.ExchangeType.FANOUT)
+        queue = await channel.declare_queue(exclusive=True, auto_delete=True)
+        await queue.bind(self._exchange)
+        await queue.consume(self._on_message, no_ack=True)
+        logger.info(f"Bus de fan-out conectado: exchange={self.exchange_name}, worker={WORKER_ID}")
+
+    async def _on_message(self, message):
+        kind = message.headers.get("kind")
+        if message.content_type == "application/octet-stream":
+            payload = message.body
+        else:
+            payload = json.loads(message.body)
+        try:
+            self._handler(kind, payload)
+        except Exception as e:
+            logger.error(f"Error procesando mensaje del bus ({kind}): {e}")
+
+    async def publish(self, kind, payload):
+        if isinstance(payload, bytes):
+            body, content_type = payload, "application/octet-stream"
+        else:
+            body, content_type = json.dumps(payload).encode(), "application/json"
+        await self._exchange.publish(
+            aio_pika.Message(body, content_type=content_type, headers={"kind": kind, "origin": WORKER_ID}),
+            routing_key="",
+        )
+
+    async def close(self):
+        if self._connection is not None:
+            await self._connection.close()
+            self._connection = None
+
+
+def crear_bus(tipo=FANOUT_BUS):
+    """Crea el bus configurado en FANOUT_BUS"""
+    if tipo == "rabbitmq":
+        return RabbitMQBus()
+    if tipo != "local":
+        logger.warning(f"FANOUT_BUS desconocido '{tipo}', se usa el bus local")
+    return InProcessBus()
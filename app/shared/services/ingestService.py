@@ -0,0 +1,138 @@
+import os
+import re
+import threading
+import logging
+import multiprocessing
+
+logger = logging.getLogger(__name__)
+
+# Si este worker del websocket consume los topics de sensores y acumula los buffers.
+# Activo por defecto; las réplicas adicionales (solo conexiones) lo apagan con
+# INGEST_ENABLED=false para no consumir y agregar las mismas muestras.
+INGEST_ENABLED = os.getenv('INGEST_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+
+# Número de procesos de ingesta; 0 procesa los mensajes dentro del proceso del websocket
+INGEST_WORKERS = int(os.getenv('INGEST_WORKERS', '0'))
+
+# Extrae el patient_id sin decodificar todo el JSON en el proceso principal
+_PATIENT_ID_RE = re.compile(rb'"patient_id"\s*:\s*"?(\d+)')
+
+# Estado del pool (solo en el proceso del websocket)
+_ctx = multiprocessing.get_context("spawn")
+_workers = []
+_entradas = []
+_salida = None
+_lector = None
+
+
+def shard_for(patient_id, n_shards):
+    """Worker responsable de un paciente; siempre el mismo para conservar el orden"""
+    try:
+        return int(patient_id) % n_shards
+    except (TypeError, ValueError):
+        return 0
+
+
+def patient_id_from_body(body):
+    match = _PATIENT_ID_RE.search(body)
+    return int(match.group(1)) if match else None
+
+
+def _worker_main(entrada, salida):
+    """Bucle de cada worker: procesa sus pacientes y reenvía los resultados al websocket"""
+    # Con 'spawn' el import arranca los hilos de agregación y escritura propios del worker
+    from app.shared.services import sensoresService
+    from app.shared.services.sensorWriterService import flush_sensor_data, set_commit_callback, set_reject_callback
+
+    # Cada elemento de la cola de salida es un lote de (type, message, target_users, coalesce_key)
+    # o una tupla ("ack", tokens) o ("nack", tokens, reencolar)
+    sensoresService.set_notification_callback(
+        lambda message_type, message, target_users=None, coalesce_key=None: salida.put(
+            [(message_type, message, target_users, coalesce_key)]
+        ),
+        lambda mensajes: salida.put(list(mensajes))
+    )
+    # Los tokens de ack vuelven al proceso principal cuando sus filas quedan guardadas
+    set_commit_callback(lambda tokens: salida.put(("ack", tokens)))
+    set_reject_callback(lambda tokens, reencolar: salida.put(("nack", tokens, reencolar)))
+    while True:
+        item = entrada.get()
+        if item is None:
+            flush_sensor_data()
+            break
+        kind = item[0]
+        try:
+            if kind == "mensaje":
+                sensoresService.procesar_mensaje_sensor(item[1], item[2], item[3])
+            elif kind == "medicion":
+                _, patient_id, activa, window_seconds = item
+                if window_seconds is not None:
+                    sensoresService.set_aggregation_window(patient_id, window_seconds)
+                sensoresService.medicion_activa[patient_id] = activa
+        except Exception as e:
+            logger.error(f"Error en worker de ingesta: {e}")
+
+
+def _leer_resultados(callback, ack_callback, nack_callback):
+    """Hilo del proceso principal que entrega al websocket lo producido por los workers"""
+    while True:
+        resultado = _salida.get()
+        if resultado is None:
+            break
+        try:
+            if isinstance(resultado, tuple) and resultado[0] == "ack":
+                if ack_callback:
+                    ack_callback(resultado[1])
+            elif isinstance(resultado, tuple) and resultado[0] == "nack":
+                if nack_callback:
+                    nack_callback(resultado[1], resultado[2])
+            else:
+                callback(resultado)
+        except Exception as e:
+            logger.error(f"Error reenviando resultado de ingesta: {e}")
+
+
+def pool_activo():
+    return bool(_workers)
+
+
+def start_ingest_pool(callback, ack_callback=None, nack_callback=None, n_workers=INGEST_WORKERS):
+    """Arranca N procesos de ingesta; `callback(mensajes)` recibe sus resultados en lotes,
+    `ack_callback(tokens)` los tokens de los mensajes ya guardados y
+    `nack_callback(tokens, reencolar)` los de los mensajes que no se guardaron"""
+    global _salida, _lector
+    if n_workers <= 0 or _workers:
+        return
+    _salida = _ctx.Queue()
+    for _ in range(n_workers):
+        entrada = _ctx.Queue()
+        proceso = _ctx.Process(target=_worker_main, args=(entrada, _salida), daemon=True)
+        proceso.start()
+        _entradas.append(entrada)
+        _workers.append(proceso)
+    _lector = threading.Thread(target=_leer_resultados, args=(callback, ack_callback, nack_callback), daemon=True)
+    _lector.start()
+    logger.info(f"Pool de ingesta iniciado con {n_workers} procesos")
+
+
+def dispatch(topic_name, body, ack_token=None):
+    """Envía un mensaje crudo al worker dueño de su paciente"""
+    shard = shard_for(patient_id_from_body(body), len(_entradas))
+    _entradas[shard].put(("mensaje", topic_name, bytes(body), ack_token))
+
+
+def set_medicion_activa(patient_id, activa, window_seconds=None):
+    """Propaga el estado de medición al worker que acumula los datos del paciente"""
+    _entradas[shard_for(patient_id, len(_entradas))].put(("medicion", patient_id, activa, window_seconds))
+
+
+def stop_ingest_pool(timeout=10):
+    """Detiene los workers dejando que persistan sus buffers"""
+    for entrada in _entradas:
+        entrada.put(None)
+    for proceso in _workers:
+        proceso.join(timeout)
+    if _salida is not None:
+        _salida.put(None)
+    _workers.clear()
+    _entradas.clear()
@@ -0,0 +1,79 @@
+import json
+import asyncio
+import logging
+import aio_pika
+from aio_pika.pool import Pool
+from app.shared.config.rabbitmq import (
+    EXCHANGE, RABBITMQ_PUBLISHER_CONNECTIONS, RABBITMQ_PUBLISHER_CHANNELS, RABBITMQ_PUBLISH_TIMEOUT, connect
+)
+
+logger = logging.getLogger(__name__)
+
+CONFIG_ROUTING_KEY = "user_config"
+
+# Pools de larga vida; se crean en el arranque del servicio websocket
+_connection_pool = None
+_channel_pool = None
+
+
+async def _nueva_conexion():
+    return await connect(robust=True)
+
+
+async def _nuevo_canal():
+    async with _connection_pool.acquire() as connection:
+        # Con publisher confirms, cada publish espera el ack del broker
+        return await connection.channel(publisher_confirms=True)
+
+
+def start_publisher():
+    """Crea los pools de conexiones y canales (las conexiones se abren al primer uso)"""
+    global _connection_pool, _channel_pool
+    if _channel_pool is not None:
+        return
+    _connection_pool = Pool(_nueva_conexion, max_size=RABBITMQ_PUBLISHER_CONNECTIONS)
+    _channel_pool = Pool(_nuevo_canal, max_size=RABBITMQ_PUBLISHER_CHANNELS)
+
+
+async def close_publisher():
+    global _connection_pool, _channel_pool
+    if _channel_pool is not None:
+        await _channel_pool.close()
+    if _connection_pool is not None:
+        await _connection_pool.close()
+    _connection_pool = _channel_pool = None
+
+
+async def publish_config(config, routing_key=CONFIG_ROUTING_KEY):
+    """Publica la configuración de un dispositivo y espera la confirmación del broker"""
+    start_publisher()
+    message = aio_pika.Message(
+        body=json.dumps(config).encode(),
+        content_type="application/json",
+        delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
+    )
+    # El plazo cubre también esperar un canal libre (y abrir la conexión), no solo el publish
+    await asyncio.wait_for(_publicar(message, routing_key), RABBITMQ_PUBLISH_TIMEOUT)
+
+
+async def _publicar(message, routing_key):
+    async with _channel_pool.acquire() as channel:
+        exchange = await channel.get_exchange(EXCHANGE, ensure=False)
+        await exchange.publish(message, routing_key=routing_key)
+
+
+async def publish_configs(configs, routing_key=CONFIG_ROUTING_KEY):
+    """Publica muchas configuraciones a la vez (p. ej. iniciar una sala completa).
+
+    Devuelve la lista de configuraciones que el broker no confirmó.
+    """
+    resultados = await asyncio.gather(
+        *(publish_config(config, routing_key) for config in configs),
+        return_exceptions=True
+    )
+    fallidas = []
+    for config, resultado in zip(configs, resultados):
+        if isinstance(resultado, BaseException):
+            logger.error(f"Error publicando configuración {config}: {resultado!r}")
+            fallidas.append(config)
+    return fallidas
@@ -0,0 +1,240 @@
+"""
+Mantenimiento incremental de `vital_rollup` (resúmenes por paciente, hora y día).
+
+Cada expediente nuevo suma su aporte a su cubeta de hora y de día con un UPSERT
+aditivo, en la misma transacción que lo inserta. Las ediciones y borrados recalculan
+las cubetas del día afectado desde `medical_record`. Para el historial existente:
+
+    python -m app.shared.services.rollupService                 # todos los pacientes
+    python -m app.shared.services.rollupService --patient-id 7
+"""
+import argparse
+import logging
+import os
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+from sqlalchemy import delete, func, select
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+from app.models.medicalRecord import MedicalRecord
+from app.models.user import User
+from app.models.vitalRollup import VitalRollup
+from app.shared.utils.alertRules import RIESGOS_ESTADISTICAS, mascaras_riesgo_estadisticas
+from app.shared.utils.riskService import systolic_array, umbrales_fc
+
+logger = logging.getLogger(__name__)
+
+ROLLUPS_ENABLED = os.getenv('ROLLUPS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+ROLLUP_REBUILD_CHUNK = int(os.getenv('ROLLUP_REBUILD_CHUNK', '50000'))
+
+METRICAS_ROLLUP = ("temperature", "systolic", "oxygen_saturation", "heart_rate")
+# granularidad -> frecuencia de pandas para truncar created_at
+GRANULARIDADES = {"hour": "h", "day": "D"}
+RIESGOS = [nombre for nombre, _ in RIESGOS_ESTADISTICAS]
+
+_CLAVE = ("patient_id", "doctor_id", "granularity", "bucket")
+_SUMABLES = ["count"] + [f"{m}_{s}" for m in METRICAS_ROLLUP for s in ("n", "sum", "sumsq")] + RIESGOS
+_MINIMOS = ["first_at"] + [f"{m}_min" for m in METRICAS_ROLLUP]
+_MAXIMOS = ["last_at"] + [f"{m}_max" for m in METRICAS_ROLLUP]
+# Filas por sentencia de UPSERT (SQLite limita los parámetros por sentencia)
+_FILAS_POR_UPSERT = 500
+
+
+def _valor(registro, campo):
+    return registro.get(campo) if isinstance(registro, dict) else getattr(registro, campo, None)
+
+
+def _resumir(df):
+    """Filas de vital_rollup (una por paciente, doctor, granularidad y cubeta) para un lote"""
+    df["doctor_id"] = df["doctor_id"].fillna(0).astype(int)
+    for metrica in METRICAS_ROLLUP:
+        df[metrica] = df[metrica].astype(np.float64)
+        df[f"{metrica}_sq"] = df[metrica] ** 2
+    hr_min, hr_max = umbrales_fc(df["age"].to_numpy(np.float64))
+    mascaras = mascaras_riesgo_estadisticas({
+        **{metrica: df[metrica].to_numpy() for metrica in METRICAS_ROLLUP},
+        "hr_min": hr_min,
+        "hr_max": hr_max,
+    })
+    for nombre, mascara in mascaras.items():
+        df[nombre] = mascara.astype(np.int64)
+
+    agregados = {
+        "count": ("created_at", "size"),
+        "first_at": ("created_at", "min"),
+        "last_at": ("created_at", "max"),
+        **{nombre: (nombre, "sum") for nombre in RIESGOS},
+    }
+    for metrica in METRICAS_ROLLUP:
+        agregados[f"{metrica}_n"] = (metrica, "count")
+        agregados[f"{metrica}_sum"] = (metrica, "sum")
+        agregados[f"{metrica}_sumsq"] = (f"{metrica}_sq", "sum")
+        agregados[f"{metrica}_min"] = (metrica, "min")
+        agregados[f"{metrica}_max"] = (metrica, "max")
+
+    filas = []
+    for granularidad, frecuencia in GRANULARIDADES.items():
+        df["bucket"] = df["created_at"].dt.floor(frecuencia)
+        resumen = df.groupby(["patient_id", "doctor_id", "bucket"], sort=False).agg(**agregados).reset_index()
+        resumen["granularity"] = granularidad
+        for columna in ("bucket", "first_at", "last_at"):
+            resumen[columna] = pd.Series(resumen[columna].dt.to_pydatetime(), dtype=object)
+        resumen = resumen.astype(object).where(resumen.notna(), None)
+        filas.extend(resumen.to_dict("records"))
+    return filas
+
+
+def _upsert(db: Session, filas):
+    """Suma las filas a sus cubetas con INSERT ... ON CONFLICT DO UPDATE (sin leer antes)"""
+    if db.get_bind().dialect.name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        menor, mayor = func.min, func.max
+    else:
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        menor, mayor = func.least, func.greatest
+
+    tabla = VitalRollup.__table__
+    for inicio in range(0, len(filas), _FILAS_POR_UPSERT):
+        stmt = dialect_insert(tabla).values(filas[inicio:inicio + _FILAS_POR_UPSERT])
+        nuevo = stmt.excluded
+        actualizar = {c: tabla.c[c] + nuevo[c] for c in _SUMABLES}
+        # coalesce para que un NULL (métrica ausente) no anule el mínimo o máximo
+        actualizar.update({
+            c: menor(func.coalesce(tabla.c[c], nuevo[c]), func.coalesce(nuevo[c], tabla.c[c])) for c in _MINIMOS
+        })
+        actualizar.update({
+            c: mayor(func.coalesce(tabla.c[c], nuevo[c]), func.coalesce(nuevo[c], tabla.c[c])) for c in _MAXIMOS
+        })
+        db.execute(stmt.on_conflict_do_update(index_elements=list(_CLAVE), set_=actualizar))
+
+
+def _acumular_df(db: Session, df):
+    if df.empty:
+        return
+    _upsert(db, _resumir(df))
+
+
+def acumular(db: Session, registros):
+    """
+    Suma expedientes recién insertados (dicts o MedicalRecord con created_at) a sus
+    cubetas, dentro de la transacción en curso. Si falla, el error se registra y los
+    expedientes se guardan igual; las cubetas se corrigen con la reconstrucción.
+    """
+    if not ROLLUPS_ENABLED or not registros:
+        return
+    pacientes = {_valor(r, "patient_id") for r in registros}
+    edades = dict(db.execute(select(User.id, User.age).where(User.id.in_(pacientes))).all())
+    df = pd.DataFrame({
+        "patient_id": [_valor(r, "patient_id") for r in registros],
+        "doctor_id": pd.Series([_valor(r, "doctor_id") for r in registros], dtype="float64"),
+        "created_at": pd.to_datetime([_valor(r, "created_at") for r in registros]),
+        "temperature": pd.Series([_valor(r, "temperature") for r in registros], dtype="float64"),
+        "systolic": systolic_array(
+            np.array([_valor(r, "systolic") for r in registros], dtype=np.float64),
+            [_valor(r, "blood_pressure") for r in registros],
+        ),
+        "oxygen_saturation": pd.Series([_valor(r, "oxygen_saturation") for r in registros], dtype="float64"),
+        "heart_rate": pd.Series([_valor(r, "heart_rate") for r in registros], dtype="float64"),
+        "age": pd.Series([edades.get(_valor(r, "patient_id")) for r in registros], dtype="float64"),
+    })
+    try:
+        with db.begin_nested():
+            _acumular_df(db, df)
+    except SQLAlchemyError as e:
+        logger.error(f"No se pudieron actualizar los rollups de {len(registros)} expedientes: {e}")
+
+
+def _columnas_crudas(filtros):
+    """SELECT de medical_record con las columnas que necesitan los rollups"""
+    return (
+        select(
+            MedicalRecord.patient_id, MedicalRecord.doctor_id, MedicalRecord.created_at,
+            MedicalRecord.temperature, MedicalRecord.systolic, MedicalRecord.blood_pressure,
+            MedicalRecord.oxygen_saturation, MedicalRecord.heart_rate, User.age,
+        )
+        .join(User, MedicalRecord.patient_id == User.id)
+        .where(*filtros)
+    )
+
+
+def _df_desde_filas(filas):
+    df = pd.DataFrame.from_records(filas, columns=[
+        "patient_id", "doctor_id", "created_at", "temperature", "systolic", "blood_pressure",
+        "oxygen_saturation", "heart_rate", "age",
+    ])
+    df["created_at"] = pd.to_datetime(df["created_at"])
+    df["systolic"] = systolic_array(np.array(df["systolic"], dtype=np.float64), df["blood_pressure"].to_numpy())
+    return df.drop(columns="blood_pressure")
+
+
+def recalcular(db: Session, patient_id, doctor_id, created_at):
+    """Rehace las cubetas (día y sus horas) de un paciente y doctor a partir de los
+    expedientes del día; se usa tras editar o borrar un expediente"""
+    if not ROLLUPS_ENABLED or created_at is None:
+        return
+    dia = datetime(created_at.year, created_at.month, created_at.day)
+    siguiente = dia + timedelta(days=1)
+    try:
+        with db.begin_nested():
+            db.execute(delete(VitalRollup).where(
+                VitalRollup.patient_id == patient_id,
+                VitalRollup.doctor_id == (doctor_id or 0),
+                VitalRollup.bucket >= dia,
+                VitalRollup.bucket < siguiente,
+            ))
+            filtro_doctor = MedicalRecord.doctor_id == doctor_id if doctor_id else MedicalRecord.doctor_id.is_(None)
+            filas = db.execute(_columnas_crudas([
+                MedicalRecord.patient_id == patient_id,
+                filtro_doctor,
+                MedicalRecord.created_at >= dia,
+                MedicalRecord.created_at < siguiente,
+            ])).all()
+            _acumular_df(db, _df_desde_filas(filas))
+    except SQLAlchemyError as e:
+        logger.error(f"No se pudieron recalcular los rollups del paciente {patient_id} ({dia:%Y-%m-%d}): {e}")
+
+
+def reconstruir(db: Session, patient_id=None, chunk_size=ROLLUP_REBUILD_CHUNK):
+    """Borra y recalcula los rollups desde medical_record, por bloques de filas"""
+    filtros = [MedicalRecord.patient_id == patient_id] if patient_id is not None else []
+    borrar = delete(VitalRollup)
+    if patient_id is not None:
+        borrar = borrar.where(VitalRollup.patient_id == patient_id)
+    db.execute(borrar)
+
+    total = 0
+    resultado = db.execute(_columnas_crudas(filtros).execution_options(yield_per=chunk_size))
+    for filas in resultado.partitions():
+        # Una misma cubeta puede repartirse entre bloques: el UPSERT aditivo las combina
+        _acumular_df(db, _df_desde_filas(filas))
+        total += len(filas)
+    db.commit()
+    return total
+
+
+def asegurar_tabla(engine):
+    """Crea vital_rollup si no existe: la ingesta puede arrancar contra una base en la que
+    la API aún no corrió create_all, y sin la tabla cada UPSERT fallaría"""
+    if ROLLUPS_ENABLED:
+        VitalRollup.__table__.create(bind=engine, checkfirst=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reconstruye vital_rollup desde medical_record")
+    parser.add_argument("--patient-id", type=int, default=None, help="Solo este paciente")
+    parser.add_argument("--chunk-size", type=int, default=ROLLUP_REBUILD_CHUNK)
+    args = parser.parse_args()
+
+    from app.shared.config.database import SessionLocal, engine
+    VitalRollup.__table__.create(bind=engine, checkfirst=True)
+    db = SessionLocal()
+    try:
+        total = reconstruir(db, args.patient_id, args.chunk_size)
+        print(f"Rollups reconstruidos a partir de {total} expedientes")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
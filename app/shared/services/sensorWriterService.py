@@ -0,0 +1,279 @@
+import os
+import threading
+import time
+import logging
+from collections import deque
+from datetime import datetime
+from sqlalchemy import insert
+from sqlalchemy.exc import DataError, IntegrityError
+from app.shared.config.database import SessionLocal
+from app.models.recordSensorData import RecordSensorData
+from app.shared.utils.riskService import split_blood_pressure
+from app.shared.config.metrics import SENSOR_WRITER_FLUSH_SECONDS, SENSOR_WRITER_PENDING
+
+logger = logging.getLogger(__name__)
+
+# Configuración del buffer de escritura diferida (write-behind)
+SENSOR_WRITER_BATCH_SIZE = int(os.getenv('SENSOR_WRITER_BATCH_SIZE', '500'))
+SENSOR_WRITER_FLUSH_INTERVAL = float(os.getenv('SENSOR_WRITER_FLUSH_INTERVAL', '1.0'))
+SENSOR_WRITER_MAX_PENDING = int(os.getenv('SENSOR_WRITER_MAX_PENDING', '50000'))
+# Reintentos de un lote fallido antes de dividirlo para aislar las filas que fallan
+SENSOR_WRITER_MAX_RETRIES = int(os.getenv('SENSOR_WRITER_MAX_RETRIES', '3'))
+
+# Filas pendientes de insertar y sus (token de ack, clave de idempotencia), alineados y
+# protegidos por la condición
+_pending_rows = deque()
+_pending_tokens = deque()
+_condition = threading.Condition()
+_writer_thread = None
+
+SENSOR_WRITER_PENDING.set_function(lambda: len(_pending_rows))
+
+# Recibe la lista de tokens de ack cuyas filas ya quedaron guardadas
+commit_callback = None
+# Recibe (tokens, reencolar) de los mensajes cuyas filas no se guardarán aquí
+reject_callback = None
+# Reciben las claves de idempotencia de las filas guardadas / no guardadas; pueden
+# devolver tokens adicionales (reentregas en espera) que siguen el mismo desenlace
+saved_callback = None
+released_callback = None
+
+# Contadores para diagnóstico
+writer_stats = {
+    "rows_written": 0,
+    "rows_dropped": 0,
+    "rows_requeued": 0,
+    "rows_rejected": 0,
+    "flushes": 0,
+    "failed_flushes": 0,
+    "retried_flushes": 0,
+}
+
+def set_commit_callback(callback_func):
+    """Configura quién recibe los tokens de ack una vez guardadas sus filas"""
+    global commit_callback
+    commit_callback = callback_func
+
+def set_reject_callback(callback_func):
+    """Configura quién rechaza (nack) los mensajes cuyas filas no se guardaron"""
+    global reject_callback
+    reject_callback = callback_func
+
+def set_saved_callback(callback_func):
+    """Configura quién registra las claves de idempotencia de las filas guardadas"""
+    global saved_callback
+    saved_callback = callback_func
+
+def set_released_callback(callback_func):
+    """Configura quién libera las claves de idempotencia de las filas que no se guardaron"""
+    global released_callback
+    released_callback = callback_func
+
+def _avisar_claves(callback, pares):
+    """Pasa las claves al callback y devuelve los tokens adicionales que indique"""
+    claves = [clave for _, clave in pares if clave is not None]
+    if not claves or not callback:
+        return []
+    try:
+        return callback(claves) or []
+    except Exception as e:
+        logger.error(f"Error en callback de claves de idempotencia: {e}")
+        return []
+
+def confirmar(tokens):
+    """Entrega tokens de ack al callback (filas guardadas o mensajes sin fila que guardar)"""
+    tokens = [token for token in tokens if token is not None]
+    if tokens and commit_callback:
+        try:
+            commit_callback(tokens)
+        except Exception as e:
+            logger.error(f"Error en callback de confirmación: {e}")
+
+def rechazar(tokens, reencolar):
+    """Entrega tokens de mensajes no guardados al callback de rechazo; con `reencolar`
+    el broker los vuelve a entregar, sin él van a la dead-letter de la cola (si tiene)"""
+    tokens = [token for token in tokens if token is not None]
+    if tokens and reject_callback:
+        try:
+            reject_callback(tokens, reencolar)
+        except Exception as e:
+            logger.error(f"Error en callback de rechazo: {e}")
+
+def _guardadas(pares):
+    """Registra las claves de las filas ya guardadas y después confirma sus mensajes
+    (así una reentrega posterior al ack siempre se reconoce como duplicada)"""
+    esperando = _avisar_claves(saved_callback, pares)
+    confirmar([token for token, _ in pares] + esperando)
+
+def _rechazadas(pares, reencolar):
+    esperando = _avisar_claves(released_callback, pares)
+    rechazar([token for token, _ in pares] + esperando, reencolar)
+
+def enqueue_sensor_data(row, ack_token=None, clave=None):
+    """Agrega una fila de RecordSensorData al buffer; el hilo escritor la inserta en lote.
+
+    `ack_token` se entrega a `commit_callback` y `clave` (idempotencia) a
+    `saved_callback` cuando la fila quede guardada. Con el
+    buffer lleno la fila no se acepta: su mensaje se rechaza con reencolado para que el
+    broker lo vuelva a entregar (el prefetch ya frena el consumo mientras tanto).
+    Devuelve True si la fila quedó en el buffer y False si se rechazó.
+    """
+    with _condition:
+        lleno = len(_pending_rows) >= SENSOR_WRITER_MAX_PENDING
+        if not lleno:
+            _pending_rows.append(row)
+            _pending_tokens.append((ack_token, clave))
+            if len(_pending_rows) >= SENSOR_WRITER_BATCH_SIZE:
+                _condition.notify()
+    if not lleno:
+        return True
+    if ack_token is None:
+        # Sin mensaje que reentregar la muestra se pierde
+        writer_stats["rows_dropped"] += 1
+        logger.warning("Buffer de escritura lleno: muestra sin token descartada")
+    else:
+        writer_stats["rows_requeued"] += 1
+    _rechazadas([(ack_token, clave)], reencolar=True)
+    return False
+
+def _take_batch():
+    """Extrae todas las filas pendientes y sus tokens (se llama con la condición adquirida)"""
+    global _pending_rows, _pending_tokens
+    batch, tokens = list(_pending_rows), list(_pending_tokens)
+    _pending_rows, _pending_tokens = deque(), deque()
+    return batch, tokens
+
+def _requeue_batch(batch, tokens):
+    """Devuelve un lote fallido al inicio del buffer para reintentarlo"""
+    with _condition:
+        _pending_rows.extendleft(reversed(batch))
+        _pending_tokens.extendleft(reversed(tokens))
+
+def _write_batch(batch):
+    """Inserta un lote de filas con un solo INSERT multi-fila y un solo commit.
+    Devuelve None si se guardó o la excepción que lo impidió."""
+    if not batch:
+        return None
+    db = SessionLocal()
+    try:
+        with SENSOR_WRITER_FLUSH_SECONDS.time():
+            db.execute(insert(RecordSensorData), batch)
+            db.commit()
+        writer_stats["rows_written"] += len(batch)
+        writer_stats["flushes"] += 1
+        return None
+    except Exception as e:
+        db.rollback()
+        writer_stats["failed_flushes"] += 1
+        logger.error(f"Error guardando lote de RecordSensorData ({len(batch)} filas): {e}")
+        return e
+    finally:
+        db.close()
+
+def _es_error_de_filas(error):
+    """Errores causados por los datos (p. ej. un paciente inexistente), no por la conexión"""
+    return isinstance(error, (IntegrityError, DataError))
+
+def _aislar(batch, tokens, error):
+    """Divide un lote fallido en mitades hasta aislar las filas que la base rechaza.
+
+    Devuelve (tokens guardados, tokens rechazados, filas y tokens sin guardar). Si una
+    parte falla por algo ajeno a sus filas (la base no responde) se deja de dividir y
+    esa parte y las que faltan vuelven al buffer, sin confirmar.
+    """
+    guardados, rechazados = [], []
+    partes = deque([(batch, tokens, error)])
+    while partes:
+        filas, toks, error = partes.popleft()
+        if error is None:
+            error = _write_batch(filas)
+            if error is None:
+                guardados.extend(toks)
+                continue
+        if len(filas) == 1 and _es_error_de_filas(error):
+            logger.error(f"Fila de RecordSensorData rechazada por la base de datos: {filas[0]}")
+            writer_stats["rows_rejected"] += 1
+            rechazados.extend(toks)
+            continue
+        if len(filas) == 1 or (not _es_error_de_filas(error) and filas is not batch):
+            restantes = [(filas, toks)] + [(f, t) for f, t, _ in partes]
+            return guardados, rechazados, (
+                [fila for f, _ in restantes for fila in f],
+                [token for _, t in restantes for token in t],
+            )
+        mitad = len(filas) // 2
+        partes.extendleft([(filas[mitad:], toks[mitad:], None), (filas[:mitad], toks[:mitad], None)])
+    return guardados, rechazados, ([], [])
+
+def flush_sensor_data():
+    """Vacía el buffer de forma síncrona (por ejemplo al apagar el servicio)"""
+    with _condition:
+        batch, tokens = _take_batch()
+    error = _write_batch(batch)
+    if error is None:
+        _guardadas(tokens)
+        return True
+    guardados, rechazados, _ = _aislar(batch, tokens, error)
+    _guardadas(guardados)
+    _rechazadas(rechazados, reencolar=False)
+    # Lo que no se pudo guardar queda sin confirmar y el broker lo reentregará
+    return False
+
+def _writer_loop():
+    """Hilo escritor: vacía el buffer cuando se llena el lote o vence el intervalo.
+
+    Los tokens de ack solo se confirman tras el commit. Un lote fallido se reintenta
+    entero; si el error es de sus filas (o persiste tras SENSOR_WRITER_MAX_RETRIES) se
+    divide hasta aislar las filas que la base rechaza, que se rechazan sin reencolar.
+    Nada que no se haya guardado se confirma: mientras la base no responde, los
+    mensajes siguen sin ack y el prefetch frena el consumo.
+    """
+    reintentos = 0
+    while True:
+        with _condition:
+            deadline = time.monotonic() + SENSOR_WRITER_FLUSH_INTERVAL
+            while len(_pending_rows) < SENSOR_WRITER_BATCH_SIZE:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                _condition.wait(remaining)
+            batch, tokens = _take_batch()
+        error = _write_batch(batch)
+        if error is None:
+            reintentos = 0
+            _guardadas(tokens)
+            continue
+        if _es_error_de_filas(error) or reintentos >= SENSOR_WRITER_MAX_RETRIES:
+            guardados, rechazados, (batch, tokens) = _aislar(batch, tokens, error)
+            _guardadas(guardados)
+            _rechazadas(rechazados, reencolar=False)
+            if not batch:
+                reintentos = 0
+                continue
+        reintentos += 1
+        writer_stats["retried_flushes"] += 1
+        _requeue_batch(batch, tokens)
+        time.sleep(min(SENSOR_WRITER_FLUSH_INTERVAL * reintentos, 30))
+
+def start_sensor_writer():
+    """Inicia el hilo escritor una sola vez por proceso"""
+    global _writer_thread
+    if _writer_thread is None or not _writer_thread.is_alive():
+        _writer_thread = threading.Thread(target=_writer_loop, daemon=True)
+        _writer_thread.start()
+
+def build_sensor_row(patient_id, doctor_id, temperature, blood_pressure, oxygen_saturation, heart_rate, medical_record_id=None):
+    """Construye la fila a insertar; `blood_pressure` conserva el valor sistólico"""
+    systolic, diastolic = split_blood_pressure(blood_pressure) or (None, None)
+    return {
+        "patient_id": patient_id,
+        "doctor_id": doctor_id,
+        "temperature": temperature,
+        "blood_pressure": systolic,
+        "systolic": systolic,
+        "diastolic": diastolic,
+        "oxygen_saturation": oxygen_saturation,
+        "heart_rate": heart_rate,
+        "timestamp": datetime.now(),
+        "medical_record_id": medical_record_id,
+    }
@@ -1,232 +1,438 @@
+import heapq
 import threading
 import time
 import json
-from collections import defaultdict
+import logging
+import os
+from sqlalchemy import insert
 from sqlalchemy.orm import Session
 from app.models.medicalRecord import MedicalRecord
 from app.shared.config.database import SessionLocal
 import pandas as pd
 from app.models.recordSensorData import RecordSensorData
+from app.shared.services.rollupService import acumular as acumular_rollups
+from app.shared.services import statsCache
+from app.shared.services.sensorWriterService import enqueue_sensor_data, build_sensor_row, start_sensor_writer, confirmar, set_saved_callback, set_released_callback
+from app.shared.utils.sampleBuffer import PatientBuffer
+from app.shared.utils.riskService import split_blood_pressure
+from app.shared.utils.alertRules import alertas_muestra
+from app.shared.utils.ackTracker import DedupCache, NUEVA, GUARDADA
+from app.shared.config.metrics import (
+    BUFFER_PATIENTS, BUFFER_SAMPLES, WINDOW_CLOSE_SECONDS, WINDOW_CLOSE_DELAY_SECONDS, MEDICAL_RECORD_COMMIT_SECONDS
+)
 
 
+logger = logging.getLogger(__name__)
+
 medicion_activa = {}  # {patient_id: True/False}
 
 # Variable global para la función de notificación WebSocket
 notification_callback = None
 
-def set_notification_callback(callback_func):
-    """Configura la función de callback para notificaciones WebSocket"""
-    global notification_callback
+batch_notification_callback = None
+
+def set_notification_callback(callback_func, batch_callback_func=None):
+    """Configura la función de callback para notificaciones WebSocket.
+
+    `batch_callback_func(mensajes)` recibe una lista de (type, message, target_users[, coalesce_key])
+    y permite entregar varias notificaciones con un solo despertar del websocket.
+    """
+    global notification_callback, batch_notification_callback
     notification_callback = callback_func
+    batch_notification_callback = batch_callback_func
+
+def notificar(message_type, message, target_users=None, coalesce_key=None):
+    """Entrega un mensaje al nivel WebSocket si hay callback configurado.
+
+    Los mensajes con `coalesce_key` pueden reemplazarse por uno más reciente con la
+    misma clave si el cliente no alcanza a recibirlos.
+    """
+    if notification_callback:
+        notification_callback(message_type, message, target_users, coalesce_key)
+
+def notificar_lote(mensajes):
+    """Entrega un lote de notificaciones de una sola vez si el websocket lo soporta"""
+    if not mensajes:
+        return
+    if batch_notification_callback:
+        batch_notification_callback(mensajes)
+    else:
+        for mensaje in mensajes:
+            notificar(*mensaje)
+
+# Los buffers solo guardan agregados (memoria fija por paciente); los inactivos se desalojan
+BUFFER_IDLE_SECONDS = float(os.getenv('BUFFER_IDLE_SECONDS', '600'))
+
+# Ventanas de agregación: duración por defecto y duraciones permitidas (segundos)
+AGGREGATION_WINDOW_SECONDS = int(os.getenv('AGGREGATION_WINDOW_SECONDS', '60'))
+AGGREGATION_WINDOWS_ALLOWED = tuple(
+    int(v) for v in os.getenv('AGGREGATION_WINDOWS_ALLOWED', '30,60,300').split(',')
+)
+
+# Claves de idempotencia (dispositivo, topic, timestamp) de las muestras ya guardadas;
+# una reentrega del broker tras una caída se descarta sin volver a guardarse. La clave se
+# registra cuando el escritor hace commit de la fila: si la escritura falla, la
+# reentrega se procesa de nuevo
+INGEST_DEDUP_SIZE = int(os.getenv('INGEST_DEDUP_SIZE', '100000'))
+muestras_vistas = DedupCache(INGEST_DEDUP_SIZE)
+set_saved_callback(muestras_vistas.registrar)
+set_released_callback(muestras_vistas.liberar)
+
+# Estructura para acumular datos por paciente: {patient_id: PatientBuffer}
+data_buffer = {}
+buffer_lock = threading.Lock()
+_total_samples = 0
+BUFFER_PATIENTS.set_function(lambda: len(data_buffer))
+BUFFER_SAMPLES.set_function(lambda: _total_samples)
+
+# Agenda de cierres de ventana: heap de (cierre, patient_id) y cierre vigente por paciente
+ventana_paciente = {}  # {patient_id: segundos}
+_agenda = []
+_programados = {}
+_agenda_cond = threading.Condition()
+
+# Llamar a esta función cada vez que recibas un dato de sensor.
+# La fila se encola y el hilo escritor la inserta en lote (ver sensorWriterService)
+def save_record_sensor_data(patient_id, doctor_id, temperature, blood_pressure, oxygen_saturation, heart_rate, medical_record_id=None, ack_token=None, clave=None):
+    """Encola la fila; devuelve None si no había nada que guardar, True si se encoló y
+    False si el buffer de escritura la rechazó (el mensaje ya se devolvió al broker)"""
+    if patient_id is None:
+        return None
+    return enqueue_sensor_data(build_sensor_row(
+        patient_id, doctor_id, temperature, blood_pressure, oxygen_saturation, heart_rate, medical_record_id
+    ), ack_token, clave)
+
+def _append_sample(buf, vital, value):
+    """Suma una muestra a los agregados de la ventana del paciente"""
+    global _total_samples
+    buf.add(vital, float(value))
+    _total_samples += 1
+
+def add_sensor_data(patient_id, doctor_id, temperature, blood_pressure, oxygen_saturation, heart_rate, ack_token=None, clave=None):
+    """Guarda la muestra cruda y la acumula si hay medición activa; devuelve lo mismo que
+    save_record_sensor_data (None, True o False)"""
+    encolada = save_record_sensor_data(
+        patient_id, doctor_id, temperature, blood_pressure, oxygen_saturation, heart_rate, ack_token=ack_token, clave=clave
+    )
+    # Una fila rechazada vuelve a llegar reentregada: acumularla ahora la contaría dos veces
+    if encolada is False or not medicion_activa.get(patient_id, False):
+        return encolada # No procesar si la medición no está activa
+    with buffer_lock:
+        buf = data_buffer.get(patient_id)
+        if buf is None:
+            buf = data_buffer[patient_id] = PatientBuffer(patient_id)
+            _programar_cierre(patient_id)
+        if temperature is not None and temperature != 0:
+            _append_sample(buf, "temperature", temperature)
+        # Para presión arterial, aceptar valores aunque contengan 0 (detección parcial)
+        presion = split_blood_pressure(blood_pressure)
+        if presion is not None:
+            sis, dia = presion
+            if sis > 0:
+                _append_sample(buf, "systolic", sis)
+            if dia is not None and dia > 0:
+                _append_sample(buf, "diastolic", dia)
+        if oxygen_saturation is not None and oxygen_saturation != 0:
+            _append_sample(buf, "oxygen_saturation", oxygen_saturation)
+        if heart_rate is not None and heart_rate != 0:
+            _append_sample(buf, "heart_rate", heart_rate)
+        buf.doctor_id = doctor_id
+        buf.last_seen = time.monotonic()
+    return encolada
+
+def _take_window(buf):
+    """Devuelve los agregados de la ventana y deja el buffer vacío (con el lock adquirido)"""
+    global _total_samples
+    aggregates = buf.aggregates
+    _total_samples -= buf.sample_count()
+    buf.clear()
+    return aggregates
+
+def get_live_aggregate(patient_id):
+    """Agregado parcial (conteo, media, mín, máx, varianza) de la ventana en curso"""
+    with buffer_lock:
+        buf = data_buffer.get(patient_id)
+        if buf is None:
+            return None
+        return {
+            "patient_id": patient_id,
+            "doctor_id": buf.doctor_id,
+            "window_started": buf.window_started,
+            "vitals": buf.live(),
+        }
+
+def buffer_stats():
+    """Contabilidad de los buffers: muestras de la ventana y bytes por paciente y totales"""
+    now = time.monotonic()
+    with buffer_lock:
+        per_patient = {
+            patient_id: {
+                "samples": buf.sample_count(),
+                "bytes": buf.nbytes(),
+                "idle_seconds": round(buf.idle_seconds(now), 1),
+            }
+            for patient_id, buf in data_buffer.items()
+        }
+        return {
+            "patients": len(per_patient),
+            "samples": _total_samples,
+            "bytes": sum(stats["bytes"] for stats in per_patient.values()),
+            "per_patient": per_patient,
+        }
+
+def evict_idle_patients(max_idle_seconds=BUFFER_IDLE_SECONDS):
+    """Elimina los buffers de pacientes que no envían datos desde hace tiempo"""
+    global _total_samples
+    now = time.monotonic()
+    with buffer_lock:
+        inactivos = [pid for pid, buf in data_buffer.items() if buf.idle_seconds(now) > max_idle_seconds]
+        for patient_id in inactivos:
+            _total_samples -= data_buffer.pop(patient_id).sample_count()
+    return inactivos
+
+def validar_ventana(seconds):
+    """Duración de ventana como entero; ValueError si no está entre las permitidas"""
+    try:
+        valor = int(seconds)
+    except (TypeError, ValueError):
+        valor = None
+    if valor not in AGGREGATION_WINDOWS_ALLOWED:
+        raise ValueError(f"Ventana no permitida: {seconds}s (permitidas: {AGGREGATION_WINDOWS_ALLOWED})")
+    return valor
 
-# Estructura para acumular datos por paciente
-data_buffer = defaultdict(lambda: {
-    "temperature": [],
-    "blood_pressure": [],
-    "oxygen_saturation": [],
-    "heart_rate": [],
-    "doctor_id": None,
-    "patient_id": None
-})
-
-# Llamar a esta función cada vez que recibas un dato de sensor
-def save_record_sensor_data(patient_id, doctor_id, temperature, blood_pressure, oxygen_saturation, heart_rate, medical_record_id=None):
-    db = SessionLocal()
-    # try:
-    #     raw_data = RecordSensorData(
-    #         patient_id=patient_id,
-    #         doctor_id=doctor_id,
-    #         temperature=temperature,
-    #         blood_pressure=blood_pressure,
-    #         oxygen_saturation=oxygen_saturation,
-    #         heart_rate=heart_rate,
-    #         medical_record_id=medical_record_id
-    #     )
-    #     db.add(raw_data)
-    #     db.commit()
-    # except Exception as e:
-    #     db.rollback()
-    #     print(f"Error guardando RecordSensorData: {e}")
-    # finally:
-    #     db.close()
-
-def add_sensor_data(patient_id, doctor_id, temperature, blood_pressure, oxygen_saturation, heart_rate):
-    save_record_sensor_data(patient_id, doctor_id, temperature, blood_pressure, oxygen_saturation, heart_rate)
-    if not medicion_activa.get(patient_id, False):
-        return # No procesar si la medición no está activa
-    buf = data_buffer[patient_id]
-    if temperature is not None and temperature != 0:
-        buf["temperature"].append(temperature)
-    # Para presión arterial, aceptar valores aunque contengan 0 (detección parcial)
-    if blood_pressure is not None:
-        buf["blood_pressure"].append(blood_pressure)
-    if oxygen_saturation is not None and oxygen_saturation != 0:
-        buf["oxygen_saturation"].append(oxygen_saturation)
-    if heart_rate is not None and heart_rate != 0:
-        buf["heart_rate"].append(heart_rate)
-    buf["doctor_id"] = doctor_id
-    buf["patient_id"] = patient_id
-
-# Proceso que cada minuto promedia y guarda en la base de datos
+def set_aggregation_window(patient_id, seconds):
+    """Configura la duración de ventana de un paciente; aplica desde el próximo cierre"""
+    ventana_paciente[patient_id] = validar_ventana(seconds)
+
+def _siguiente_cierre(patient_id, now=None):
+    """Próximo cierre alineado a múltiplos de la ventana, p. ej. :00, :30 o cada 5 min"""
+    ventana = ventana_paciente.get(patient_id, AGGREGATION_WINDOW_SECONDS)
+    now = time.time() if now is None else now
+    return (int(now // ventana) + 1) * ventana
+
+def _programar_cierre(patient_id, now=None):
+    with _agenda_cond:
+        if patient_id in _programados:
+            return
+        cierre = _siguiente_cierre(patient_id, now)
+        _programados[patient_id] = cierre
+        heapq.heappush(_agenda, (cierre, patient_id))
+        _agenda_cond.notify()
+
+def _tomar_vencidos(now):
+    """Extrae de la agenda los pacientes cuya ventana ya cerró"""
+    vencidos = []
+    with _agenda_cond:
+        while _agenda and _agenda[0][0] <= now:
+            cierre, patient_id = heapq.heappop(_agenda)
+            if _programados.get(patient_id) != cierre:
+                continue  # Entrada obsoleta
+            del _programados[patient_id]
+            vencidos.append((cierre, patient_id))
+    return vencidos
+
+def _aggregate_window(patient_id, doctor_id, aggregates):
+    """Promedia la ventana de un paciente en tiempo constante; None si no hubo temperatura"""
+    if aggregates["temperature"].count == 0:
+        return None  # No hay datos nuevos
+
+    def safe_avg(aggregate):
+        return aggregate.mean if aggregate.count else 0
+
+    return {
+        "patient_id": patient_id,
+        "doctor_id": doctor_id,
+        "temperature": safe_avg(aggregates["temperature"]),
+        "blood_pressure": f"{safe_avg(aggregates['systolic']):.0f}/{safe_avg(aggregates['diastolic']):.0f}",
+        "systolic": aggregates["systolic"].mean if aggregates["systolic"].count else None,
+        "diastolic": aggregates["diastolic"].mean if aggregates["diastolic"].count else None,
+        "oxygen_saturation": safe_avg(aggregates["oxygen_saturation"]),
+        "heart_rate": safe_avg(aggregates["heart_rate"]),
+        "diagnosis": "",
+        "treatment": "",
+        "notes": "",
+    }
+
+def save_medical_records(rows):
+    """Inserta todas las ventanas cerradas en un INSERT multi-fila y una sola transacción"""
+    if not rows:
+        return []
+    db: Session = SessionLocal()
+    try:
+        with MEDICAL_RECORD_COMMIT_SECONDS.time():
+            result = db.execute(
+                insert(MedicalRecord).returning(MedicalRecord.id, MedicalRecord.created_at, sort_by_parameter_order=True),
+                rows
+            )
+            insertados = result.all()
+            # Rollups por hora y día en la misma transacción que los expedientes
+            acumular_rollups(db, [{**row, "created_at": created_at} for row, (_, created_at) in zip(rows, insertados)])
+            record_ids = [record_id for record_id, _ in insertados]
+            db.commit()
+        return record_ids
+    except Exception:
+        db.rollback()
+        logger.exception(f"Error al guardar {len(rows)} registros médicos")
+        return None
+    finally:
+        db.close()
+
+def cerrar_ventanas(vencidos):
+    """Cierra las ventanas vencidas, guarda los expedientes y notifica en lote"""
+    rows = []
+    with buffer_lock:
+        for cierre, patient_id in vencidos:
+            buf = data_buffer.get(patient_id)
+            if buf is None:
+                continue  # Paciente desalojado por inactividad
+            row = _aggregate_window(patient_id, buf.doctor_id, _take_window(buf))
+            if row is not None:
+                rows.append(row)
+    # Programar la siguiente ventana de los pacientes que siguen activos
+    for cierre, patient_id in vencidos:
+        if patient_id in data_buffer:
+            _programar_cierre(patient_id, now=cierre)
+
+    record_ids = save_medical_records(rows)
+    if not record_ids:
+        return
+    statsCache.invalidar(*{(row["patient_id"], row["doctor_id"]) for row in rows})
+    logger.info(f"{len(record_ids)} expedientes médicos creados")
+
+    # Enviar notificación WebSocket sobre la creación de los expedientes
+    ahora = time.time()
+    mensajes = []
+    for row, record_id in zip(rows, record_ids):
+        notification_message = json.dumps({
+            "type": "medical_record_created",
+            "patient_id": row["patient_id"],
+            "doctor_id": row["doctor_id"],
+            "record_id": record_id,
+            "timestamp": ahora,
+            "data": {
+                "temperature": row["temperature"],
+                "blood_pressure": row["blood_pressure"],
+                "oxygen_saturation": row["oxygen_saturation"],
+                "heart_rate": row["heart_rate"]
+            },
+            "message": f"Nuevo expediente médico creado para el paciente {row['patient_id']}"
+        })
+        # Enviar notificación a usuarios específicos (paciente y doctor)
+        mensajes.append(("targeted", notification_message, [row["patient_id"], row["doctor_id"]]))
+    notificar_lote(mensajes)
+
+# Proceso que cierra las ventanas de cada paciente a su hora y guarda en la base de datos
 def process_and_save_records():
     while True:
-        time.sleep(60)  # Espera 1 minuto
-        for patient_id, buf in list(data_buffer.items()):
-            if len(buf["temperature"]) == 0:
-                continue  # No hay datos nuevos
-
-            def safe_avg(lst):
-                values = [x for x in lst if x is not None]
-                return sum(values) / len(values) if values else 0
-
-            def safe_avg_blood_pressure(bp_list):
-                """Promedio especial para presión arterial que maneja valores parciales"""
-                if not bp_list:
-                    return 0
-                
-                sistolica_vals = []
-                diastolica_vals = []
-                
-                for bp in bp_list:
-                    if bp is not None:
-                        try:
-                            sis, dia = map(float, str(bp).split('/'))
-                            if sis > 0:
-                                sistolica_vals.append(sis)
-                            if dia > 0:
-                                diastolica_vals.append(dia)
-                        except:
-                            continue
-                
-                # Calcular promedios
-                avg_sis = sum(sistolica_vals) / len(sistolica_vals) if sistolica_vals else 0
-                avg_dia = sum(diastolica_vals) / len(diastolica_vals) if diastolica_vals else 0
-                
-                return f"{avg_sis:.0f}/{avg_dia:.0f}"
-
-            avg_temp = safe_avg(buf["temperature"])
-            avg_bp = safe_avg_blood_pressure(buf["blood_pressure"])
-            avg_ox = safe_avg(buf["oxygen_saturation"])
-            avg_hr = safe_avg(buf["heart_rate"])
-
-            db: Session = SessionLocal()
+        with _agenda_cond:
+            espera = _agenda[0][0] - time.time() if _agenda else BUFFER_IDLE_SECONDS
+            if espera > 0:
+                _agenda_cond.wait(min(espera, BUFFER_IDLE_SECONDS))
+        ahora = time.time()
+        vencidos = _tomar_vencidos(ahora)
+        if vencidos:
+            for cierre, _ in vencidos:
+                WINDOW_CLOSE_DELAY_SECONDS.observe(max(0.0, ahora - cierre))
             try:
-                record = MedicalRecord(
-                    patient_id=buf["patient_id"],
-                    doctor_id=buf["doctor_id"],
-                    temperature=avg_temp,
-                    blood_pressure=avg_bp,
-                    oxygen_saturation=avg_ox,
-                    heart_rate=avg_hr,
-                    diagnosis="",
-                    treatment="",
-                    notes=""
-                )
-                db.add(record)
-                db.commit()
-                db.refresh(record)
-                print(f"Expediente médico creado para paciente {patient_id}")
-
-                # Enviar notificación WebSocket sobre la creación del expediente
-                if notification_callback:
-                    notification_message = json.dumps({
-                        "type": "medical_record_created",
-                        "patient_id": buf["patient_id"],
-                        "doctor_id": buf["doctor_id"],
-                        "record_id": record.id,
-                        "timestamp": time.time(),
-                        "data": {
-                            "temperature": avg_temp,
-                            "blood_pressure": avg_bp,
-                            "oxygen_saturation": avg_ox,
-                            "heart_rate": avg_hr
-                        },
-                        "message": f"Nuevo expediente médico creado para el paciente {patient_id}"
-                    })
-                    
-                    # Enviar notificación a usuarios específicos (paciente y doctor)
-                    target_users = [buf["patient_id"], buf["doctor_id"]]
-                    notification_callback("targeted", notification_message, target_users)
-
-                # Asociar los RecordSensorData crudos a este MedicalRecord
-                # db.query(RecordSensorData).filter(
-                #     RecordSensorData.patient_id == buf["patient_id"],
-                #     RecordSensorData.doctor_id == buf["doctor_id"],
-                #     RecordSensorData.medical_record_id == None
-                # ).update({RecordSensorData.medical_record_id: record.id})
-                # db.commit()
-            except Exception as e:
-                db.rollback()
-                print(f"Error al guardar registro médico: {e}")
-            finally:
-                db.close()
-
-            # Limpia el buffer de ese paciente
-            data_buffer[patient_id] = {
-                "temperature": [],
-                "blood_pressure": [],
-                "oxygen_saturation": [],
-                "heart_rate": [],
-                "doctor_id": buf["doctor_id"],
-                "patient_id": buf["patient_id"]
-            }
-            
+                with WINDOW_CLOSE_SECONDS.time():
+                    cerrar_ventanas(vencidos)
+            except Exception:
+                logger.exception("Error al cerrar ventanas de agregación")
+        evict_idle_patients()
+
 def validar_datos(temperature, blood_pressure, oxygen_saturation, heart_rate):
-    alertas = []
-
-    # Temperatura
-    if temperature is not None:
-        if temperature < 35:
-            alertas.append("Hipotermia: Temperatura menor a 35°C")
-        elif 37.5 <= temperature < 38:
-            alertas.append("Febrícula: Temperatura entre 37.5°C y 38°C")
-        elif 38 <= temperature < 39:
-            alertas.append("Fiebre: Temperatura entre 38°C y 39°C")
-        elif temperature >= 39:
-            alertas.append("Hipertermia: Temperatura mayor a 39°C")
-
-    # Presión arterial (ejemplo para sistólica/diastólica)
-    if blood_pressure is not None:
-        try:
-            sistolica, diastolica = map(float, str(blood_pressure).split('/'))
+    # Presión arterial (sistólica/diastólica); si el formato no es correcto, se ignora
+    sistolica, diastolica = split_blood_pressure(blood_pressure) or (None, None)
+    return alertas_muestra(temperature, sistolica, diastolica, oxygen_saturation, heart_rate)
+
+def clave_idempotencia(topic_name, data):
+    """(dispositivo, topic, timestamp del dispositivo); None si el mensaje no trae timestamp"""
+    timestamp = data.get("timestamp")
+    if timestamp is None:
+        return None
+    return (data.get("device_id", data.get("patient_id")), topic_name, timestamp)
+
+def procesar_mensaje_sensor(topic_name, body, ack_token=None):
+    """Procesa un mensaje de sensor: signos vitales a suscriptores, alertas y acumulación para el expediente.
+
+    Los mensajes resultantes se entregan a través de `notification_callback`, de modo
+    que la misma función sirve en el proceso del websocket y en los workers de ingesta.
+    `ack_token` se confirma cuando la muestra queda guardada (o si no hay nada que guardar).
+    Si el buffer de escritura rechaza la fila, el mensaje se reentregará y no se notifica nada.
+    """
+    encolada = None
+    clave = None
+    estado = NUEVA
+    try:
+        data = json.loads(body)
+        clave = clave_idempotencia(topic_name, data)
+        # Duplicado si la clave ya se guardó o si su fila sigue en el escritor (p. ej. una
+        # reentrega tras reconectar); en ese caso el token espera el desenlace de la original
+        if clave is not None:
+            estado = muestras_vistas.reservar(clave, ack_token)
+        if estado != NUEVA:
+            logger.info(f"Mensaje duplicado descartado en topic {topic_name}: {clave}")
+            return
+        logger.info(f"Mensaje recibido en topic {topic_name}: {data}")
+
+        # Guardar datos en base de datos antes de notificar
+        encolada = add_sensor_data(
+            data.get("patient_id"),
+            data.get("doctor_id"),
+            data.get("temperature"),
+            data.get("blood_pressure"),
+            data.get("oxygen_saturation"),
+            data.get("heart_rate"),
+            ack_token,
+            clave
+        )
+        if encolada is False:
+            return
+        
+        # Se codifica una sola vez y se entrega solo a los suscriptores del paciente
+        if data.get("patient_id") is not None:
+            vitals_message = json.dumps({"topic": topic_name, "data": data})
+            notificar("patient", vitals_message, [data.get("patient_id")],
+                      coalesce_key=(data.get("patient_id"), topic_name))
+        
+        # Validar datos y enviar alertas si es necesario
+        alertas = validar_datos(
+            data.get("temperature"),
+            data.get("blood_pressure"),
+            data.get("oxygen_saturation"),
+            data.get("heart_rate")
+        )
+        
+        if alertas:
+            alerta_msg = json.dumps({
+                "type": "alerta",
+                "patient_id": data.get("patient_id"),
+                "doctor_id": data.get("doctor_id"),
+                "alertas": alertas
+            })
             
-            # Validar solo los valores detectados (diferentes de 0)
-            if sistolica > 0 and diastolica > 0:
-                # Ambos valores detectados
-                if sistolica < 90 or diastolica < 60:
-                    alertas.append("Hipotensión: Presión arterial baja")
-                elif sistolica > 140 or diastolica > 90:
-                    alertas.append("Hipertensión: Presión arterial alta")
-            elif sistolica > 0:
-                # Solo sistólica detectada
-                if sistolica < 90:
-                    alertas.append("Hipotensión sistólica: Presión sistólica baja")
-                elif sistolica > 140:
-                    alertas.append("Hipertensión sistólica: Presión sistólica alta")
-            elif diastolica > 0:
-                # Solo diastólica detectada
-                if diastolica < 60:
-                    alertas.append("Hipotensión diastólica: Presión diastólica baja")
-                elif diastolica > 90:
-                    alertas.append("Hipertensión diastólica: Presión diastólica alta")
-        except Exception:
-            pass  # Si el formato no es correcto, ignora
-
-    # Oxigenación
-    if oxygen_saturation is not None:
-        if oxygen_saturation < 90:
-            alertas.append("Oxigenación grave: SpO2 menor a 90%")
-        elif 90 <= oxygen_saturation < 93:
-            alertas.append("Oxigenación leve: SpO2 entre 90% y 92%")
-
-    # Ritmo cardíaco
-    if heart_rate is not None:
-        if heart_rate < 50:
-            alertas.append("Bradicardia: Ritmo cardíaco menor a 50 lpm")
-        elif heart_rate > 100:
-            alertas.append("Taquicardia: Ritmo cardíaco mayor a 100 lpm")
-
-    return alertas
-
-# Inicia el hilo de procesamiento
-threading.Thread(target=process_and_save_records, daemon=True).start()
\ No newline at end of file
+            # Enviar alerta a usuarios específicos
+            target_users = []
+            if data.get("patient_id"):
+                target_users.append(data.get("patient_id"))
+            if data.get("doctor_id"):
+                target_users.append(data.get("doctor_id"))
+            
+            if target_users:
+                notificar("targeted", alerta_msg, target_users)
+        
+    except json.JSONDecodeError as e:
+        logger.error(f"Error decodificando JSON: {e}")
+    except Exception as e:
+        logger.error(f"Error procesando mensaje: {e}")
+    finally:
+        if estado == GUARDADA:
+            confirmar([ack_token])
+        # Sin fila que guardar no hay commit que esperar: se registra y se confirma ya
+        elif estado == NUEVA and encolada is None:
+            esperando = muestras_vistas.registrar([clave]) if clave is not None else []
+            confirmar([ack_token] + esperando)
+
+# Inicia el hilo de procesamiento y el escritor de datos crudos
+threading.Thread(target=process_and_save_records, daemon=True).start()
+start_sensor_writer()
\ No newline at end of file
@@ -1,93 +1,155 @@
-import matplotlib.pyplot as plt
 import numpy as np
-import re
-from typing import List, Dict, Any, Optional, Tuple
-from datetime import datetime, date
+import math
+import os
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, Dict, Any, Optional
+from sqlalchemy import Numeric, and_, cast, func, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from app.models import medicalRecord
+from app.shared.config.database import AsyncSessionLocal
 from app.models.medicalRecord import MedicalRecord
-from app.schemas.riskSchema import RisksSchema
 from app.models.user import User
-from app.shared.utils.riskService import get_heart_rate_range, get_respiratory_rate_range
-from scipy.stats import pearsonr
+from app.models.vitalRollup import VitalRollup
+from app.shared.services.rollupService import RIESGOS as RIESGOS_ROLLUP
+from app.shared.utils.riskService import get_heart_rate_range, get_respiratory_rate_range, heart_rate_range_sql, systolic_array, systolic_sql, umbrales_fc
+from app.shared.utils.alertRules import filtros_riesgo_estadisticas, mascaras_riesgo_estadisticas
 import pandas as pd
 
-async def get_medical_record_statistics(db: Session, medical_records: List[MedicalRecord]) -> Dict[str, Any]:
+# Dónde se calculan las estadísticas de las rutas: "sql" (agregados en PostgreSQL),
+# "numpy" (columnas traídas a Python; con otras bases "sql" también usa NumPy) o
+# "rollup" (cubetas de vital_rollup, sin mediana ni moda)
+STATISTICS_MODE = os.getenv('STATISTICS_MODE', 'sql')
+
+# Métrica de la respuesta -> columna
+METRICAS = {
+    "temperatura": "temperature",
+    "presion_arterial": "systolic",
+    "saturacion_oxigeno": "oxygen_saturation",
+    "frecuencia_cardiaca": "heart_rate",
+}
+
+# Columnas que necesitan las estadísticas; la edad viene del paciente (join con user)
+COLUMNAS_ESTADISTICAS = ("temperature", "systolic", "blood_pressure", "oxygen_saturation", "heart_rate", "created_at", "age")
+
+
+def _flotantes(valores):
+    return np.fromiter((math.nan if v is None else v for v in valores), np.float64, len(valores))
+
+
+def _columnas_desde_filas(filas):
+    """Convierte filas (tuplas en el orden de COLUMNAS_ESTADISTICAS) en arreglos NumPy con NaN"""
+    temperature, systolic, blood_pressure, oxygen_saturation, heart_rate, created_at, age = (
+        zip(*filas) if filas else [()] * len(COLUMNAS_ESTADISTICAS)
+    )
+    return {
+        "temperature": _flotantes(temperature),
+        "systolic": systolic_array(_flotantes(systolic), blood_pressure),
+        "oxygen_saturation": _flotantes(oxygen_saturation),
+        "heart_rate": _flotantes(heart_rate),
+        "age": _flotantes(age),
+        # pandas convierte los datetime de Python en C, mucho más rápido que np.array
+        "created_at": pd.to_datetime(list(created_at)).to_numpy(),
+    }
+
+
+def _filtros(patient_id=None, doctor_id=None, start_date=None, end_date=None):
+    """Condiciones WHERE del alcance de unas estadísticas (paciente o doctor y rango)"""
+    filtros = []
+    if patient_id is not None:
+        filtros.append(MedicalRecord.patient_id == patient_id)
+    if doctor_id is not None:
+        filtros.append(MedicalRecord.doctor_id == doctor_id)
+    # Las rutas reciben las fechas como texto y asyncpg solo acepta datetime
+    if start_date is not None:
+        filtros.append(MedicalRecord.created_at >= pd.Timestamp(start_date).to_pydatetime())
+    if end_date is not None:
+        filtros.append(MedicalRecord.created_at <= pd.Timestamp(end_date).to_pydatetime())
+    return filtros
+
+
+def _consulta_columnas(patient_id=None, doctor_id=None, start_date=None, end_date=None):
     """
-    Calcula estadísticas básicas de los registros médicos de un paciente
+    SELECT de solo las columnas que usan las estadísticas, con la edad del paciente
+    por join (sin cargar objetos ORM ni la relación patient por registro)
     """
-    if not medical_records:
-        return {"error": "No hay registros médicos para analizar"}
+    return (
+        select(
+            MedicalRecord.temperature, MedicalRecord.systolic, MedicalRecord.blood_pressure,
+            MedicalRecord.oxygen_saturation, MedicalRecord.heart_rate, MedicalRecord.created_at, User.age,
+        )
+        .join(User, MedicalRecord.patient_id == User.id)
+        .order_by(MedicalRecord.id)
+        .where(*_filtros(patient_id, doctor_id, start_date, end_date))
+    )
 
-    def parse_blood_pressure(value: Any) -> Optional[float]:
-        if value is None:
-            return None
-        if isinstance(value, (int, float)):
-            return float(value)
-        if isinstance(value, str):
-            match = re.match(r"^\s*(\d+(?:\.\d+)?)", value)
-            if match:
-                return float(match.group(1))
-        return None
-    
-    # Extraer datos de cada métrica
-    temperatures = [record.temperature for record in medical_records]
-    blood_pressures = [bp for bp in (parse_blood_pressure(record.blood_pressure) for record in medical_records) if bp is not None]
-    oxygen_saturations = [record.oxygen_saturation for record in medical_records]
-    heart_rates = [record.heart_rate for record in medical_records]
-    
-    # Extraemos al paciente
-    patient = medical_records[0].patient
-    
-    # Calcular estadísticas básicas para cada métrica
-    def calculate_basic_stats(data: List[float]) -> Dict[str, float]:
-        if not data:
-            return {}
-        
-        return {
-            "media": float(np.mean(data).round(2)),
-            "mediana": float(np.median(data).round(2)),
-            "moda": float(calculate_mode(data)),
-            "desviacion_estandar": float(np.std(data).round(2)),
-            "minimo": float(np.min(data)),
-            "maximo": float(np.max(data)),
-            "rango": float(np.max(data) - np.min(data))
-        }
-    
-    def calculate_mode(data: List[float]) -> float:
-        """Calcula la moda de una lista de datos"""
-        if not data:
-            return 0.0
-        
-        # Redondear a 1 decimal para agrupar valores similares
-        rounded_data = [round(x, 1) for x in data]
-        values, counts = np.unique(rounded_data, return_counts=True)
-        mode_index = np.argmax(counts)
-        return float(values[mode_index])
-    
-    # Calcular estadísticas para cada métrica
-    stats = {
-        "temperatura": calculate_basic_stats(temperatures),
-        "presion_arterial": calculate_basic_stats(blood_pressures),
-        "saturacion_oxigeno": calculate_basic_stats(oxygen_saturations),
-        "frecuencia_cardiaca": calculate_basic_stats(heart_rates),
-        "resumen": {
-            "total_registros": len(medical_records),
-            "periodo_analisis": {
-                "fecha_inicio": min(record.created_at for record in medical_records).strftime("%Y-%m-%d"),
-                "fecha_fin": max(record.created_at for record in medical_records).strftime("%Y-%m-%d")
-            }
-        }
+
+def cargar_columnas(db: Session, patient_id: Optional[int] = None, doctor_id: Optional[int] = None,
+                    start_date=None, end_date=None) -> Dict[str, np.ndarray]:
+    """Columnas de las estadísticas en una sola consulta (sesión síncrona)"""
+    return _columnas_desde_filas(db.execute(_consulta_columnas(patient_id, doctor_id, start_date, end_date)).all())
+
+
+def columnas_de_expedientes(medical_records: List[MedicalRecord]) -> Dict[str, np.ndarray]:
+    """Columnas a partir de expedientes ya cargados (la edad se lee una vez por paciente)"""
+    edades = {}
+    filas = []
+    for r in medical_records:
+        patient = r.patient
+        if id(patient) not in edades:
+            edades[id(patient)] = patient.age
+        filas.append((r.temperature, getattr(r, "systolic", None), r.blood_pressure,
+                      r.oxygen_saturation, r.heart_rate, r.created_at, edades[id(patient)]))
+    return _columnas_desde_filas(filas)
+
+
+def _filtrar_fechas(columnas, start_date, end_date):
+    seleccion = np.ones(len(columnas["created_at"]), dtype=bool)
+    if start_date is not None:
+        seleccion &= columnas["created_at"] >= np.datetime64(start_date)
+    if end_date is not None:
+        seleccion &= columnas["created_at"] <= np.datetime64(end_date)
+    if seleccion.all():
+        return columnas
+    return {nombre: valores[seleccion] for nombre, valores in columnas.items()}
+
+
+def calculate_basic_stats(data: np.ndarray) -> Dict[str, float]:
+    """Estadísticas básicas de una columna, ignorando valores ausentes (NaN)"""
+    data = data[~np.isnan(data)]
+    if not data.size:
+        return {}
+    minimo, maximo = float(data.min()), float(data.max())
+    return {
+        "media": float(np.mean(data).round(2)),
+        "mediana": float(np.median(data).round(2)),
+        "moda": calculate_mode(data),
+        "desviacion_estandar": float(np.std(data).round(2)),
+        "minimo": minimo,
+        "maximo": maximo,
+        "rango": maximo - minimo,
     }
-    
+
+
+def calculate_mode(data: np.ndarray) -> float:
+    """Moda de la columna, redondeando a 1 decimal para agrupar valores similares"""
+    if not data.size:
+        return 0.0
+    values, counts = np.unique(np.round(data, 1), return_counts=True)
+    return float(values[np.argmax(counts)])
+
+
+def _parametros(age) -> Dict[str, Any]:
     """
     SECCION DE PARA OBTENER LOS RANGOS PARA EL PACIENTE DEPENDIENTO DE SU INFORMACION
     """
-    parametros = {
-        "rango_bradicardia": get_heart_rate_range(patient.age)[0] - 10,
-        "rango_taquicardia": get_heart_rate_range(patient.age)[1] + 10,
-        "rango_bradiapnea": get_respiratory_rate_range(patient.age)[0] - 5,
-        "rango_taquipnea": get_respiratory_rate_range(patient.age)[1] + 5,
+    return {
+        "rango_bradicardia": get_heart_rate_range(age)[0] - 10,
+        "rango_taquicardia": get_heart_rate_range(age)[1] + 10,
+        "rango_bradiapnea": get_respiratory_rate_range(age)[0] - 5,
+        "rango_taquipnea": get_respiratory_rate_range(age)[1] + 5,
         "rango_hipotermia": 35.0,  # < a 35.0 es hipotermia
         "rango_fiebre": 38.0,  # > 38.0 es fiebre
         "rango_hipertension": 140.0,  # > 140.0 es hipertensión
@@ -96,109 +158,446 @@ async def get_medical_record_statistics(db: Session, medical_records: List[Medic
     }
 
 
+def _armar_respuesta(stats, total, fecha_inicio, fecha_fin, age, conteos) -> Dict[str, Any]:
+    """Forma de la respuesta común al cálculo en NumPy y a los agregados en SQL;
+    `conteos` tiene cuántos registros cumplen cada regla de RIESGOS_ESTADISTICAS"""
+    stats = {
+        **stats,
+        "resumen": {
+            "total_registros": total,
+            "periodo_analisis": {
+                "fecha_inicio": fecha_inicio.strftime("%Y-%m-%d"),
+                "fecha_fin": fecha_fin.strftime("%Y-%m-%d")
+            }
+        }
+    }
+
     """
     SECCION DE PROBABILIDAD
     """
-    def calcular_probabilidad(condicion, registros):
-        if not registros:
-            return 0.0
-        return round(100 * sum(1 for r in registros if condicion(r)) / len(registros), 2)
+    def calcular_probabilidad(nombre):
+        return round(100 * int(conteos[nombre]) / total, 2)
 
     risk_probabilities = {
         # Taquicardia y bradicardia según edad
-        "riesgo_taquicardia": calcular_probabilidad(
-            lambda r: r.heart_rate is not None and r.heart_rate > get_heart_rate_range(r.patient.age)[1],
-            medical_records
-        ),
-        "riesgo_bradicardia": calcular_probabilidad(
-            lambda r: r.heart_rate is not None and r.heart_rate < get_heart_rate_range(r.patient.age)[0],
-            medical_records
-        ),
-        # Frecuencia respiratoria anormal según edad
-        "riesgo_taquipnea": calcular_probabilidad(
-            lambda r: hasattr(r, 'respiratory_rate') and r.respiratory_rate is not None and r.respiratory_rate > get_respiratory_rate_range(r.patient.age)[1],
-            medical_records
-        ),
-        "riesgo_bradipnea": calcular_probabilidad(
-            lambda r: hasattr(r, 'respiratory_rate') and r.respiratory_rate is not None and r.respiratory_rate < get_respiratory_rate_range(r.patient.age)[0],
-            medical_records
-        ),
+        "riesgo_taquicardia": calcular_probabilidad("riesgo_taquicardia"),
+        "riesgo_bradicardia": calcular_probabilidad("riesgo_bradicardia"),
+        # Frecuencia respiratoria anormal según edad (MedicalRecord aún no la registra)
+        "riesgo_taquipnea": 0.0,
+        "riesgo_bradipnea": 0.0,
         # Fiebre e hipotermia
-        "riesgo_fiebre": calcular_probabilidad(
-            lambda r: r.temperature is not None and r.temperature > 38.0,
-            medical_records
-        ),
-        "riesgo_hipotermia": calcular_probabilidad(
-            lambda r: r.temperature is not None and r.temperature < 35.0,
-            medical_records
-        ),
+        "riesgo_fiebre": calcular_probabilidad("riesgo_fiebre"),
+        "riesgo_hipotermia": calcular_probabilidad("riesgo_hipotermia"),
         # Hipertensión e hipotensión con valores estandarizados para adultos
-        "riesgo_hipertension": calcular_probabilidad(
-            lambda r: (parse_blood_pressure(r.blood_pressure) is not None and parse_blood_pressure(r.blood_pressure) > 140.0),
-            medical_records
-        ),
-        "riesgo_hipotension": calcular_probabilidad(
-            lambda r: (parse_blood_pressure(r.blood_pressure) is not None and parse_blood_pressure(r.blood_pressure) < 50.0),
-            medical_records
-        ),
+        "riesgo_hipertension": calcular_probabilidad("riesgo_hipertension"),
+        "riesgo_hipotension": calcular_probabilidad("riesgo_hipotension"),
         # Baja saturación 
-        "riesgo_baja_saturacion": calcular_probabilidad(
-            lambda r: r.oxygen_saturation is not None and r.oxygen_saturation < 90.0 and r.oxygen_saturation > 0.0,
-            medical_records
-        ),
+        "riesgo_baja_saturacion": calcular_probabilidad("riesgo_baja_saturacion"),
     }
-    
-    # --- SECCION DE CORRELACIONES Y PROBABILIDADES COMBINADAS ---
-
-    # Calcular correlaciones entre variables principales
-    # correlaciones = {}
-    # try:
-    #     data = {
-    #         "temperatura": [r.temperature for r in medical_records],
-    #         "presion_arterial": [r.blood_pressure for r in medical_records],
-    #         "saturacion_oxigeno": [r.oxygen_saturation for r in medical_records],
-    #         "frecuencia_cardiaca": [r.heart_rate for r in medical_records],
-    #     }
-    #     df = pd.DataFrame(data)
-    #     corr_matrix = df.corr(method="pearson")
-    #     # Reemplazar NaN e infinitos por None para compatibilidad JSON
-    #     corr_matrix = corr_matrix.replace([np.nan, np.inf, -np.inf], None)
-    #     correlaciones = corr_matrix.to_dict()
-    # except Exception as e:
-    #     correlaciones = {"error": str(e)}
-
-    # Probabilidad de agitación: fiebre + taquicardia
-    def probabilidad_coincidencia(cond1, cond2, registros):
-        if not registros:
-            return 0.0
-        return round(100 * sum(1 for r in registros if cond1(r) and cond2(r)) / len(registros), 2)
-
-    prob_agitacion = probabilidad_coincidencia(
-        lambda r: r.temperature is not None and r.temperature > 38.0,
-        lambda r: r.heart_rate is not None and r.heart_rate > get_heart_rate_range(r.patient.age)[1],
-        medical_records
-    )
-    # Ejemplo extendido: shock (hipotensión + taquicardia + baja saturación)
-    def condicion_shock(r):
-        systolic_bp = parse_blood_pressure(r.blood_pressure)
-        return (
-            systolic_bp is not None and systolic_bp < 90.0 and
-            r.heart_rate is not None and r.heart_rate > get_heart_rate_range(r.patient.age)[1] and
-            r.oxygen_saturation is not None and r.oxygen_saturation < 90.0
-        )
-    prob_shock = calcular_probabilidad(condicion_shock, medical_records)
-
-    # Puedes agregar más combinaciones clínicas aquí
 
+    # Probabilidad de agitación (fiebre + taquicardia) y de shock
+    # (hipotensión + taquicardia + baja saturación)
+    # Puedes agregar más combinaciones clínicas en RIESGOS_ESTADISTICAS
     combinaciones_clinicas = {
-        "probabilidad_agitacion": prob_agitacion,
-        "probabilidad_shock": prob_shock,
+        "probabilidad_agitacion": calcular_probabilidad("probabilidad_agitacion"),
+        "probabilidad_shock": calcular_probabilidad("probabilidad_shock"),
     }
-    
+
     return {
     "estadisticas": stats,
     "probabilidades_riesgo": risk_probabilities,
-    "parametros": parametros,
-    # "correlaciones": correlaciones,
+    # Los parámetros se reportan según el paciente del primer registro
+    "parametros": _parametros(age),
     "combinaciones_clinicas": combinaciones_clinicas,
     }
+
+
+def _conteos_riesgo(columnas) -> Dict[str, int]:
+    """Registros que cumplen cada regla de RIESGOS_ESTADISTICAS"""
+    # Los umbrales de frecuencia cardiaca dependen de la edad
+    hr_min, hr_max = umbrales_fc(columnas["age"])
+    mascaras = mascaras_riesgo_estadisticas({
+        "temperature": columnas["temperature"],
+        "systolic": columnas["systolic"],
+        "oxygen_saturation": columnas["oxygen_saturation"],
+        "heart_rate": columnas["heart_rate"],
+        "hr_min": hr_min,
+        "hr_max": hr_max,
+    })
+    return {nombre: int(np.count_nonzero(mascara)) for nombre, mascara in mascaras.items()}
+
+
+def calcular_estadisticas(columnas: Dict[str, np.ndarray]) -> Dict[str, Any]:
+    """Estadísticas, probabilidades de riesgo y combinaciones clínicas sobre columnas NumPy"""
+    total = len(columnas["created_at"])
+    if not total:
+        return {"error": "No hay registros médicos para analizar"}
+
+    stats = {
+        nombre: calculate_basic_stats(columnas[columna]) for nombre, columna in METRICAS.items()
+    }
+    return _armar_respuesta(
+        stats, total,
+        pd.Timestamp(columnas["created_at"].min()), pd.Timestamp(columnas["created_at"].max()),
+        columnas["age"][0].item(), _conteos_riesgo(columnas),
+    )
+
+
+def estadisticas_sql(db: Session, patient_id: Optional[int] = None, doctor_id: Optional[int] = None,
+                     start_date=None, end_date=None) -> Dict[str, Any]:
+    """
+    Misma respuesta que calcular_estadisticas, pero con los agregados calculados en
+    PostgreSQL: solo una fila de resultados cruza la red, no el historial completo
+    """
+    filtros = _filtros(patient_id, doctor_id, start_date, end_date)
+    # La sistólica derivada se define una sola vez en la subconsulta y los agregados la reutilizan
+    base = (
+        select(
+            MedicalRecord.temperature,
+            systolic_sql(MedicalRecord.systolic, MedicalRecord.blood_pressure).label("systolic"),
+            MedicalRecord.oxygen_saturation, MedicalRecord.heart_rate, MedicalRecord.created_at, User.age,
+        )
+        .join(User, MedicalRecord.patient_id == User.id)
+        .where(*filtros)
+        .subquery()
+    )
+    hr_min, hr_max = heart_rate_range_sql(base.c.age)
+    columnas = {
+        "temperature": base.c.temperature,
+        "systolic": base.c.systolic,
+        "oxygen_saturation": base.c.oxygen_saturation,
+        "heart_rate": base.c.heart_rate,
+        "hr_min": hr_min,
+        "hr_max": hr_max,
+    }
+
+    agregados = [
+        func.count().label("total"),
+        func.min(base.c.created_at).label("fecha_inicio"),
+        func.max(base.c.created_at).label("fecha_fin"),
+        # Edad del paciente del primer registro, para los parámetros
+        select(User.age).join(MedicalRecord, MedicalRecord.patient_id == User.id)
+        .where(*filtros).order_by(MedicalRecord.id).limit(1).scalar_subquery().label("age"),
+    ]
+    for columna in METRICAS.values():
+        valor = columnas[columna]
+        agregados += [
+            func.count(valor).label(f"{columna}_n"),
+            func.avg(valor).label(f"{columna}_media"),
+            func.percentile_cont(0.5).within_group(valor).label(f"{columna}_mediana"),
+            func.mode().within_group(func.round(cast(valor, Numeric), 1)).label(f"{columna}_moda"),
+            func.stddev_pop(valor).label(f"{columna}_desviacion"),
+            func.min(valor).label(f"{columna}_minimo"),
+            func.max(valor).label(f"{columna}_maximo"),
+        ]
+    riesgos = filtros_riesgo_estadisticas(columnas)
+    for nombre, condicion in riesgos.items():
+        agregados.append(func.count().filter(condicion).label(nombre))
+
+    fila = db.execute(select(*agregados).select_from(base)).mappings().one()
+    if not fila["total"]:
+        return {"error": "No hay registros médicos para analizar"}
+
+    stats = {}
+    for nombre, columna in METRICAS.items():
+        if not fila[f"{columna}_n"]:
+            stats[nombre] = {}
+            continue
+        minimo, maximo = float(fila[f"{columna}_minimo"]), float(fila[f"{columna}_maximo"])
+        stats[nombre] = {
+            "media": round(float(fila[f"{columna}_media"]), 2),
+            "mediana": round(float(fila[f"{columna}_mediana"]), 2),
+            "moda": float(fila[f"{columna}_moda"]),
+            "desviacion_estandar": round(float(fila[f"{columna}_desviacion"]), 2),
+            "minimo": minimo,
+            "maximo": maximo,
+            "rango": maximo - minimo,
+        }
+    conteos = {nombre: fila[nombre] for nombre in riesgos}
+    return _armar_respuesta(stats, fila["total"], fila["fecha_inicio"], fila["fecha_fin"], fila["age"], conteos)
+
+
+def _tramos_rollup(start_date, end_date):
+    """Cubetas que cubren [start_date, end_date): días completos y horas en los extremos"""
+    inicio = pd.Timestamp(start_date).to_pydatetime() if start_date is not None else None
+    fin = pd.Timestamp(end_date).to_pydatetime() if end_date is not None else None
+    primer_dia = pd.Timestamp(inicio).ceil("D").to_pydatetime() if inicio else None
+    primera_hora = pd.Timestamp(inicio).ceil("h").to_pydatetime() if inicio else None
+    ultimo_dia = pd.Timestamp(fin).floor("D").to_pydatetime() if fin else None
+    ultima_hora = pd.Timestamp(fin).floor("h").to_pydatetime() if fin else None
+
+    if primer_dia and ultimo_dia and primer_dia >= ultimo_dia:
+        return [("hour", primera_hora, ultima_hora)]
+    tramos = [("day", primer_dia, ultimo_dia)]
+    if primera_hora and primera_hora < primer_dia:
+        tramos.append(("hour", primera_hora, primer_dia))
+    if ultima_hora and ultimo_dia < ultima_hora:
+        tramos.append(("hour", ultimo_dia, ultima_hora))
+    return tramos
+
+
+def estadisticas_rollup(db: Session, patient_id: Optional[int] = None, doctor_id: Optional[int] = None,
+                        start_date=None, end_date=None) -> Dict[str, Any]:
+    """
+    Estadísticas combinando cubetas de vital_rollup en lugar de recorrer medical_record.
+    Media, desviación, extremos y probabilidades son exactos; la mediana y la moda no se
+    pueden combinar desde sumas y se devuelven como None. Los rangos se alinean a horas.
+    """
+    filtros = []
+    if patient_id is not None:
+        filtros.append(VitalRollup.patient_id == patient_id)
+    if doctor_id is not None:
+        filtros.append(VitalRollup.doctor_id == doctor_id)
+    tramos = []
+    for granularidad, desde, hasta in _tramos_rollup(start_date, end_date):
+        condiciones = [VitalRollup.granularity == granularidad]
+        if desde is not None:
+            condiciones.append(VitalRollup.bucket >= desde)
+        if hasta is not None:
+            condiciones.append(VitalRollup.bucket < hasta)
+        tramos.append(and_(*condiciones))
+    filtros.append(or_(*tramos))
+
+    agregados = [
+        func.sum(VitalRollup.count).label("total"),
+        func.min(VitalRollup.first_at).label("fecha_inicio"),
+        func.max(VitalRollup.last_at).label("fecha_fin"),
+        # Edad del paciente con el registro más antiguo, para los parámetros
+        select(User.age).join(VitalRollup, VitalRollup.patient_id == User.id)
+        .where(*filtros).order_by(VitalRollup.first_at).limit(1).scalar_subquery().label("age"),
+    ]
+    for columna in METRICAS.values():
+        agregados += [
+            func.sum(getattr(VitalRollup, f"{columna}_n")).label(f"{columna}_n"),
+            func.sum(getattr(VitalRollup, f"{columna}_sum")).label(f"{columna}_sum"),
+            func.sum(getattr(VitalRollup, f"{columna}_sumsq")).label(f"{columna}_sumsq"),
+            func.min(getattr(VitalRollup, f"{columna}_min")).label(f"{columna}_min"),
+            func.max(getattr(VitalRollup, f"{columna}_max")).label(f"{columna}_max"),
+        ]
+    agregados += [func.sum(getattr(VitalRollup, nombre)).label(nombre) for nombre in RIESGOS_ROLLUP]
+
+    fila = db.execute(select(*agregados).where(*filtros)).mappings().one()
+    if not fila["total"]:
+        return {"error": "No hay registros médicos para analizar"}
+
+    stats = {}
+    for nombre, columna in METRICAS.items():
+        n = fila[f"{columna}_n"]
+        if not n:
+            stats[nombre] = {}
+            continue
+        media = fila[f"{columna}_sum"] / n
+        varianza = max(fila[f"{columna}_sumsq"] / n - media ** 2, 0.0)
+        minimo, maximo = float(fila[f"{columna}_min"]), float(fila[f"{columna}_max"])
+        stats[nombre] = {
+            "media": round(media, 2),
+            "mediana": None,
+            "moda": None,
+            "desviacion_estandar": round(math.sqrt(varianza), 2),
+            "minimo": minimo,
+            "maximo": maximo,
+            "rango": maximo - minimo,
+        }
+    conteos = {nombre: fila[nombre] for nombre in RIESGOS_ROLLUP}
+    return _armar_respuesta(stats, int(fila["total"]), fila["fecha_inicio"], fila["fecha_fin"], fila["age"], conteos)
+
+
+async def get_medical_record_statistics(db: Session, medical_records: List[MedicalRecord],
+                                        start_date=None, end_date=None) -> Dict[str, Any]:
+    """
+    Calcula estadísticas básicas de expedientes ya cargados (opcionalmente en un rango de fechas)
+    """
+    if not medical_records:
+        return {"error": "No hay registros médicos para analizar"}
+    columnas = _filtrar_fechas(columnas_de_expedientes(medical_records), start_date, end_date)
+    return calcular_estadisticas(columnas)
+
+
+async def get_statistics(db: AsyncSession, patient_id: Optional[int] = None, doctor_id: Optional[int] = None,
+                         start_date=None, end_date=None) -> Dict[str, Any]:
+    """
+    Estadísticas de un paciente o de los pacientes de un doctor leyendo solo las columnas
+    necesarias; es la ruta rápida para rangos grandes (p. ej. un año de registros por minuto)
+    """
+    if STATISTICS_MODE == "rollup":
+        return await db.run_sync(estadisticas_rollup, patient_id, doctor_id, start_date, end_date)
+    if STATISTICS_MODE == "sql" and db.bind.dialect.name == "postgresql":
+        return await db.run_sync(estadisticas_sql, patient_id, doctor_id, start_date, end_date)
+    filas = (await db.execute(_consulta_columnas(patient_id, doctor_id, start_date, end_date))).all()
+    # El cálculo NumPy corre en un hilo para no detener el event loop
+    return await asyncio.to_thread(lambda: calcular_estadisticas(_columnas_desde_filas(filas)))
+
+
+"""
+DESGLOSE POR PACIENTE PARA LOS DOCTORES
+"""
+# Procesos para el cálculo por paciente (0 = en un hilo, sin procesos) y consultas simultáneas
+STATS_WORKERS = int(os.getenv('STATS_WORKERS', str(min(4, os.cpu_count() or 1))))
+STATS_FETCH_CONCURRENCY = int(os.getenv('STATS_FETCH_CONCURRENCY', '4'))
+STATS_PATIENTS_PER_TASK = int(os.getenv('STATS_PATIENTS_PER_TASK', '20'))
+
+_pool_estadisticas = None
+
+
+def _pool():
+    """Pool de procesos creado en el primer uso; spawn como los workers de ingesta"""
+    global _pool_estadisticas
+    if _pool_estadisticas is None:
+        _pool_estadisticas = ProcessPoolExecutor(
+            max_workers=STATS_WORKERS, mp_context=multiprocessing.get_context("spawn")
+        )
+    return _pool_estadisticas
+
+
+def iniciar_pool():
+    """Arranca los procesos al iniciar la app: cada uno importa la app completa y
+    hacerlo en el primer request costaría segundos"""
+    if STATS_WORKERS > 0:
+        for _ in range(STATS_WORKERS):
+            _pool().submit(int)
+
+
+def cerrar_pool():
+    global _pool_estadisticas
+    if _pool_estadisticas is not None:
+        _pool_estadisticas.shutdown(wait=False, cancel_futures=True)
+        _pool_estadisticas = None
+
+
+def _consulta_por_paciente(patient_ids, doctor_id, start_date, end_date):
+    """SELECT de las columnas de un grupo de pacientes, ordenadas por paciente"""
+    return (
+        select(
+            MedicalRecord.patient_id,
+            MedicalRecord.temperature, MedicalRecord.systolic, MedicalRecord.blood_pressure,
+            MedicalRecord.oxygen_saturation, MedicalRecord.heart_rate, MedicalRecord.created_at, User.age,
+        )
+        .join(User, MedicalRecord.patient_id == User.id)
+        .where(MedicalRecord.patient_id.in_(patient_ids), *_filtros(None, doctor_id, start_date, end_date))
+        .order_by(MedicalRecord.patient_id, MedicalRecord.id)
+    )
+
+
+def _separar_por_paciente(filas):
+    """Columnas NumPy de cada paciente a partir de las filas de _consulta_por_paciente"""
+    pacientes = np.fromiter((fila[0] for fila in filas), np.int64, len(filas))
+    columnas = _columnas_desde_filas([fila[1:] for fila in filas])
+    ids, inicios = np.unique(pacientes, return_index=True)
+    limites = list(inicios[1:]) + [len(pacientes)]
+    return [
+        (int(patient_id), {nombre: valores[inicio:fin] for nombre, valores in columnas.items()})
+        for patient_id, inicio, fin in zip(ids, inicios, limites)
+    ]
+
+
+def _parcial(data: np.ndarray):
+    """(n, media, M2, mínimo, máximo) de una columna, para combinar entre pacientes"""
+    data = data[~np.isnan(data)]
+    if not data.size:
+        return (0, 0.0, 0.0, None, None)
+    media = float(data.mean())
+    return (int(data.size), media, float(((data - media) ** 2).sum()), float(data.min()), float(data.max()))
+
+
+def resumir_pacientes(grupo):
+    """Estadísticas de cada paciente de un grupo más los parciales para la cohorte.
+    Corre en el pool de procesos: recibe y devuelve solo datos serializables."""
+    resultados = []
+    for patient_id, columnas in grupo:
+        parcial = {
+            "total": len(columnas["created_at"]),
+            "inicio": columnas["created_at"].min(),
+            "fin": columnas["created_at"].max(),
+            "age": columnas["age"][0].item(),
+            "metricas": {columna: _parcial(columnas[columna]) for columna in METRICAS.values()},
+            "conteos": _conteos_riesgo(columnas),
+        }
+        resultados.append((patient_id, calcular_estadisticas(columnas), parcial))
+    return resultados
+
+
+def _combinar(a, b):
+    """Combina dos parciales (n, media, M2, mín, máx) con la fórmula de Chan"""
+    if not a[0]:
+        return b
+    if not b[0]:
+        return a
+    n = a[0] + b[0]
+    delta = b[1] - a[1]
+    return (
+        n,
+        a[1] + delta * b[0] / n,
+        a[2] + b[2] + delta ** 2 * a[0] * b[0] / n,
+        min(a[3], b[3]),
+        max(a[4], b[4]),
+    )
+
+
+def _resumen_cohorte(parciales):
+    """Resumen de todos los pacientes a partir de sus parciales (sin recorrer los registros)"""
+    total = sum(p["total"] for p in parciales)
+    stats = {}
+    for nombre, columna in METRICAS.items():
+        acumulado = (0, 0.0, 0.0, None, None)
+        for p in parciales:
+            acumulado = _combinar(acumulado, p["metricas"][columna])
+        n, media, m2, minimo, maximo = acumulado
+        stats[nombre] = {} if not n else {
+            "media": round(media, 2),
+            "desviacion_estandar": round(math.sqrt(m2 / n), 2),
+            "minimo": minimo,
+            "maximo": maximo,
+            "rango": maximo - minimo,
+        }
+    conteos = {nombre: sum(p["conteos"][nombre] for p in parciales) for nombre in parciales[0]["conteos"]}
+    cohorte = _armar_respuesta(
+        stats, total,
+        pd.Timestamp(min(p["inicio"] for p in parciales)), pd.Timestamp(max(p["fin"] for p in parciales)),
+        parciales[0]["age"], conteos,
+    )
+    # Los parámetros dependen de la edad de cada paciente; van en el desglose
+    del cohorte["parametros"]
+    cohorte["total_pacientes"] = len(parciales)
+    cohorte["pacientes_con_riesgo"] = {
+        nombre: sum(1 for p in parciales if p["conteos"][nombre]) for nombre in conteos
+    }
+    return cohorte
+
+
+async def get_doctor_patients_breakdown(db: AsyncSession, doctor_id: int, start_date=None, end_date=None) -> Dict[str, Any]:
+    """
+    Estadísticas por paciente de un doctor y el resumen de la cohorte. Los grupos de
+    pacientes se consultan en paralelo (una AsyncSession por consulta) y el cálculo NumPy
+    de cada grupo corre en el pool de procesos en cuanto llegan sus filas.
+    """
+    patient_ids = list(await db.scalars(
+        select(MedicalRecord.patient_id).distinct()
+        .where(*_filtros(None, doctor_id, start_date, end_date))
+        .order_by(MedicalRecord.patient_id)
+    ))
+    if not patient_ids:
+        return {"error": "No hay registros médicos para analizar"}
+
+    loop = asyncio.get_running_loop()
+    consultas = asyncio.Semaphore(STATS_FETCH_CONCURRENCY)
+
+    async def procesar(grupo_ids):
+        async with consultas, AsyncSessionLocal() as sesion:
+            filas = (await sesion.execute(_consulta_por_paciente(grupo_ids, doctor_id, start_date, end_date))).all()
+        grupo = await asyncio.to_thread(_separar_por_paciente, filas)
+        if STATS_WORKERS > 0:
+            try:
+                return await loop.run_in_executor(_pool(), resumir_pacientes, grupo)
+            except BrokenProcessPool:
+                # Un worker murió: se descarta el pool (el siguiente request crea otro)
+                cerrar_pool()
+        return await asyncio.to_thread(resumir_pacientes, grupo)
+
+    grupos = [patient_ids[i:i + STATS_PATIENTS_PER_TASK] for i in range(0, len(patient_ids), STATS_PATIENTS_PER_TASK)]
+    resultados = [r for parte in await asyncio.gather(*(procesar(g) for g in grupos)) for r in parte]
+
+    return {
+        "doctor_id": doctor_id,
+        "pacientes": [{"patient_id": patient_id, **estadisticas} for patient_id, estadisticas, _ in resultados],
+        "cohorte": _resumen_cohorte([parcial for _, _, parcial in resultados]),
+    }
@@ -0,0 +1,201 @@
+"""
+Caché de resultados de estadísticas con invalidación por paciente y por doctor.
+
+La clave de un resultado es (alcance, id, rango, generación). Cada paciente y cada
+doctor tienen un contador de generación que se incrementa al crear, editar o borrar
+uno de sus expedientes; las entradas con la generación anterior ya no se vuelven a
+leer y terminan desalojadas por LRU/TTL. Así no hace falta recorrer la caché para
+invalidar y un resultado calculado en paralelo con una escritura nunca se sirve como
+vigente.
+
+La caché necesita `STATS_CACHE_URL=redis://...`: los expedientes del ciclo de agregación
+se escriben en el proceso del websocket y sus invalidaciones solo llegan a main.py a
+través de Redis. Sin Redis la caché queda desactivada. `STATS_CACHE_LOCAL=true` usa una
+caché en memoria por proceso, que solo ve las invalidaciones de su propio proceso: un
+despliegue con ingesta aparte sirve resultados viejos hasta `STATS_CACHE_TTL` segundos.
+"""
+import os
+import json
+import asyncio
+import time
+import logging
+import threading
+from collections import OrderedDict
+from app.shared.config.metrics import STATS_CACHE_REQUESTS, STATS_CACHE_INVALIDATIONS
+
+logger = logging.getLogger(__name__)
+
+STATS_CACHE_ENABLED = os.getenv('STATS_CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+STATS_CACHE_MAX_ENTRIES = int(os.getenv('STATS_CACHE_MAX_ENTRIES', '2048'))
+STATS_CACHE_TTL = float(os.getenv('STATS_CACHE_TTL', '60'))
+STATS_CACHE_URL = os.getenv('STATS_CACHE_URL', '')
+# Caché en memoria sin Redis; solo correcta si un único proceso escribe y lee expedientes
+STATS_CACHE_LOCAL = os.getenv('STATS_CACHE_LOCAL', 'false').lower() in ('1', 'true', 'yes')
+
+estadisticas_cache = {"hits": 0, "misses": 0, "invalidaciones": 0}
+
+
+class CacheLocal:
+    """LRU con TTL en memoria del proceso"""
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entradas = OrderedDict()  # clave -> (expira, valor)
+        self._generaciones = {}
+        self._lock = threading.Lock()
+
+    def generacion(self, alcance):
+        with self._lock:
+            return self._generaciones.get(alcance, 0)
+
+    def invalidar(self, alcances):
+        with self._lock:
+            for alcance in alcances:
+                self._generaciones[alcance] = self._generaciones.get(alcance, 0) + 1
+
+    def get(self, clave):
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is None:
+                return None
+            if entrada[0] < time.monotonic():
+                del self._entradas[clave]
+                return None
+            self._entradas.move_to_end(clave)
+            return entrada[1]
+
+    def set(self, clave, valor):
+        with self._lock:
+            self._entradas[clave] = (time.monotonic() + self.ttl, valor)
+            self._entradas.move_to_end(clave)
+            while len(self._entradas) > self.max_entries:
+                self._entradas.popitem(last=False)
+
+    def tamano(self):
+        return len(self._entradas)
+
+
+class CacheRedis:
+    """Caché compartida en Redis; el desalojo LRU lo hace Redis (maxmemory-policy)"""
+
+    def __init__(self, url, ttl, prefijo="smartvitals:stats"):
+        import redis  # Dependencia opcional, solo con STATS_CACHE_URL
+        self._redis = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefijo = prefijo
+
+    def generacion(self, alcance):
+        valor = self._redis.get(f"{self.prefijo}:gen:{alcance}")
+        return int(valor) if valor else 0
+
+    def invalidar(self, alcances):
+        pipe = self._redis.pipeline(transaction=False)
+        for alcance in alcances:
+            pipe.incr(f"{self.prefijo}:gen:{alcance}")
+        pipe.execute()
+
+    def get(self, clave):
+        valor = self._redis.get(f"{self.prefijo}:val:{clave}")
+        return json.loads(valor) if valor is not None else None
+
+    def set(self, clave, valor):
+        self._redis.set(f"{self.prefijo}:val:{clave}", json.dumps(valor), ex=max(1, int(self.ttl)))
+
+    def tamano(self):
+        return None
+
+
+def crear_cache():
+    """Caché Redis, la local si se pidió explícitamente, o None (sin caché)"""
+    if not STATS_CACHE_ENABLED:
+        return None
+    if STATS_CACHE_URL:
+        try:
+            return CacheRedis(STATS_CACHE_URL, STATS_CACHE_TTL)
+        except ImportError:
+            logger.error("STATS_CACHE_URL requiere el paquete redis")
+    if STATS_CACHE_LOCAL:
+        logger.warning(
+            "Caché de estadísticas LOCAL: no ve las invalidaciones de otros procesos (p. ej. el ciclo "
+            f"de agregación del websocket); puede servir resultados viejos hasta {STATS_CACHE_TTL:g}s. "
+            "Usa STATS_CACHE_URL=redis://... si la ingesta corre en otro proceso"
+        )
+        return CacheLocal(STATS_CACHE_MAX_ENTRIES, STATS_CACHE_TTL)
+    logger.warning("Caché de estadísticas desactivada: requiere STATS_CACHE_URL (Redis) para invalidarse entre procesos")
+    return None
+
+
+cache = crear_cache()
+
+
+async def _llamar(funcion, *args):
+    """Las llamadas a Redis son de red y bloqueantes: desde el event loop van a un hilo"""
+    if isinstance(cache, CacheRedis):
+        return await asyncio.to_thread(funcion, *args)
+    return funcion(*args)
+
+
+def _alcances(patient_id, doctor_id):
+    alcances = [f"patient:{patient_id}"]
+    if doctor_id:
+        alcances.append(f"doctor:{doctor_id}")
+    return alcances
+
+
+async def obtener(alcance, id, start_date, end_date, calcular, variante=""):
+    """Resultado en caché para (alcance, id, rango) o el de `await calcular()`;
+    `variante` distingue respuestas distintas del mismo alcance (p. ej. el desglose)"""
+    if cache is None:
+        return await calcular()
+    try:
+        generacion = await _llamar(cache.generacion, f"{alcance}:{id}")
+        clave = f"{alcance}:{id}:{variante}:{start_date}:{end_date}:{generacion}"
+        valor = await _llamar(cache.get, clave)
+    except Exception as e:
+        logger.error(f"Caché de estadísticas no disponible: {e}")
+        return await calcular()
+    if valor is not None:
+        estadisticas_cache["hits"] += 1
+        STATS_CACHE_REQUESTS.labels("hit").inc()
+        return valor
+
+    estadisticas_cache["misses"] += 1
+    STATS_CACHE_REQUESTS.labels("miss").inc()
+    valor = await calcular()
+    try:
+        await _llamar(cache.set, clave, valor)
+    except Exception as e:
+        logger.error(f"No se pudo guardar en la caché de estadísticas: {e}")
+    return valor
+
+
+def invalidar(*registros):
+    """Invalida las estadísticas de los (patient_id, doctor_id) cuyos expedientes cambiaron"""
+    if cache is None:
+        return
+    alcances = {alcance for patient_id, doctor_id in registros for alcance in _alcances(patient_id, doctor_id)}
+    if not alcances:
+        return
+    try:
+        cache.invalidar(alcances)
+    except Exception as e:
+        logger.error(f"No se pudo invalidar la caché de estadísticas: {e}")
+        return
+    estadisticas_cache["invalidaciones"] += len(alcances)
+    STATS_CACHE_INVALIDATIONS.inc(len(alcances))
+
+
+async def invalidar_async(*registros):
+    """`invalidar` para las rutas async, sin bloquear el event loop con Redis"""
+    await _llamar(invalidar, *registros)
+
+
+def estadisticas():
+    total = estadisticas_cache["hits"] + estadisticas_cache["misses"]
+    return {
+        **estadisticas_cache,
+        "hit_ratio": round(estadisticas_cache["hits"] / total, 3) if total else None,
+        "backend": "redis" if isinstance(cache, CacheRedis) else ("local" if cache else None),
+        "entradas": cache.tamano() if cache else None,
+    }
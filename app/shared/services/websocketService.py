@@ -0,0 +1,272 @@
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+from app.shared.config.database import SessionLocal
+from app.models.doctorPatient import DoctorPatient
+from app.shared.services import ecgService
+from app.shared.config.metrics import WS_CONNECTIONS, WS_SEND_SECONDS, WS_DROPPED
+
+logger = logging.getLogger(__name__)
+
+# Tamaño de la cola de salida de cada conexión antes de empezar a coalescer
+WS_SEND_QUEUE_SIZE = int(os.getenv('WS_SEND_QUEUE_SIZE', '256'))
+
+
+class Conexion:
+    """Un WebSocket con su propia cola de salida acotada y su tarea de envío.
+
+    Los frames de signos vitales llevan una clave (patient_id, topic). Cuando la cola
+    está llena, un frame nuevo reemplaza al pendiente con la misma clave (solo se
+    conserva el más reciente) o se descarta; las alertas y notificaciones nunca se
+    descartan.
+    """
+
+    def __init__(self, ws, user_id=None, rol=None, max_size=WS_SEND_QUEUE_SIZE):
+        self.ws = ws
+        self.user_id = str(user_id) if user_id else None
+        self.rol = rol
+        self.max_size = max_size
+        self.pacientes = set()
+        self.ecg = {}  # {patient_id: (display_rate, formato)}
+        self._cola = deque()  # Entradas [clave, mensaje]
+        self._por_clave = {}  # Última entrada pendiente por clave
+        self._hay_datos = asyncio.Event()
+        self._tarea = None
+        self.enviados = 0
+        self.descartados = 0
+        self.coalescidos = 0
+        self.max_profundidad = 0
+
+    def encolar(self, message, clave=None):
+        if clave is not None and len(self._cola) >= self.max_size:
+            entrada = self._por_clave.get(clave)
+            if entrada is not None:
+                entrada[1] = message
+                self.coalescidos += 1
+                WS_DROPPED.labels("coalesced").inc()
+            else:
+                self.descartados += 1
+                WS_DROPPED.labels("dropped").inc()
+            return
+        entrada = [clave, message]
+        self._cola.append(entrada)
+        if clave is not None:
+            self._por_clave[clave] = entrada
+        self.max_profundidad = max(self.max_profundidad, len(self._cola))
+        self._hay_datos.set()
+
+    async def _enviar(self):
+        while True:
+            await self._hay_datos.wait()
+            self._hay_datos.clear()
+            while self._cola:
+                entrada = self._cola.popleft()
+                clave, message = entrada
+                if clave is not None and self._por_clave.get(clave) is entrada:
+                    del self._por_clave[clave]
+                inicio = time.perf_counter()
+                if isinstance(message, bytes):
+                    await self.ws.send_bytes(message)
+                else:
+                    await self.ws.send_text(message)
+                WS_SEND_SECONDS.observe(time.perf_counter() - inicio)
+                self.enviados += 1
+
+    async def _enviar_seguro(self):
+        try:
+            await self._enviar()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error enviando a WebSocket de usuario {self.user_id}: {e}")
+            unregister_client(self.ws)
+
+    def iniciar(self):
+        self._tarea = asyncio.create_task(self._enviar_seguro())
+
+    def detener(self):
+        if self._tarea is not None and self._tarea is not asyncio.current_task():
+            self._tarea.cancel()
+
+    def estadisticas(self):
+        return {
+            "user_id": self.user_id,
+            "rol": self.rol,
+            "subscriptions": len(self.pacientes),
+            "ecg_subscriptions": len(self.ecg),
+            "queue_depth": len(self._cola),
+            "max_queue_depth": self.max_profundidad,
+            "sent": self.enviados,
+            "dropped": self.descartados,
+            "coalesced": self.coalescidos,
+        }
+
+
+# Registro de conexiones del servicio websocket (solo se usa desde el event loop)
+conexiones = {}  # {WebSocket: Conexion}
+user_ws_map = {}  # {user_id: set(Conexion)}, un usuario puede tener varias pestañas
+patient_subscribers = {}  # {patient_id: set(Conexion)}
+WS_CONNECTIONS.set_function(lambda: len(conexiones))
+ecg_subscribers = {}  # {patient_id: set(Conexion)}, con su frecuencia y formato en Conexion.ecg
+
+
+def register_client(ws, user_id=None, rol=None):
+    conexion = Conexion(ws, user_id, rol)
+    conexiones[ws] = conexion
+    if conexion.user_id:
+        user_ws_map.setdefault(conexion.user_id, set()).add(conexion)
+    conexion.iniciar()
+    return conexion
+
+
+def subscribe(ws, patient_ids):
+    conexion = conexiones.get(ws)
+    if conexion is None:
+        return
+    for patient_id in patient_ids:
+        patient_subscribers.setdefault(int(patient_id), set()).add(conexion)
+        conexion.pacientes.add(int(patient_id))
+
+
+def unsubscribe(ws, patient_ids=None):
+    """Quita suscripciones de un socket; sin `patient_ids` las quita todas"""
+    conexion = conexiones.get(ws)
+    if conexion is None:
+        return
+    for patient_id in list(conexion.pacientes if patient_ids is None else patient_ids):
+        patient_id = int(patient_id)
+        conexion.pacientes.discard(patient_id)
+        suscriptores = patient_subscribers.get(patient_id)
+        if suscriptores is not None:
+            suscriptores.discard(conexion)
+            if not suscriptores:
+                del patient_subscribers[patient_id]
+
+
+def subscribe_ecg(ws, patient_ids, display_rate=None, formato="int16"):
+    """Suscribe un socket al ECG de los pacientes con su frecuencia de visualización"""
+    conexion = conexiones.get(ws)
+    if conexion is None:
+        return
+    preferencia = (
+        float(display_rate or ecgService.ECG_DEFAULT_DISPLAY_RATE),
+        ecgService.FORMATOS.get(formato, ecgService.FORMATO_INT16),
+    )
+    for patient_id in patient_ids:
+        ecg_subscribers.setdefault(int(patient_id), set()).add(conexion)
+        conexion.ecg[int(patient_id)] = preferencia
+
+
+def unsubscribe_ecg(ws, patient_ids=None):
+    conexion = conexiones.get(ws)
+    if conexion is None:
+        return
+    for patient_id in list(conexion.ecg if patient_ids is None else patient_ids):
+        patient_id = int(patient_id)
+        conexion.ecg.pop(patient_id, None)
+        suscriptores = ecg_subscribers.get(patient_id)
+        if suscriptores is not None:
+            suscriptores.discard(conexion)
+            if not suscriptores:
+                del ecg_subscribers[patient_id]
+                ecgService.olvidar_paciente(patient_id)
+
+
+def unregister_client(ws):
+    conexion = conexiones.get(ws)
+    if conexion is None:
+        return
+    unsubscribe(ws)
+    unsubscribe_ecg(ws)
+    del conexiones[ws]
+    if conexion.user_id:
+        sockets_usuario = user_ws_map.get(conexion.user_id)
+        if sockets_usuario is not None:
+            sockets_usuario.discard(conexion)
+            if not sockets_usuario:
+                del user_ws_map[conexion.user_id]
+    conexion.detener()
+
+
+def _pacientes_permitidos(user_id, patient_ids):
+    db = SessionLocal()
+    try:
+        asignados = {
+            row.patient_id for row in db.query(DoctorPatient.patient_id).filter(
+                DoctorPatient.doctor_id == int(user_id),
+                DoctorPatient.patient_id.in_(patient_ids)
+            )
+        }
+    finally:
+        db.close()
+    # Un paciente siempre puede ver sus propios datos
+    return [pid for pid in patient_ids if pid == int(user_id) or pid in asignados]
+
+
+async def pacientes_permitidos(user_id, patient_ids):
+    """Filtra los pacientes que el usuario puede monitorear según DoctorPatient"""
+    if not user_id:
+        return []
+    patient_ids = [int(pid) for pid in patient_ids]
+    return await asyncio.to_thread(_pacientes_permitidos, user_id, patient_ids)
+
+
+def resolver_destinos(message_data):
+    """Devuelve las conexiones destino de un mensaje"""
+    message_type = message_data.get("type")
+    if message_type == "broadcast":
+        return list(conexiones.values())
+    if message_type == "patient":
+        # Datos de un paciente: solo a las conexiones suscritas a él
+        destinos = set()
+        for patient_id in message_data.get("target_users", []):
+            try:
+                destinos.update(patient_subscribers.get(int(patient_id), ()))
+            except (TypeError, ValueError):
+                continue
+        return list(destinos)
+    if message_type == "targeted":
+        destinos = set()
+        for user_id in message_data.get("target_users", []):
+            destinos.update(user_ws_map.get(str(user_id), ()))
+        return list(destinos)
+    return []
+
+
+def despachar(message_data):
+    """Copia un mensaje a la cola de cada conexión destino (no bloquea)"""
+    for conexion in resolver_destinos(message_data):
+        conexion.encolar(message_data.get("message"), message_data.get("coalesce_key"))
+
+
+def despachar_ecg(body):
+    """Reenvía un chunk de ECG como frames binarios decimados a sus suscriptores.
+
+    No pasa por JSON de salida ni por el log: se decodifica una vez, se decima por
+    frecuencia pedida y cada variante se codifica una sola vez.
+    """
+    patient_id, sample_rate, timestamp, muestras = ecgService.parse_chunk(body)
+    suscriptores = ecg_subscribers.get(patient_id)
+    if not suscriptores:
+        return
+    preferencias = {conexion: conexion.ecg[patient_id] for conexion in suscriptores}
+    frames = ecgService.frames_para_suscriptores(patient_id, sample_rate, timestamp, muestras, preferencias)
+    for conexion, frame in frames:
+        conexion.encolar(frame, ("ecg", patient_id))
+
+
+def estadisticas_conexiones():
+    """Profundidad de cola, envíos y descartes por conexión"""
+    por_conexion = [conexion.estadisticas() for conexion in conexiones.values()]
+    return {
+        "connections": len(por_conexion),
+        "users": len(user_ws_map),
+        "subscribed_patients": len(patient_subscribers),
+        "ecg_subscribed_patients": len(ecg_subscribers),
+        "queue_depth": sum(c["queue_depth"] for c in por_conexion),
+        "dropped": sum(c["dropped"] for c in por_conexion),
+        "coalesced": sum(c["coalesced"] for c in por_conexion),
+        "per_connection": por_conexion,
+    }
@@ -0,0 +1,140 @@
+import threading
+from collections import OrderedDict, deque
+
+
+# Desenlace de una entrega
+ACK = "ack"
+REENCOLAR = "reencolar"
+DESCARTAR = "descartar"
+
+# Estado de una clave de idempotencia al reservarla
+NUEVA = "nueva"
+GUARDADA = "guardada"
+EN_CURSO = "en_curso"
+
+
+class AckTracker:
+    """Entregas pendientes de un canal en orden de llegada.
+
+    Una entrega se marca como completada cuando su muestra ya está guardada (o no
+    requería guardarse), o como rechazada si su muestra no se guardó. `confirmable()`
+    devuelve la última entrega de la parte inicial completamente terminada, para
+    confirmarla con un ack acumulado (multiple=True) sin confirmar nada que siga
+    pendiente, y los rechazos que le siguen, que se envían como nack uno por uno
+    después de ese ack (un ack acumulado posterior los confirmaría).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pendientes = deque()  # Entradas [tag, mensaje, desenlace]
+        self._por_tag = {}
+
+    def registrar(self, tag, mensaje):
+        entrada = [tag, mensaje, None]
+        with self._lock:
+            self._pendientes.append(entrada)
+            self._por_tag[tag] = entrada
+
+    def completar(self, tags, desenlace=ACK):
+        """Marca entregas como terminadas; se puede llamar desde cualquier hilo"""
+        with self._lock:
+            for tag in tags:
+                entrada = self._por_tag.pop(tag, None)
+                if entrada is not None:
+                    entrada[2] = desenlace
+
+    def rechazar(self, tags, reencolar):
+        self.completar(tags, REENCOLAR if reencolar else DESCARTAR)
+
+    def confirmable(self):
+        """Último mensaje de la parte inicial guardada (o None), cuántos abarca y los
+        (mensaje, reencolar) rechazados inmediatamente después"""
+        ultimo = None
+        cantidad = 0
+        rechazados = []
+        with self._lock:
+            while self._pendientes:
+                desenlace = self._pendientes[0][2]
+                if desenlace == ACK and not rechazados:
+                    ultimo = self._pendientes.popleft()[1]
+                    cantidad += 1
+                elif desenlace in (REENCOLAR, DESCARTAR):
+                    rechazados.append((self._pendientes.popleft()[1], desenlace == REENCOLAR))
+                else:
+                    break
+        return ultimo, cantidad, rechazados
+
+    def pendientes(self):
+        return len(self._pendientes)
+
+
+class DedupCache:
+    """Claves de idempotencia vistas recientemente (LRU acotado en memoria).
+
+    Además de las claves ya guardadas lleva las que están en curso (su fila espera en
+    el escritor). Una reentrega de una clave en curso deja su token esperando: se
+    confirma cuando la fila original se guarda o se rechaza cuando no se guardará.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._claves = OrderedDict()
+        self._en_curso = {}  # clave -> tokens de reentregas que esperan su desenlace
+        self._lock = threading.Lock()
+        self.duplicados = 0
+
+    def visto(self, clave):
+        """True si la clave ya se había visto; si no, la registra"""
+        if self.contiene(clave):
+            return True
+        self.registrar([clave])
+        return False
+
+    def contiene(self, clave):
+        """True si la clave ya se registró o está en curso (cuenta como duplicado), sin registrarla"""
+        with self._lock:
+            if clave in self._en_curso:
+                self.duplicados += 1
+                return True
+            if clave not in self._claves:
+                return False
+            self._claves.move_to_end(clave)
+            self.duplicados += 1
+            return True
+
+    def reservar(self, clave, token=None):
+        """NUEVA (y la deja en curso), GUARDADA, o EN_CURSO; en este último caso `token`
+        queda esperando el desenlace de la fila original"""
+        with self._lock:
+            if clave in self._en_curso:
+                self.duplicados += 1
+                if token is not None:
+                    self._en_curso[clave].append(token)
+                return EN_CURSO
+            if clave in self._claves:
+                self._claves.move_to_end(clave)
+                self.duplicados += 1
+                return GUARDADA
+            self._en_curso[clave] = []
+            return NUEVA
+
+    def registrar(self, claves):
+        """Registra claves ya procesadas; devuelve los tokens de sus reentregas en espera.
+        Se puede llamar desde cualquier hilo"""
+        esperando = []
+        with self._lock:
+            for clave in claves:
+                esperando.extend(self._en_curso.pop(clave, ()))
+                self._claves[clave] = None
+                self._claves.move_to_end(clave)
+            while len(self._claves) > self.max_size:
+                self._claves.popitem(last=False)
+        return esperando
+
+    def liberar(self, claves):
+        """Saca de curso claves cuya fila no se guardó; devuelve los tokens en espera"""
+        esperando = []
+        with self._lock:
+            for clave in claves:
+                esperando.extend(self._en_curso.pop(clave, ()))
+        return esperando
@@ -0,0 +1,196 @@
+"""
+Motor de reglas de umbrales compartido por la ingesta en streaming, la detección
+de riesgos de un expediente y las estadísticas históricas.
+
+Cada regla es una disyunción de conjunciones de comparaciones sobre columnas:
+    (mensaje, [[(columna, operador, valor), ...], ...])
+El valor puede ser un número o el nombre de otra columna (p. ej. "hr_max" según la edad).
+Los valores ausentes se representan como NaN y toda comparación sobre ellos es falsa,
+igual que los `is not None` de las reglas originales: `<`, `>`, etc. ya lo son con NaN,
+y `!=` (verdadero con NaN en Python y NumPy) se evalúa como "presente y distinto".
+En SQL los NULL quedan fuera de cualquier comparación.
+"""
+import math
+import operator
+from functools import reduce
+import numpy as np
+
+
+def _distinto(a, b):
+    return a == a and a != b
+
+
+def _distinto_vectorial(a, b):
+    return np.not_equal(a, b) & ~np.isnan(a)
+
+
+# operador: (escalar, vectorial, SQL)
+_OPERADORES = {
+    "<": (operator.lt, np.less, operator.lt),
+    "<=": (operator.le, np.less_equal, operator.le),
+    ">": (operator.gt, np.greater, operator.gt),
+    ">=": (operator.ge, np.greater_equal, operator.ge),
+    "!=": (_distinto, _distinto_vectorial, operator.ne),
+}
+
+# Alertas en tiempo real (antes en validar_datos). Dentro de cada grupo gana la
+# primera regla que se cumple, como en la cadena de if/elif original.
+ALERTAS_TIEMPO_REAL = [
+    [
+        ("Hipotermia: Temperatura menor a 35°C", [[("temperature", "<", 35)]]),
+        ("Febrícula: Temperatura entre 37.5°C y 38°C", [[("temperature", ">=", 37.5), ("temperature", "<", 38)]]),
+        ("Fiebre: Temperatura entre 38°C y 39°C", [[("temperature", ">=", 38), ("temperature", "<", 39)]]),
+        ("Hipertermia: Temperatura mayor a 39°C", [[("temperature", ">=", 39)]]),
+    ],
+    [
+        # Ambos valores detectados
+        ("Hipotensión: Presión arterial baja", [
+            [("systolic", ">", 0), ("diastolic", ">", 0), ("systolic", "<", 90)],
+            [("systolic", ">", 0), ("diastolic", ">", 0), ("diastolic", "<", 60)],
+        ]),
+        ("Hipertensión: Presión arterial alta", [
+            [("systolic", ">", 0), ("diastolic", ">", 0), ("systolic", ">", 140)],
+            [("systolic", ">", 0), ("diastolic", ">", 0), ("diastolic", ">", 90)],
+        ]),
+        # Solo sistólica detectada
+        ("Hipotensión sistólica: Presión sistólica baja", [[("systolic", ">", 0), ("diastolic", "<=", 0), ("systolic", "<", 90)]]),
+        ("Hipertensión sistólica: Presión sistólica alta", [[("systolic", ">", 0), ("diastolic", "<=", 0), ("systolic", ">", 140)]]),
+        # Solo diastólica detectada
+        ("Hipotensión diastólica: Presión diastólica baja", [[("systolic", "<=", 0), ("diastolic", ">", 0), ("diastolic", "<", 60)]]),
+        ("Hipertensión diastólica: Presión diastólica alta", [[("systolic", "<=", 0), ("diastolic", ">", 0), ("diastolic", ">", 90)]]),
+    ],
+    [
+        ("Oxigenación grave: SpO2 menor a 90%", [[("oxygen_saturation", "<", 90)]]),
+        ("Oxigenación leve: SpO2 entre 90% y 92%", [[("oxygen_saturation", ">=", 90), ("oxygen_saturation", "<", 93)]]),
+    ],
+    [
+        ("Bradicardia: Ritmo cardíaco menor a 50 lpm", [[("heart_rate", "<", 50)]]),
+        ("Taquicardia: Ritmo cardíaco mayor a 100 lpm", [[("heart_rate", ">", 100)]]),
+    ],
+]
+
+# Riesgos de un expediente individual (antes en detectar_riesgos)
+RIESGOS_EXPEDIENTE = [
+    ("hipotermia", [[("temperature", "!=", 0), ("temperature", "<", 35.0)]]),
+    ("fiebre", [[("temperature", "!=", 0), ("temperature", ">", 37.5)]]),
+    ("arritmia", [[("heart_rate", "!=", 0), ("heart_rate", "<", 60)], [("heart_rate", "!=", 0), ("heart_rate", ">", 100)]]),
+    ("hipoxemia", [[("oxygen_saturation", "!=", 0), ("oxygen_saturation", "<", 90.0)]]),
+    ("hipertension", [[("systolic", ">", 140.0)]]),
+    ("hipotension", [[("systolic", "<", 90.0)]]),
+]
+
+# Riesgos para las estadísticas históricas; hr_min/hr_max dependen de la edad del paciente
+RIESGOS_ESTADISTICAS = [
+    ("riesgo_taquicardia", [[("heart_rate", ">", "hr_max")]]),
+    ("riesgo_bradicardia", [[("heart_rate", "<", "hr_min")]]),
+    ("riesgo_fiebre", [[("temperature", ">", 38.0)]]),
+    ("riesgo_hipotermia", [[("temperature", "<", 35.0)]]),
+    ("riesgo_hipertension", [[("systolic", ">", 140.0)]]),
+    ("riesgo_hipotension", [[("systolic", "<", 50.0)]]),
+    ("riesgo_baja_saturacion", [[("oxygen_saturation", "<", 90.0), ("oxygen_saturation", ">", 0.0)]]),
+    # Combinaciones clínicas
+    ("probabilidad_agitacion", [[("temperature", ">", 38.0), ("heart_rate", ">", "hr_max")]]),
+    ("probabilidad_shock", [[("systolic", "<", 90.0), ("heart_rate", ">", "hr_max"), ("oxygen_saturation", "<", 90.0)]]),
+]
+
+
+def _compilar_regla(condicion):
+    return tuple(
+        tuple((columna, *_OPERADORES[op], valor) for columna, op, valor in conjuncion)
+        for conjuncion in condicion
+    )
+
+
+def compilar(reglas):
+    """Convierte una tabla (nombre, condición) en una tupla lista para evaluar"""
+    return tuple((nombre, _compilar_regla(condicion)) for nombre, condicion in reglas)
+
+
+def compilar_grupos(grupos):
+    return tuple(compilar(grupo) for grupo in grupos)
+
+
+_ALERTAS = compilar_grupos(ALERTAS_TIEMPO_REAL)
+_RIESGOS_EXPEDIENTE = compilar(RIESGOS_EXPEDIENTE)
+_RIESGOS_ESTADISTICAS = compilar(RIESGOS_ESTADISTICAS)
+
+
+def _a_float(value):
+    return math.nan if value is None else float(value)
+
+
+def _cumple(condicion, fila):
+    """Evalúa una regla compilada sobre una sola muestra (diccionario de floats)"""
+    for conjuncion in condicion:
+        for columna, op_escalar, _, _, valor in conjuncion:
+            limite = fila[valor] if isinstance(valor, str) else valor
+            if not op_escalar(fila[columna], limite):
+                break
+        else:
+            return True
+    return False
+
+
+def _mascara(condicion, columnas, n):
+    """Evalúa una regla compilada sobre columnas NumPy completas"""
+    resultado = np.zeros(n, dtype=bool)
+    with np.errstate(invalid="ignore"):
+        for conjuncion in condicion:
+            parcial = np.ones(n, dtype=bool)
+            for columna, _, op_vectorial, _, valor in conjuncion:
+                limite = columnas[valor] if isinstance(valor, str) else valor
+                parcial &= op_vectorial(columnas[columna], limite)
+            resultado |= parcial
+    return resultado
+
+
+def _condicion_sql(condicion, columnas):
+    """Traduce una regla compilada a una expresión SQL; los operadores de Python sobre
+    columnas de SQLAlchemy generan las comparaciones, y NULL queda fuera como NaN"""
+    return reduce(operator.or_, (
+        reduce(operator.and_, (
+            op_sql(columnas[columna], columnas[valor] if isinstance(valor, str) else valor)
+            for columna, _, _, op_sql, valor in conjuncion
+        ))
+        for conjuncion in condicion
+    ))
+
+
+def alertas_muestra(temperature, systolic, diastolic, oxygen_saturation, heart_rate):
+    """Alertas de una sola muestra con la tabla compilada de ALERTAS_TIEMPO_REAL"""
+    fila = {
+        "temperature": _a_float(temperature),
+        "systolic": _a_float(systolic),
+        "diastolic": _a_float(diastolic),
+        "oxygen_saturation": _a_float(oxygen_saturation),
+        "heart_rate": _a_float(heart_rate),
+    }
+    alertas = []
+    for grupo in _ALERTAS:
+        for mensaje, condicion in grupo:
+            if _cumple(condicion, fila):
+                alertas.append(mensaje)
+                break
+    return alertas
+
+
+def riesgos_expediente(temperature, systolic, oxygen_saturation, heart_rate):
+    """Banderas de riesgo de un solo expediente"""
+    fila = {
+        "temperature": _a_float(temperature),
+        "systolic": _a_float(systolic),
+        "oxygen_saturation": _a_float(oxygen_saturation),
+        "heart_rate": _a_float(heart_rate),
+    }
+    return {nombre: _cumple(condicion, fila) for nombre, condicion in _RIESGOS_EXPEDIENTE}
+
+
+def mascaras_riesgo_estadisticas(columnas):
+    """Máscaras de riesgo y combinaciones clínicas para las estadísticas históricas"""
+    n = len(next(iter(columnas.values())))
+    return {nombre: _mascara(condicion, columnas, n) for nombre, condicion in _RIESGOS_ESTADISTICAS}
+
+
+def filtros_riesgo_estadisticas(columnas):
+    """Las mismas reglas de las estadísticas como condiciones SQL (para COUNT(*) FILTER)"""
+    return {nombre: _condicion_sql(condicion, columnas) for nombre, condicion in _RIESGOS_ESTADISTICAS}
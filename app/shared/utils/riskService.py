@@ -1,28 +1,58 @@
 from app.schemas.riskSchema import RisksSchema
 import re
+import numpy as np
+from sqlalchemy import Float, case, cast, func
+from app.shared.utils.alertRules import riesgos_expediente
 
 
-def parse_blood_pressure(value):
+_BLOOD_PRESSURE_RE = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*(?:/\s*(\d+(?:\.\d+)?))?")
+
+def split_blood_pressure(value):
+    """Convierte "sis/dia" en (sistólica, diastólica); la diastólica puede ser None.
+
+    Devuelve None si el valor no se puede interpretar. Es el único parser de presión
+    arterial del proyecto: ingesta, expedientes, riesgos y estadísticas lo comparten.
+    """
     if value is None:
         return None
     if isinstance(value, (int, float)):
-        return float(value)
-    if isinstance(value, str):
-        match = re.match(r"^\s*(\d+(?:\.\d+)?)", value)
-        if match:
-            return float(match.group(1))
-    return None
+        return float(value), None
+    match = _BLOOD_PRESSURE_RE.match(str(value))
+    if not match:
+        return None
+    diastolic = match.group(2)
+    return float(match.group(1)), float(diastolic) if diastolic is not None else None
+
+def parse_blood_pressure(value):
+    """Valor sistólico de una presión arterial"""
+    parts = split_blood_pressure(value)
+    return parts[0] if parts else None
+
+def systolic_of(record):
+    """Sistólica de un expediente, usando la columna numérica si ya está poblada"""
+    if getattr(record, "systolic", None) is not None:
+        return record.systolic
+    return parse_blood_pressure(record.blood_pressure)
+
+def systolic_array(systolic, blood_pressures):
+    """Versión por columnas de systolic_of: `systolic` es un arreglo float64 con NaN donde
+    la columna numérica no está poblada; solo esas filas se interpretan desde el texto"""
+    for i in np.flatnonzero(np.isnan(systolic)):
+        value = parse_blood_pressure(blood_pressures[i])
+        if value is not None:
+            systolic[i] = value
+    return systolic
+
+def systolic_sql(systolic, blood_pressure):
+    """Versión SQL (PostgreSQL) de systolic_of: la columna numérica o, si es NULL, el
+    primer número del texto con la misma expresión regular"""
+    return func.coalesce(systolic, cast(func.substring(blood_pressure, _BLOOD_PRESSURE_RE.pattern), Float))
 
 def detectar_riesgos(record):
-    systolic_bp = parse_blood_pressure(record.blood_pressure)
-    return RisksSchema(
-        hipotermia=(record.temperature is not None and record.temperature != 0 and record.temperature < 35.0),
-        fiebre=(record.temperature is not None and record.temperature != 0 and record.temperature > 37.5),
-        arritmia=(record.heart_rate is not None and record.heart_rate != 0 and (record.heart_rate < 60 or record.heart_rate > 100)),
-        hipoxemia=(record.oxygen_saturation is not None and record.oxygen_saturation != 0 and record.oxygen_saturation < 90.0),
-        hipertension=(systolic_bp is not None and systolic_bp > 140.0),
-        hipotension=(systolic_bp is not None and systolic_bp < 90.0)
-    )
+    systolic_bp = systolic_of(record)
+    return RisksSchema(**riesgos_expediente(
+        record.temperature, systolic_bp, record.oxygen_saturation, record.heart_rate
+    ))
     
 def get_respiratory_rate_range(age):
     # Devuelve el rango normal de frecuencia respiratoria según la edad
@@ -45,8 +75,35 @@ def get_respiratory_rate_range(age):
     else:  # Vejez
         return (12, 16)
 
+# Rangos normales de frecuencia cardiaca: (edad límite exclusiva, rango); None cubre el resto
+RANGOS_FC_POR_EDAD = (
+    (None, (60, 100)),  # Valor para adultos
+)
+
 def get_heart_rate_range(age):
-    return (60, 100)  # Valor para adultos
+    for limite, rango in RANGOS_FC_POR_EDAD:
+        if limite is None or age < limite:
+            return rango
+
+def heart_rate_range_sql(age):
+    """Versión SQL de get_heart_rate_range a partir de los tramos fijos de edad: constantes
+    si hay un solo tramo, un CASE sobre la columna de edad si hay varios"""
+    if len(RANGOS_FC_POR_EDAD) == 1:
+        return RANGOS_FC_POR_EDAD[0][1]
+    return tuple(
+        case(
+            *[(age < limite, rango[i]) for limite, rango in RANGOS_FC_POR_EDAD if limite is not None],
+            else_=RANGOS_FC_POR_EDAD[-1][1][i],
+        )
+        for i in (0, 1)
+    )
+
+def umbrales_fc(edades):
+    """Columnas hr_min/hr_max para un arreglo de edades: el rango se calcula una vez por
+    edad distinta y se expande a todas las filas con el índice inverso"""
+    unicas, por_fila = np.unique(edades, return_inverse=True)
+    rangos = np.array([get_heart_rate_range(edad.item()) for edad in unicas], dtype=np.float64).reshape(-1, 2)
+    return rangos[por_fila.ravel(), 0], rangos[por_fila.ravel(), 1]
 
 
 def riesgo_taquicardia(record):
@@ -0,0 +1,77 @@
+import sys
+import time
+
+# Señales que se acumulan por paciente; la presión se guarda ya separada
+VITALES = ("temperature", "systolic", "diastolic", "oxygen_saturation", "heart_rate")
+
+
+class VitalAggregate:
+    """Conteo, media, mínimo, máximo y varianza incrementales (algoritmo de Welford)"""
+
+    __slots__ = ("count", "mean", "m2", "min", "max")
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = None
+        self.max = None
+
+    def update(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    @property
+    def variance(self):
+        """Varianza poblacional"""
+        return self.m2 / self.count if self.count else 0.0
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "mean": self.mean if self.count else None,
+            "min": self.min,
+            "max": self.max,
+            "variance": self.variance if self.count else None,
+        }
+
+
+class PatientBuffer:
+    """Ventana actual de un paciente: solo los agregados de cada señal, sin guardar las
+    muestras, así que la memoria por paciente no crece con la duración de la ventana"""
+
+    __slots__ = ("patient_id", "doctor_id", "aggregates", "window_started", "last_seen")
+
+    def __init__(self, patient_id):
+        self.patient_id = patient_id
+        self.doctor_id = None
+        self.aggregates = {vital: VitalAggregate() for vital in VITALES}
+        self.window_started = time.time()
+        self.last_seen = time.monotonic()
+
+    def add(self, vital, value):
+        self.aggregates[vital].update(value)
+
+    def live(self):
+        """Agregado parcial de la ventana en curso"""
+        return {vital: aggregate.snapshot() for vital, aggregate in self.aggregates.items()}
+
+    def sample_count(self):
+        return sum(aggregate.count for aggregate in self.aggregates.values())
+
+    def nbytes(self):
+        """Memoria de los agregados (constante por paciente)"""
+        return sys.getsizeof(self.aggregates) + sum(sys.getsizeof(a) for a in self.aggregates.values())
+
+    def idle_seconds(self, now=None):
+        return (now or time.monotonic()) - self.last_seen
+
+    def clear(self):
+        self.aggregates = {vital: VitalAggregate() for vital in VITALES}
+        self.window_started = time.time()
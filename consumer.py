@@ -2,6 +2,7 @@ import pika
 import json
 from dotenv import load_dotenv
 import os
+from app.shared.utils.ackTracker import DedupCache
 load_dotenv()
 
 # Configuración de RabbitMQ
@@ -10,12 +11,16 @@ RABBITMQ_USER = os.getenv('RABBITMQ_USER')    # Cambia por tu usuario
 RABBITMQ_PASSWORD = os.getenv('RABBITMQ_PASSWORD')  # Cambia por tu contraseña
 EXCHANGE = 'sensores_exchange'
 TOPICS = ['temperatura', 'oxigeno', 'presion', 'ritmo_cardiaco', 'sensor']
+PREFETCH_COUNT = int(os.getenv('RABBITMQ_PREFETCH_COUNT', '2000'))
+ACK_BATCH_SIZE = int(os.getenv('RABBITMQ_ACK_BATCH_SIZE', '50'))
+ACK_INTERVAL = float(os.getenv('RABBITMQ_ACK_INTERVAL', '0.5'))
 
 # Conexión a RabbitMQ
 credentials = pika.PlainCredentials(RABBITMQ_USER, RABBITMQ_PASSWORD)
 parameters = pika.ConnectionParameters(host=RABBITMQ_HOST, credentials=credentials)
 connection = pika.BlockingConnection(parameters)
 channel = connection.channel()
+channel.basic_qos(prefetch_count=PREFETCH_COUNT)
 
 # Declarar el exchange tipo 'topic' y las colas
 channel.exchange_declare(exchange=EXCHANGE, exchange_type='topic', durable=True)
@@ -26,22 +31,47 @@ for topic in TOPICS:
 
 print(f"Esperando mensajes en las colas: {', '.join(TOPICS)}. Para salir presiona CTRL+C.")
 
+# Ack manual acumulado: se confirma el último mensaje ya procesado con multiple=True
+pendiente = {"tag": None, "cantidad": 0}
+vistos = DedupCache(100000)
+
+def confirmar():
+    if pendiente["tag"] is not None:
+        channel.basic_ack(delivery_tag=pendiente["tag"], multiple=True)
+        pendiente["tag"] = None
+        pendiente["cantidad"] = 0
+
+def confirmar_periodicamente():
+    confirmar()
+    connection.call_later(ACK_INTERVAL, confirmar_periodicamente)
+
 def make_callback(topic_name):
     def callback(ch, method, properties, body):
         try:
             data = json.loads(body)
-            print(f"[{topic_name}] Mensaje recibido: {data}")
-            # Aquí puedes procesar el mensaje como quieras
+            # Reentregas de un mensaje ya procesado (mismo dispositivo y timestamp)
+            clave = (data.get("device_id", data.get("patient_id")), topic_name, data.get("timestamp"))
+            if data.get("timestamp") is not None and vistos.visto(clave):
+                print(f"[{topic_name}] Duplicado descartado: {clave}")
+            else:
+                print(f"[{topic_name}] Mensaje recibido: {data}")
+                # Aquí puedes procesar el mensaje como quieras
         except Exception as e:
             print(f"[{topic_name}] Error procesando el mensaje: {e}")
+        pendiente["tag"] = method.delivery_tag
+        pendiente["cantidad"] += 1
+        if pendiente["cantidad"] >= ACK_BATCH_SIZE:
+            confirmar()
     return callback
 
 for topic in TOPICS:
-    channel.basic_consume(queue=topic, on_message_callback=make_callback(topic), auto_ack=True)
+    channel.basic_consume(queue=topic, on_message_callback=make_callback(topic), auto_ack=False)
+connection.call_later(ACK_INTERVAL, confirmar_periodicamente)
 
 try:
     channel.start_consuming()
 except KeyboardInterrupt:
     print("Interrumpido por el usuario.")
+    confirmar()
 finally:
     connection.close()
@@ -2,12 +2,17 @@ from fastapi import FastAPI, Depends,status, HTTPException
 from sqlalchemy.orm import Session
 from fastapi.middleware.cors import CORSMiddleware
 
-from app.shared.config.database import engine, Base, SessionLocal
+from app.shared.config.database import engine, async_engine, Base, SessionLocal
 
 from app.routes.userRoutes import userRouter
 from app.routes.medicalRecordRoutes import medicalRecordRouter
 from app.routes.stadisticsRoutes import stadisticsRouter
 from app.models.recordSensorData import RecordSensorData
+from app.shared.config.schemaUpdates import ensure_blood_pressure_columns
+from app.shared.config.metrics import metrics_response, observar_pool
+from app.shared.services import statsCache
+from app.shared.services.stadisticsService import iniciar_pool, cerrar_pool
+from app.shared.config.middleware.queryProfiler import QueryProfilerMiddleware, instrumentar_engine, solicitudes_lentas
 
 app = FastAPI()
 
@@ -15,6 +20,33 @@ app = FastAPI()
 def health_check():
     return {"status": "ok"}
 
+@app.get("/metrics")
+def get_metrics():
+    return metrics_response()
+
+@app.get("/debug/slow-requests")
+def get_slow_requests():
+    """Últimos requests lentos con sus huellas SQL (y su perfil si fueron muestreados)"""
+    return list(solicitudes_lentas)
+
+@app.on_event("startup")
+def startup_event():
+    # Esquema al arrancar y no al importar: importar main no toca la base
+    Base.metadata.create_all(bind=engine)
+    ensure_blood_pressure_columns(engine)
+    # Procesos del desglose por paciente (/stadistics/{doctor_id}/patients/breakdown)
+    iniciar_pool()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    cerrar_pool()
+    await async_engine.dispose()
+
+@app.get("/debug/stats-cache")
+def get_stats_cache():
+    """Aciertos, fallos e invalidaciones de la caché de estadísticas"""
+    return statsCache.estadisticas()
+
 app.include_router(userRouter, prefix="/api", tags=["users"])
 app.include_router(medicalRecordRouter, prefix="/api", tags=["medical_records"])
 app.include_router(stadisticsRouter, prefix="/api", tags=["stadistics"])
@@ -26,5 +58,9 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
-
-Base.metadata.create_all(bind=engine)
+# Conteo de SQL y tiempos por request (ver queryProfiler)
+instrumentar_engine(engine)
+# Las rutas usan el engine async: sus sentencias y su pool son las que se miden aquí
+instrumentar_engine(async_engine.sync_engine)
+observar_pool(async_engine.sync_engine)
+app.add_middleware(QueryProfilerMiddleware)
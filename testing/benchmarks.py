@@ -0,0 +1,347 @@
+"""
+Microbenchmarks de las funciones calientes de ingesta y analítica.
+
+Corre sin red ni base de datos (SQLite en memoria) sobre datos sintéticos con semilla
+fija, reporta operaciones por segundo y memoria pico, y compara contra una línea base
+guardada. Un cambio de rendimiento se acepta o se rechaza con estos números:
+
+Las estadísticas se miden por los tres caminos: NumPy sobre expedientes en memoria,
+rollups (vital_rollup en SQLite) y SQL. `estadisticas_sql` usa agregados propios de
+PostgreSQL (percentile_cont, mode, stddev_pop), así que solo corre con DB_URL
+apuntando a PostgreSQL; con SQLite se omite y no cuenta para la comparación.
+
+    python -m testing.benchmarks                        # compara contra la línea base
+    python -m testing.benchmarks --sizes 1000,10000     # solo tamaños chicos
+    python -m testing.benchmarks --only validar_datos,detectar_riesgos
+    python -m testing.benchmarks --save-baseline        # actualiza la línea base
+
+Sale con código 1 si algún benchmark queda por debajo de la línea base más allá de
+la tolerancia. La línea base depende de la máquina: regenerarla en la misma máquina
+antes de comparar una rama.
+"""
+import os
+
+# Antes de importar la app: base en memoria y el escritor en lote sin vaciarse solo
+os.environ.setdefault("DB_URL", "sqlite://")
+os.environ["SENSOR_WRITER_BATCH_SIZE"] = str(10 ** 9)
+os.environ["SENSOR_WRITER_FLUSH_INTERVAL"] = str(10 ** 9)
+os.environ["SENSOR_WRITER_MAX_PENDING"] = str(10 ** 9)
+# Que el hilo de agregación no cierre ventanas a mitad de una medición
+os.environ["AGGREGATION_WINDOW_SECONDS"] = str(10 ** 9)
+
+import argparse  # noqa: E402
+import asyncio  # noqa: E402
+import gc  # noqa: E402
+import json  # noqa: E402
+import logging  # noqa: E402
+import sys  # noqa: E402
+import time  # noqa: E402
+import tracemalloc  # noqa: E402
+from datetime import datetime, timedelta  # noqa: E402
+from types import SimpleNamespace  # noqa: E402
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+
+from sqlalchemy import delete, insert  # noqa: E402
+
+from app.models.medicalRecord import MedicalRecord  # noqa: E402
+from app.models.user import User  # noqa: E402
+from app.models.vitalRollup import VitalRollup  # noqa: E402
+from app.shared.config.database import Base, SessionLocal, engine  # noqa: E402
+from app.shared.services import rollupService, sensoresService, sensorWriterService  # noqa: E402
+from app.shared.services.stadisticsService import (  # noqa: E402
+    estadisticas_rollup, estadisticas_sql, get_medical_record_statistics,
+)
+from app.shared.utils.riskService import detectar_riesgos, parse_blood_pressure  # noqa: E402
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "benchmark_baseline.json")
+DEFAULT_SIZES = "1000,10000,100000,1000000"
+MUESTRAS_POR_PACIENTE = 100
+FILAS_POR_CARGA = 50000
+# Solo corren con DB_URL apuntando a PostgreSQL
+REQUIEREN_POSTGRESQL = {"estadisticas_sql"}
+
+
+def generar_datos(n, seed=42):
+    """Muestras sintéticas con la misma forma que envían los dispositivos (incluye faltantes)"""
+    rng = np.random.default_rng(seed)
+    temperatura = np.round(rng.normal(36.8, 1.0, n), 1)
+    sistolica = rng.normal(120, 20, n).astype(int)
+    diastolica = rng.normal(80, 12, n).astype(int)
+    oxigeno = np.round(rng.normal(95, 3, n), 1)
+    ritmo = np.round(rng.normal(80, 18, n), 1)
+    faltantes = rng.random(n) < 0.05
+    return {
+        "temperature": [None if f else float(t) for t, f in zip(temperatura, faltantes)],
+        "blood_pressure": [f"{s}/{d}" for s, d in zip(sistolica, diastolica)],
+        "oxygen_saturation": [float(o) for o in oxigeno],
+        "heart_rate": [float(r) for r in ritmo],
+        "patient_id": [int(i % max(1, n // MUESTRAS_POR_PACIENTE)) + 1 for i in range(n)],
+    }
+
+
+def generar_expedientes(datos):
+    """Objetos con los atributos de MedicalRecord que usan los servicios de riesgo y estadística"""
+    paciente = SimpleNamespace(age=40)
+    inicio = datetime(2025, 1, 1)
+    return [
+        SimpleNamespace(
+            temperature=t if t is not None else 36.5,
+            blood_pressure=bp,
+            systolic=None,
+            diastolic=None,
+            oxygen_saturation=o,
+            heart_rate=r,
+            patient=paciente,
+            created_at=inicio + timedelta(minutes=i),
+        )
+        for i, (t, bp, o, r) in enumerate(zip(
+            datos["temperature"], datos["blood_pressure"], datos["oxygen_saturation"], datos["heart_rate"]
+        ))
+    ]
+
+
+def _limpiar_ingesta():
+    """Vacía buffers, agenda y escritor entre corridas"""
+    with sensoresService.buffer_lock:
+        sensoresService.data_buffer.clear()
+        sensoresService._total_samples = 0
+    with sensoresService._agenda_cond:
+        sensoresService._agenda.clear()
+        sensoresService._programados.clear()
+    with sensorWriterService._condition:
+        sensorWriterService._take_batch()
+    sensoresService.muestras_vistas._claves.clear()
+    sensoresService.muestras_vistas._en_curso.clear()
+
+
+def bench_validar_datos(datos, _):
+    validar = sensoresService.validar_datos
+    for t, bp, o, r in zip(datos["temperature"], datos["blood_pressure"], datos["oxygen_saturation"], datos["heart_rate"]):
+        validar(t, bp, o, r)
+
+
+def bench_parse_blood_pressure(datos, _):
+    for bp in datos["blood_pressure"]:
+        parse_blood_pressure(bp)
+
+
+def bench_detectar_riesgos(_, expedientes):
+    for record in expedientes:
+        detectar_riesgos(record)
+
+
+def preparar_add_sensor_data(datos):
+    _limpiar_ingesta()
+    for patient_id in set(datos["patient_id"]):
+        sensoresService.medicion_activa[patient_id] = True
+
+
+def bench_add_sensor_data(datos, _):
+    add = sensoresService.add_sensor_data
+    for pid, t, bp, o, r in zip(datos["patient_id"], datos["temperature"], datos["blood_pressure"],
+                                datos["oxygen_saturation"], datos["heart_rate"]):
+        add(pid, 2, t, bp, o, r)
+
+
+def preparar_agregacion(datos):
+    """Llena los buffers con todas las muestras; el benchmark mide solo el cierre de ventanas"""
+    preparar_add_sensor_data(datos)
+    bench_add_sensor_data(datos, None)
+
+
+def bench_agregacion(_, __):
+    # Mismo trabajo que cerrar_ventanas antes del INSERT: tomar la ventana y promediarla
+    with sensoresService.buffer_lock:
+        for patient_id, buf in list(sensoresService.data_buffer.items()):
+            sensoresService._aggregate_window(patient_id, buf.doctor_id, sensoresService._take_window(buf))
+
+
+def bench_estadisticas(_, expedientes):
+    asyncio.run(get_medical_record_statistics(None, expedientes))
+
+
+_cargados = None
+
+
+def preparar_base(datos):
+    """Carga los expedientes y sus rollups en la base; se hace una sola vez por tamaño.
+
+    Cada paciente tiene una muestra por minuto desde el mismo inicio, como en una
+    medición real, así que sus cubetas de hora y día son pocas.
+    """
+    global _cargados
+    n = len(datos["patient_id"])
+    if _cargados == n:
+        return
+    Base.metadata.create_all(bind=engine)
+    pacientes = max(1, n // MUESTRAS_POR_PACIENTE)
+    df = pd.DataFrame({
+        "patient_id": datos["patient_id"],
+        "doctor_id": np.nan,
+        "created_at": pd.Timestamp(2025, 1, 1) + pd.to_timedelta(np.arange(n) // pacientes, unit="min"),
+        "temperature": [t if t is not None else 36.5 for t in datos["temperature"]],
+        "systolic": [parse_blood_pressure(bp) for bp in datos["blood_pressure"]],
+        "oxygen_saturation": datos["oxygen_saturation"],
+        "heart_rate": datos["heart_rate"],
+        "age": 40.0,
+    })
+    with SessionLocal() as db:
+        for modelo in (VitalRollup, MedicalRecord, User):
+            db.execute(delete(modelo))
+        db.execute(insert(User), [
+            {"id": patient_id, "name": "Paciente", "lastname": "Benchmark", "age": 40, "gender": "other",
+             "email": f"paciente{patient_id}@benchmark.local", "password": "x"}
+            for patient_id in range(1, pacientes + 1)
+        ])
+        # Por lotes para no tener un dict por expediente de todo el dataset a la vez
+        for inicio in range(0, n, FILAS_POR_CARGA):
+            parte = df.iloc[inicio:inicio + FILAS_POR_CARGA]
+            db.execute(insert(MedicalRecord), [
+                {"patient_id": pid, "temperature": t, "blood_pressure": bp, "systolic": sis,
+                 "oxygen_saturation": o, "heart_rate": r, "created_at": creado}
+                for pid, t, bp, sis, o, r, creado in zip(
+                    parte["patient_id"].tolist(), parte["temperature"].tolist(),
+                    datos["blood_pressure"][inicio:inicio + FILAS_POR_CARGA], parte["systolic"].tolist(),
+                    parte["oxygen_saturation"].tolist(), parte["heart_rate"].tolist(),
+                    parte["created_at"].dt.to_pydatetime(),
+                )
+            ])
+        # Las tablas están vacías: las cubetas se insertan directo, sin el UPSERT de reconstruir
+        db.execute(insert(VitalRollup), rollupService._resumir(df))
+        db.commit()
+    _cargados = n
+
+
+def bench_estadisticas_rollup(_, __):
+    with SessionLocal() as db:
+        estadisticas_rollup(db)
+
+
+def bench_estadisticas_sql(_, __):
+    with SessionLocal() as db:
+        estadisticas_sql(db)
+
+
+# nombre: (función, preparación antes de cada corrida o None)
+BENCHMARKS = {
+    "validar_datos": (bench_validar_datos, None),
+    "parse_blood_pressure": (bench_parse_blood_pressure, None),
+    "detectar_riesgos": (bench_detectar_riesgos, None),
+    "add_sensor_data": (bench_add_sensor_data, preparar_add_sensor_data),
+    "agregacion_ventanas": (bench_agregacion, preparar_agregacion),
+    "get_medical_record_statistics": (bench_estadisticas, None),
+    "estadisticas_rollup": (bench_estadisticas_rollup, preparar_base),
+    "estadisticas_sql": (bench_estadisticas_sql, preparar_base),
+}
+
+
+def medir(funcion, preparar, datos, expedientes, repeticiones):
+    """Mejor tiempo de `repeticiones` corridas y memoria pico de una corrida adicional"""
+    tiempos = []
+    for _ in range(repeticiones):
+        if preparar:
+            preparar(datos)
+        gc.collect()
+        inicio = time.perf_counter()
+        funcion(datos, expedientes)
+        tiempos.append(time.perf_counter() - inicio)
+
+    if preparar:
+        preparar(datos)
+    gc.collect()
+    tracemalloc.start()
+    funcion(datos, expedientes)
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return min(tiempos), pico
+
+
+def ejecutar(nombres, sizes, repeticiones):
+    resultados = {}
+    for n in sizes:
+        datos = generar_datos(n)
+        expedientes = generar_expedientes(datos)
+        for nombre in nombres:
+            funcion, preparar = BENCHMARKS[nombre]
+            segundos, pico = medir(funcion, preparar, datos, expedientes, repeticiones)
+            resultados.setdefault(nombre, {})[str(n)] = {
+                "ops_per_sec": round(n / segundos, 1),
+                "peak_mb": round(pico / 2 ** 20, 2),
+            }
+            print(f"{nombre:32s} n={n:>8d} {n / segundos:>14,.0f} ops/s {pico / 2 ** 20:>9.2f} MB pico")
+        _limpiar_ingesta()
+    return resultados
+
+
+def comparar(resultados, baseline, tolerancia):
+    """Imprime la comparación y devuelve los benchmarks por debajo de la tolerancia"""
+    regresiones = []
+    print("\nComparación contra la línea base (ops/s actual / base):")
+    for nombre, por_tamano in resultados.items():
+        for n, actual in por_tamano.items():
+            base = baseline.get(nombre, {}).get(n)
+            if not base:
+                print(f"  {nombre:32s} n={n:>8s}  sin línea base")
+                continue
+            ratio = actual["ops_per_sec"] / base["ops_per_sec"]
+            marca = "REGRESIÓN" if ratio < 1 - tolerancia else ("mejora" if ratio > 1 + tolerancia else "=")
+            print(f"  {nombre:32s} n={n:>8s}  x{ratio:5.2f}  {marca}")
+            if ratio < 1 - tolerancia:
+                regresiones.append((nombre, n, ratio))
+    return regresiones
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmarks de ingesta y analítica")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="Tamaños de dataset separados por coma")
+    parser.add_argument("--only", default="", help="Benchmarks a correr, separados por coma")
+    parser.add_argument("--repeat", type=int, default=3, help="Corridas por medición (se toma la mejor)")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Caída de ops/s aceptada (0.2 = 20%%)")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true")
+    args = parser.parse_args()
+
+    # Los hilos de la app no deben ensuciar la salida
+    logging.disable(logging.CRITICAL)
+
+    nombres = [n.strip() for n in args.only.split(",") if n.strip()] or list(BENCHMARKS)
+    desconocidos = [n for n in nombres if n not in BENCHMARKS]
+    if desconocidos:
+        parser.error(f"Benchmarks desconocidos: {', '.join(desconocidos)}")
+    sizes = [int(n) for n in args.sizes.split(",")]
+    if engine.dialect.name != "postgresql":
+        omitidos = [n for n in nombres if n in REQUIEREN_POSTGRESQL]
+        if omitidos:
+            print(f"Omitidos sin PostgreSQL (DB_URL={engine.url.drivername}): {', '.join(omitidos)}")
+        nombres = [n for n in nombres if n not in REQUIEREN_POSTGRESQL]
+
+    resultados = ejecutar(nombres, sizes, args.repeat)
+
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        for nombre, por_tamano in resultados.items():
+            baseline.setdefault(nombre, {}).update(por_tamano)
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"\nLínea base guardada en {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("\nNo hay línea base; genera una con --save-baseline")
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regresiones = comparar(resultados, baseline, args.tolerance)
+    if regresiones:
+        print(f"\n{len(regresiones)} benchmark(s) por debajo de la línea base")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
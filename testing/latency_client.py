@@ -0,0 +1,132 @@
+"""
+Cliente WebSocket que mide la latencia productor → socket y el caudal recibido.
+
+Usa el `sent_at` que `testing/producer.py` agrega a cada mensaje (y, para el ECG
+binario, el timestamp de la cabecera del frame). Ejemplos:
+
+    # Un socket por paciente (rol paciente: se suscribe solo a sí mismo, sin doctor_patient)
+    python -m testing.latency_client --patients 500 --per-patient
+    # Un doctor con sus pacientes asignados, incluyendo ECG a 125 Hz
+    python -m testing.latency_client --user-id 2 --rol doctor --patients 50 --ecg --ecg-rate 125
+
+Si el caudal recibido deja de crecer con la rampa del productor o la latencia p99
+sube sin control, se alcanzó el techo de ingesta de la instalación.
+"""
+import argparse
+import asyncio
+import json
+import time
+import websockets
+
+from app.shared.services.ecgService import ECG_FRAME_HEADER
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Medición de latencia de WebSocket de Smartvitals")
+    parser.add_argument("--url", default="ws://localhost:8001/ws/sensores")
+    parser.add_argument("--patients", type=int, default=10)
+    parser.add_argument("--first-patient-id", type=int, default=1)
+    parser.add_argument("--per-patient", action="store_true",
+                        help="Abrir un socket por paciente identificado como ese paciente")
+    parser.add_argument("--user-id", type=int, default=2, help="Usuario del socket compartido")
+    parser.add_argument("--rol", default="doctor")
+    parser.add_argument("--ecg", action="store_true", help="Suscribirse también al ECG")
+    parser.add_argument("--ecg-rate", type=float, default=125.0)
+    parser.add_argument("--duration", type=float, default=60.0)
+    parser.add_argument("--report-every", type=float, default=5.0)
+    return parser.parse_args()
+
+
+class Medicion:
+    def __init__(self):
+        self.latencias = []
+        self.recibidos = 0
+        self.binarios = 0
+        self.bytes = 0
+
+    def registrar(self, latencia):
+        self.latencias.append(latencia)
+
+    def percentiles(self, latencias=None):
+        datos = sorted(self.latencias if latencias is None else latencias)
+        if not datos:
+            return {}
+        def p(q):
+            return datos[min(len(datos) - 1, int(q * len(datos)))] * 1000
+        return {"p50": p(0.50), "p95": p(0.95), "p99": p(0.99), "max": datos[-1] * 1000}
+
+
+def latencia_de(mensaje, ahora):
+    """Latencia de un frame de texto o binario; None si no trae hora de envío"""
+    if isinstance(mensaje, bytes):
+        _, _, sample_rate, timestamp, _, n = ECG_FRAME_HEADER.unpack_from(mensaje)
+        # La última muestra del chunk se generó justo antes de enviarlo
+        return ahora - (timestamp + n / sample_rate) if sample_rate else None
+    data = json.loads(mensaje)
+    sent_at = (data.get("data") or {}).get("sent_at")
+    return ahora - sent_at if sent_at else None
+
+
+async def cliente(args, user_id, rol, patient_ids, medicion, fin):
+    async with websockets.connect(args.url, max_size=None) as ws:
+        await ws.send(json.dumps({"user_id": user_id, "rol": rol}))
+        if rol != "paciente":
+            await ws.send(json.dumps({"action": "subscribe", "patient_ids": patient_ids}))
+        if args.ecg:
+            await ws.send(json.dumps({"action": "ecg_subscribe", "patient_ids": patient_ids, "rate": args.ecg_rate}))
+        while time.monotonic() < fin:
+            try:
+                mensaje = await asyncio.wait_for(ws.recv(), timeout=max(0.1, fin - time.monotonic()))
+            except asyncio.TimeoutError:
+                break
+            ahora = time.time()
+            medicion.recibidos += 1
+            medicion.bytes += len(mensaje)
+            if isinstance(mensaje, bytes):
+                medicion.binarios += 1
+            try:
+                latencia = latencia_de(mensaje, ahora)
+            except (ValueError, KeyError):
+                latencia = None
+            if latencia is not None:
+                medicion.registrar(latencia)
+
+
+async def reportar(args, medicion, inicio):
+    previos, desde = 0, 0
+    while True:
+        await asyncio.sleep(args.report_every)
+        ventana = medicion.percentiles(medicion.latencias[desde:])
+        desde = len(medicion.latencias)
+        recibidos = medicion.recibidos
+        print(
+            f"t={time.monotonic() - inicio:6.0f}s msgs/s={(recibidos - previos) / args.report_every:8.0f} "
+            + " ".join(f"{k}={v:7.1f}ms" for k, v in ventana.items())
+        )
+        previos = recibidos
+
+
+async def main():
+    args = parse_args()
+    patient_ids = list(range(args.first_patient_id, args.first_patient_id + args.patients))
+    medicion = Medicion()
+    inicio = time.monotonic()
+    fin = inicio + args.duration
+
+    if args.per_patient:
+        clientes = [cliente(args, pid, "paciente", [pid], medicion, fin) for pid in patient_ids]
+    else:
+        clientes = [cliente(args, args.user_id, args.rol, patient_ids, medicion, fin)]
+
+    reporte = asyncio.create_task(reportar(args, medicion, inicio))
+    await asyncio.gather(*clientes, return_exceptions=True)
+    reporte.cancel()
+
+    total = medicion.percentiles()
+    print(f"\nRecibidos: {medicion.recibidos} ({medicion.binarios} binarios), "
+          f"{medicion.recibidos / args.duration:.0f} msgs/s, {medicion.bytes / args.duration / 1024:.0f} KB/s")
+    print("Latencia total: " + " ".join(f"{k}={v:.1f}ms" for k, v in total.items()))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,93 +1,208 @@
+"""
+Generador de carga: simula muchos pacientes/dispositivos publicando en todos los topics.
 
-import pika
+Cada mensaje lleva `sent_at` (hora de envío) para que `testing/latency_client.py` mida
+la latencia productor → socket. Ejemplos:
+
+    python -m testing.producer --patients 2000 --rate 1 --ramp linear --ramp-seconds 120
+    python -m testing.producer --patients 50 --topics ecg --ecg-sample-rate 500 --binary-ecg
+    python -m testing.producer --patients 5000 --dry-run   # sin broker, mide el generador
+"""
+import argparse
+import array
+import asyncio
 import json
-import time
-import random
 import math
+import random
+import time
+import aio_pika
 from dotenv import load_dotenv
-import os
+
 load_dotenv()
 
-# Configuración de RabbitMQ
-RABBITMQ_HOST = os.getenv('RABBITMQ_HOST')
-RABBITMQ_USER = os.getenv('RABBITMQ_USER')
-RABBITMQ_PASSWORD = os.getenv('RABBITMQ_PASSWORD')
-EXCHANGE = 'amq.topic'  # Cambiar al exchange por defecto
-TOPICS = ['temperatura', 'oxigeno', 'ritmo_cardiaco']
-
-# Conexión a RabbitMQ
-credentials = pika.PlainCredentials(RABBITMQ_USER, RABBITMQ_PASSWORD)
-parameters = pika.ConnectionParameters(host=RABBITMQ_HOST, credentials=credentials)
-connection = pika.BlockingConnection(parameters)
-channel = connection.channel()
-
-# Declarar el exchange tipo 'topic'
-channel.exchange_declare(exchange=EXCHANGE, exchange_type='topic', durable=True)
-
-# Función para enviar un mensaje a un topic
-def send_message(topic, data):
-    message = json.dumps(data)
-    channel.basic_publish(
-        exchange=EXCHANGE,
-        routing_key=topic,
-        body=message,
-        properties=pika.BasicProperties(delivery_mode=2)  # Hacer el mensaje persistente
-    )
-    print(f"📤 Enviado a '{topic}': {message}")
-
-# Función para generar datos variando
-def generate_varying_data(cycle):
-    # Datos base que varían con el tiempo
-    base_temp = 36.5 + 2 * math.sin(cycle * 0.1) + random.uniform(-0.5, 0.5)
-    base_oxygen = 95 + 3 * math.sin(cycle * 0.15) + random.uniform(-2, 2)
-    base_heart_rate = 70 + 10 * math.sin(cycle * 0.2) + random.uniform(-5, 5)
-    
-    # Asegurar rangos realistas
-    base_temp = max(35.0, min(39.0, base_temp))
-    base_oxygen = max(85, min(100, base_oxygen))
-    base_heart_rate = max(50, min(120, base_heart_rate))
-    
-    return {
-        'temperatura': {
-            'patient_id': 1,
-            'doctor_id': 2,
-            'temperature': round(base_temp, 1),
-            'timestamp': time.time()
-        },
-        'oxigeno': {
-            'patient_id': 1,
-            'doctor_id': 2,
-            'oxygen_saturation': round(base_oxygen, 1),
-            'timestamp': time.time()
-        },
-        'ritmo_cardiaco': {
-            'patient_id': 1,
-            'doctor_id': 2,
-            'heart_rate': round(base_heart_rate, 1),
-            'timestamp': time.time()
-        }
+from app.shared.config.rabbitmq import EXCHANGE, TOPICS, connect  # noqa: E402
+from app.shared.services.ecgService import ECG_CHUNK_HEADER  # noqa: E402
+
+TOPICS_ESCALARES = [topic for topic in TOPICS if topic != "ecg"]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Generador de carga de sensores para Smartvitals")
+    parser.add_argument("--patients", type=int, default=100, help="Número de pacientes simulados")
+    parser.add_argument("--first-patient-id", type=int, default=1)
+    parser.add_argument("--doctor-id", type=int, default=2)
+    parser.add_argument("--topics", default=",".join(TOPICS), help="Topics separados por coma")
+    parser.add_argument("--rate", type=float, default=1.0, help="Mensajes por segundo por paciente y topic escalar")
+    parser.add_argument("--ecg-sample-rate", type=float, default=250.0, help="Muestras de ECG por segundo")
+    parser.add_argument("--ecg-chunk-ms", type=int, default=200, help="Duración de cada chunk de ECG")
+    parser.add_argument("--binary-ecg", action="store_true", help="Enviar el ECG en binario en lugar de JSON")
+    parser.add_argument("--ramp", choices=["constant", "linear", "step"], default="constant",
+                        help="Perfil de activación de pacientes")
+    parser.add_argument("--ramp-seconds", type=float, default=60.0)
+    parser.add_argument("--duration", type=float, default=0, help="Segundos de prueba (0 = sin límite)")
+    parser.add_argument("--report-every", type=float, default=5.0)
+    parser.add_argument("--dry-run", action="store_true", help="No publicar; solo generar (mide el generador)")
+    return parser.parse_args()
+
+
+def pacientes_activos(args, transcurrido):
+    """Cuántos pacientes están enviando según el perfil de rampa"""
+    if args.ramp == "linear":
+        fraccion = min(1.0, transcurrido / args.ramp_seconds) if args.ramp_seconds else 1.0
+    elif args.ramp == "step":
+        # Cuatro escalones de 25% repartidos en ramp_seconds
+        fraccion = min(1.0, (math.floor(4 * transcurrido / args.ramp_seconds) + 1) / 4) if args.ramp_seconds else 1.0
+    else:
+        fraccion = 1.0
+    return max(1, int(args.patients * fraccion))
+
+
+def generar_escalar(topic, patient_id, doctor_id, ciclo):
+    """Datos de un topic escalar variando en el tiempo, con rangos realistas"""
+    fase = ciclo + patient_id
+    temp = max(35.0, min(39.0, 36.5 + 2 * math.sin(fase * 0.1) + random.uniform(-0.5, 0.5)))
+    oxigeno = max(85, min(100, 95 + 3 * math.sin(fase * 0.15) + random.uniform(-2, 2)))
+    ritmo = max(50, min(120, 70 + 10 * math.sin(fase * 0.2) + random.uniform(-5, 5)))
+    sistolica = int(120 + 15 * math.sin(fase * 0.05) + random.uniform(-5, 5))
+    diastolica = int(80 + 8 * math.sin(fase * 0.05) + random.uniform(-3, 3))
+    ahora = time.time()
+    data = {
+        "patient_id": patient_id,
+        "doctor_id": doctor_id,
+        "device_id": f"sim-{patient_id}",
+        "timestamp": ahora,
+        "sent_at": ahora,
     }
+    if topic in ("temperatura", "sensor"):
+        data["temperature"] = round(temp, 1)
+    if topic in ("oxigeno", "sensor"):
+        data["oxygen_saturation"] = round(oxigeno, 1)
+    if topic in ("ritmo_cardiaco", "sensor"):
+        data["heart_rate"] = round(ritmo, 1)
+    if topic in ("presion", "sensor"):
+        data["blood_pressure"] = f"{sistolica}/{diastolica}"
+    return json.dumps(data).encode()
 
-# Loop principal para enviar datos cada segundo
-try:
-    print("🚀 Iniciando productor de datos de sensores...")
-    print("📊 Enviando datos cada segundo a: temperatura, oxigeno, ritmo_cardiaco")
-    print("🛑 Presiona Ctrl+C para detener")
-    
-    cycle = 0
+
+def generar_ecg(patient_id, sample_rate, n_muestras, inicio, binario):
+    """Chunk de ECG sintético (onda aproximada a 72 lpm); `inicio` es la hora de la primera muestra"""
+    muestras = []
+    for i in range(n_muestras):
+        t = inicio + i / sample_rate
+        fase = (t * 1.2) % 1.0
+        valor = 1.2 * math.exp(-((fase - 0.3) ** 2) / 0.0002) + 0.15 * math.sin(2 * math.pi * fase)
+        muestras.append(valor + random.uniform(-0.02, 0.02))
+    if binario:
+        return ECG_CHUNK_HEADER.pack(patient_id, sample_rate, inicio) + array.array('f', muestras).tobytes()
+    return json.dumps({
+        "patient_id": patient_id,
+        "device_id": f"sim-{patient_id}",
+        "sample_rate": sample_rate,
+        "timestamp": inicio,
+        "sent_at": time.time(),
+        "samples": [round(v, 4) for v in muestras],
+    }).encode()
+
+
+class Publicador:
+    def __init__(self, dry_run):
+        self.dry_run = dry_run
+        self.enviados = 0
+        self.bytes = 0
+        self._connection = None
+        self._exchange = None
+
+    async def iniciar(self):
+        if self.dry_run:
+            return
+        self._connection = await connect()
+        channel = await self._connection.channel(publisher_confirms=False)
+        self._exchange = await channel.declare_exchange(EXCHANGE, aio_pika.ExchangeType.TOPIC, durable=True)
+
+    async def publicar(self, topic, body):
+        if not self.dry_run:
+            await self._exchange.publish(aio_pika.Message(body), routing_key=topic)
+        self.enviados += 1
+        self.bytes += len(body)
+
+    async def cerrar(self):
+        if self._connection is not None:
+            await self._connection.close()
+
+
+async def bucle_escalares(args, topics, publicador, inicio):
+    """Un tick cada 1/rate segundos: todos los pacientes activos publican en cada topic"""
+    periodo = 1.0 / args.rate
+    ciclo = 0
+    siguiente = time.monotonic()
     while True:
-        # Generar datos variando
-        data = generate_varying_data(cycle)
-        
-        # Enviar a cada topic
-        for topic in TOPICS:
-            send_message(topic, data[topic])
-        
-        cycle += 1
-        time.sleep(1)  # Esperar 1 segundo
-
-except KeyboardInterrupt:
-    print("\n🛑 Productor detenido por el usuario.")
-finally:
-    connection.close()
-    print("🔌 Conexión cerrada.")
\ No newline at end of file
+        activos = pacientes_activos(args, time.monotonic() - inicio)
+        for patient_id in range(args.first_patient_id, args.first_patient_id + activos):
+            for topic in topics:
+                await publicador.publicar(topic, generar_escalar(topic, patient_id, args.doctor_id, ciclo))
+        ciclo += 1
+        siguiente += periodo
+        await asyncio.sleep(max(0.0, siguiente - time.monotonic()))
+
+
+async def bucle_ecg(args, publicador, inicio):
+    """Un chunk de ECG por paciente activo cada ecg_chunk_ms"""
+    periodo = args.ecg_chunk_ms / 1000
+    n_muestras = max(1, int(args.ecg_sample_rate * periodo))
+    siguiente = time.monotonic()
+    while True:
+        activos = pacientes_activos(args, time.monotonic() - inicio)
+        primera = time.time() - periodo
+        for patient_id in range(args.first_patient_id, args.first_patient_id + activos):
+            body = generar_ecg(patient_id, args.ecg_sample_rate, n_muestras, primera, args.binary_ecg)
+            await publicador.publicar("ecg", body)
+        siguiente += periodo
+        await asyncio.sleep(max(0.0, siguiente - time.monotonic()))
+
+
+async def reportar(args, publicador, inicio):
+    previos, previos_bytes = 0, 0
+    while True:
+        await asyncio.sleep(args.report_every)
+        enviados, bytes_enviados = publicador.enviados, publicador.bytes
+        print(
+            f"t={time.monotonic() - inicio:6.0f}s activos={pacientes_activos(args, time.monotonic() - inicio)} "
+            f"msgs/s={(enviados - previos) / args.report_every:8.0f} "
+            f"KB/s={(bytes_enviados - previos_bytes) / args.report_every / 1024:8.0f} total={enviados}"
+        )
+        previos, previos_bytes = enviados, bytes_enviados
+
+
+async def main():
+    args = parse_args()
+    topics = [topic.strip() for topic in args.topics.split(",") if topic.strip()]
+    escalares = [topic for topic in topics if topic in TOPICS_ESCALARES]
+
+    publicador = Publicador(args.dry_run)
+    await publicador.iniciar()
+    print(f"🚀 Simulando {args.patients} pacientes en {', '.join(topics)} (rampa {args.ramp})")
+    print("🛑 Presiona Ctrl+C para detener")
+
+    inicio = time.monotonic()
+    tareas = [asyncio.create_task(reportar(args, publicador, inicio))]
+    if escalares:
+        tareas.append(asyncio.create_task(bucle_escalares(args, escalares, publicador, inicio)))
+    if "ecg" in topics:
+        tareas.append(asyncio.create_task(bucle_ecg(args, publicador, inicio)))
+    try:
+        if args.duration:
+            await asyncio.sleep(args.duration)
+        else:
+            await asyncio.gather(*tareas)
+    finally:
+        for tarea in tareas:
+            tarea.cancel()
+        await publicador.cerrar()
+        print(f"🔌 Enviados {publicador.enviados} mensajes.")
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        print("\n🛑 Productor detenido por el usuario.")
@@ -1,15 +1,26 @@
 import json
-import os
-import pika
 import time
 import asyncio
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException
 from dotenv import load_dotenv
-import threading
 import logging
-from concurrent.futures import ThreadPoolExecutor
-import queue
-from app.shared.services.sensoresService import add_sensor_data, process_and_save_records, validar_datos, medicion_activa, set_notification_callback
+from app.shared.services.sensoresService import procesar_mensaje_sensor, medicion_activa, set_notification_callback, set_aggregation_window, validar_ventana, buffer_stats, get_live_aggregate
+from app.shared.services import ingestService, rollupService
+from app.shared.services.fanoutBus import crear_bus, WORKER_ID
+from app.shared.services.websocketService import (
+    register_client, unregister_client, subscribe, unsubscribe, pacientes_permitidos,
+    subscribe_ecg, unsubscribe_ecg, despachar, despachar_ecg, estadisticas_conexiones
+)
+from app.shared.services.sensorWriterService import flush_sensor_data, set_commit_callback, set_reject_callback
+from app.shared.utils.ackTracker import AckTracker
+from app.shared.config.database import engine
+from app.shared.config.schemaUpdates import ensure_blood_pressure_columns
+from app.shared.config.metrics import MESSAGES_CONSUMED, MESSAGE_QUEUE_DEPTH, UNACKED_DELIVERIES, metrics_response
+from app.shared.services.publisherService import publish_config, publish_configs, start_publisher, close_publisher
+from app.shared.config.rabbitmq import (
+    RABBITMQ_PREFETCH_COUNT, RABBITMQ_ACK_BATCH_SIZE, RABBITMQ_ACK_INTERVAL,
+    connect, declare_topic_queues, run_with_backoff
+)
 
 # Configurar logging
 logging.basicConfig(level=logging.INFO)
@@ -18,198 +29,233 @@ logger = logging.getLogger(__name__)
 load_dotenv()
 
 app = FastAPI()
-clients = set()
-user_ws_map = {}  # Mapa para almacenar WebSockets por usuario
-
-# Configuración de RabbitMQ
-RABBITMQ_HOST = os.getenv('RABBITMQ_HOST')
-RABBITMQ_USER = os.getenv('RABBITMQ_USER')
-RABBITMQ_PASSWORD = os.getenv('RABBITMQ_PASSWORD')
-EXCHANGE = 'amq.topic'  
-TOPICS = ['temperatura', 'oxigeno', 'presion', 'ritmo_cardiaco', 'sensor', 'ecg']
-
-# Cola thread-safe para comunicación entre hilos (usando queue estándar)
-message_queue = queue.Queue()
+
+# Cola del event loop principal; los hilos la alimentan con call_soon_threadsafe
+message_queue = asyncio.Queue()
 # Variable global para el event loop principal
 main_loop = None
+MESSAGE_QUEUE_DEPTH.set_function(message_queue.qsize)
+# Bus que reparte mensajes y estado de sesión entre todos los workers del websocket
+bus = crear_bus()
 
 async def websocket_sender():
-    """Proceso asíncrono que envía mensajes a WebSockets"""
+    """Proceso asíncrono que publica en el bus los mensajes pendientes.
+
+    Cada despertar vacía la cola y publica un solo lote; cada worker lo reparte
+    después a las colas de sus propias conexiones (ver `procesar_evento_bus`).
+    """
     while True:
         try:
-            # Usar un bucle no bloqueante para revisar la cola
-            try:
-                message_data = message_queue.get_nowait()
-            except queue.Empty:
-                await asyncio.sleep(0.1)  # Esperar un poco antes de revisar de nuevo
-                continue
-            
-            message_type = message_data.get("type")
-            message = message_data.get("message")
-            
-            if message_type == "broadcast":
-                # Enviar a todos los clientes
-                disconnected_clients = set()
-                for ws in clients.copy():
-                    try:
-                        await ws.send_text(message)
-                    except Exception as e:
-                        logger.error(f"Error enviando mensaje broadcast: {e}")
-                        disconnected_clients.add(ws)
-                
-                # Limpiar clientes desconectados
-                for ws in disconnected_clients:
-                    clients.discard(ws)
-                    
-            elif message_type == "targeted":
-                # Enviar a usuarios específicos
-                target_users = message_data.get("target_users", [])
-                for user_id in target_users:
-                    user_ws = user_ws_map.get(str(user_id))
-                    if user_ws:
-                        try:
-                            await user_ws.send_text(message)
-                        except Exception as e:
-                            logger.error(f"Error enviando mensaje a usuario {user_id}: {e}")
-                            clients.discard(user_ws)
-                            if str(user_id) in user_ws_map:
-                                del user_ws_map[str(user_id)]
-                                
+            lote = [await message_queue.get()]
+            while not message_queue.empty():
+                lote.append(message_queue.get_nowait())
+            await bus.publish("mensajes", lote)
         except Exception as e:
             logger.error(f"Error en websocket_sender: {e}")
             await asyncio.sleep(1)
 
-def add_message_to_queue(message_type, message, target_users=None):
-    """Función thread-safe para agregar mensajes a la cola"""
+def add_message_to_queue(message_type, message, target_users=None, coalesce_key=None):
+    """Función thread-safe para agregar mensajes a la cola y despertar al sender"""
     try:
         message_data = {
             "type": message_type,
             "message": message,
-            "target_users": target_users or []
+            "target_users": target_users or [],
+            "coalesce_key": coalesce_key
         }
-        # Usar queue.Queue estándar que es thread-safe
-        message_queue.put(message_data)
+        try:
+            en_loop = asyncio.get_running_loop() is main_loop
+        except RuntimeError:
+            en_loop = False
+        if en_loop:
+            message_queue.put_nowait(message_data)
+        elif main_loop is not None:
+            main_loop.call_soon_threadsafe(message_queue.put_nowait, message_data)
+        else:
+            logger.warning("Event loop no iniciado; mensaje descartado")
+            return
         logger.debug(f"Mensaje agregado a cola: {message_type}")
     except Exception as e:
         logger.error(f"Error agregando mensaje a cola: {e}")
 
-def rabbitmq_consumer():
-    """Consumidor de RabbitMQ que corre en hilo separado"""
-    max_retries = 5
-    retry_delay = 5
-    
-    for attempt in range(max_retries):
+def add_messages_to_queue(mensajes):
+    """Agrega un lote de (type, message, target_users[, coalesce_key]) con un solo despertar del event loop"""
+    lote = [
+        {"type": message_type, "message": message, "target_users": target_users or [],
+         "coalesce_key": extra[0] if extra else None}
+        for message_type, message, target_users, *extra in mensajes
+    ]
+
+    def encolar():
+        for message_data in lote:
+            message_queue.put_nowait(message_data)
+
+    try:
+        en_loop = asyncio.get_running_loop() is main_loop
+    except RuntimeError:
+        en_loop = False
+    if en_loop:
+        encolar()
+    elif main_loop is not None:
+        main_loop.call_soon_threadsafe(encolar)
+    else:
+        logger.warning("Event loop no iniciado; lote de mensajes descartado")
+
+# Entregas sin confirmar de la sesión de consumo vigente
+_tracker = None
+_sesion = 0
+UNACKED_DELIVERIES.set_function(lambda: _tracker.pendientes() if _tracker else 0)
+
+def confirmar_entregas(tokens):
+    """Callback del escritor: marca como guardadas las entregas (sesion, delivery_tag)"""
+    tracker = _tracker
+    if tracker is None:
+        return
+    # Los tokens de una sesión anterior ya no se pueden confirmar (el canal se cerró)
+    tracker.completar([tag for sesion, tag in tokens if sesion == _sesion])
+
+def rechazar_entregas(tokens, reencolar):
+    """Callback del escritor: entregas cuyas muestras no se guardaron (se envía nack)"""
+    tracker = _tracker
+    if tracker is None:
+        return
+    tracker.rechazar([tag for sesion, tag in tokens if sesion == _sesion], reencolar)
+
+async def consumir_rabbitmq():
+    """Sesión de consumo asíncrona sobre el event loop de la aplicación.
+
+    Entrega al menos una vez: cada mensaje se confirma solo cuando el escritor en
+    lote guardó su muestra (o si no tenía nada que guardar). Las entregas se siguen
+    en orden con AckTracker y se confirman con un ack acumulado (multiple=True) de
+    la última entrega de la parte inicial ya guardada; las que el escritor rechaza
+    reciben un nack propio y nunca quedan dentro de un ack acumulado.
+    """
+    global _tracker, _sesion
+    connection = await connect()
+    async with connection:
+        channel = await connection.channel()
+        await channel.set_qos(prefetch_count=RABBITMQ_PREFETCH_COUNT)
+        _, queues = await declare_topic_queues(channel)
+
+        entregas = asyncio.Queue()
+        connection.close_callbacks.add(lambda *args: entregas.put_nowait(None))
+
+        _sesion += 1
+        _tracker = tracker = AckTracker()
+
+        for topic, topic_queue in queues.items():
+            async def on_message(message, topic=topic):
+                entregas.put_nowait((topic, message))
+            await topic_queue.consume(on_message)
+
+        logger.info("Iniciando consumo de RabbitMQ...")
+        ultimo_mensaje = None
+        sin_confirmar = 0
+        while True:
+            try:
+                entrega = await asyncio.wait_for(entregas.get(), timeout=RABBITMQ_ACK_INTERVAL)
+            except asyncio.TimeoutError:
+                entrega = False
+
+            if entrega is None:
+                raise ConnectionError("La conexión con RabbitMQ se cerró")
+
+            if entrega:
+                topic, message = entrega
+                MESSAGES_CONSUMED.labels(topic).inc()
+                token = (_sesion, message.delivery_tag)
+                tracker.registrar(message.delivery_tag, message)
+                if topic == "ecg":
+                    # La forma de onda va directo a los suscriptores en binario, sin el camino JSON
+                    await bus.publish("ecg", bytes(message.body))
+                    tracker.completar([message.delivery_tag])
+                elif ingestService.pool_activo():
+                    ingestService.dispatch(topic, message.body, token)
+                else:
+                    procesar_mensaje_sensor(topic, message.body, token)
+
+            guardado, cantidad, rechazados = tracker.confirmable()
+            if guardado is not None:
+                ultimo_mensaje = guardado
+                sin_confirmar += cantidad
+
+            # Confirmar en lote al llenar el lote o al quedar la cola ociosa; antes de un
+            # nack hay que confirmar lo anterior, que el ack acumulado no lo alcanzaría
+            if ultimo_mensaje is not None and (sin_confirmar >= RABBITMQ_ACK_BATCH_SIZE or not entrega or rechazados):
+                await ultimo_mensaje.ack(multiple=True)
+                ultimo_mensaje = None
+                sin_confirmar = 0
+            for message, reencolar in rechazados:
+                await message.nack(requeue=reencolar)
+
+def aplicar_medicion(patient_id, activa, window_seconds=None):
+    """Activa o detiene la acumulación de datos de un paciente donde se procese su ingesta"""
+    if window_seconds is not None:
+        set_aggregation_window(patient_id, window_seconds)
+    medicion_activa[patient_id] = activa
+    if ingestService.pool_activo():
+        ingestService.set_medicion_activa(patient_id, activa, window_seconds)
+
+async def set_medicion_activa(patient_id, activa, window_seconds=None):
+    """Propaga el estado de medición a todos los workers (el que consume lo aplica).
+
+    La ventana se valida antes de publicar: un error dentro del manejador del bus
+    solo quedaría en el log del worker de ingesta y el cliente no se enteraría.
+    """
+    if window_seconds is not None:
+        window_seconds = validar_ventana(window_seconds)
+    await bus.publish("medicion", {"patient_id": patient_id, "activa": activa, "window_seconds": window_seconds})
+
+def procesar_evento_bus(kind, payload):
+    """Aplica en este worker lo publicado en el bus por cualquier worker"""
+    if kind == "mensajes":
+        for message_data in payload:
+            # Por el bus RabbitMQ la clave llega como lista JSON
+            if isinstance(message_data.get("coalesce_key"), list):
+                message_data["coalesce_key"] = tuple(message_data["coalesce_key"])
+            despachar(message_data)
+    elif kind == "ecg":
         try:
-            credentials = pika.PlainCredentials(RABBITMQ_USER, RABBITMQ_PASSWORD)
-            parameters = pika.ConnectionParameters(
-                host=RABBITMQ_HOST, 
-                credentials=credentials,
-                heartbeat=600,
-                blocked_connection_timeout=300
-            )
-            connection = pika.BlockingConnection(parameters)
-            channel = connection.channel()
-            
-            # Configurar exchange y colas
-            channel.exchange_declare(exchange=EXCHANGE, exchange_type='topic', durable=True)
-            for topic in TOPICS:
-                channel.queue_declare(queue=topic, durable=True)
-                channel.queue_bind(exchange=EXCHANGE, queue=topic, routing_key=topic)
-
-            def make_callback(topic_name):
-                def callback(ch, method, properties, body):
-                    try:
-                        data = json.loads(body)
-                        logger.info(f"Mensaje recibido en topic {topic_name}: {data}")
-                        
-                        # Mensaje para broadcast
-                        broadcast_message = json.dumps({"topic": topic_name, "data": data})
-                        add_message_to_queue("broadcast", broadcast_message)
-                        
-                        # Validar datos y enviar alertas si es necesario
-                        alertas = validar_datos(
-                            data.get("temperature"),
-                            data.get("blood_pressure"),
-                            data.get("oxygen_saturation"),
-                            data.get("heart_rate")
-                        )
-                        
-                        if alertas:
-                            alerta_msg = json.dumps({
-                                "type": "alerta",
-                                "patient_id": data.get("patient_id"),
-                                "doctor_id": data.get("doctor_id"),
-                                "alertas": alertas
-                            })
-                            
-                            # Enviar alerta a usuarios específicos
-                            target_users = []
-                            if data.get("patient_id"):
-                                target_users.append(data.get("patient_id"))
-                            if data.get("doctor_id"):
-                                target_users.append(data.get("doctor_id"))
-                            
-                            if target_users:
-                                add_message_to_queue("targeted", alerta_msg, target_users)
-                        
-                        # Guardar datos en base de datos
-                        add_sensor_data(
-                            data.get("patient_id"),
-                            data.get("doctor_id"),
-                            data.get("temperature"),
-                            data.get("blood_pressure"),
-                            data.get("oxygen_saturation"),
-                            data.get("heart_rate")
-                        )
-                        
-                    except json.JSONDecodeError as e:
-                        logger.error(f"Error decodificando JSON: {e}")
-                    except Exception as e:
-                        logger.error(f"Error procesando mensaje: {e}")
-                        
-                return callback
-
-            # Configurar consumidores
-            for topic in TOPICS:
-                channel.basic_consume(
-                    queue=topic, 
-                    on_message_callback=make_callback(topic), 
-                    auto_ack=True
-                )
-            
-            logger.info("Iniciando consumo de RabbitMQ...")
-            channel.start_consuming()
-            
-        except pika.exceptions.AMQPConnectionError as e:
-            logger.error(f"Error de conexión a RabbitMQ (intento {attempt + 1}/{max_retries}): {e}")
-            if attempt < max_retries - 1:
-                time.sleep(retry_delay)
-            else:
-                logger.error("No se pudo conectar a RabbitMQ después de varios intentos")
-                raise
+            despachar_ecg(payload)
         except Exception as e:
-            logger.error(f"Error inesperado en consumidor RabbitMQ: {e}")
-            raise
+            logger.error(f"Error procesando chunk de ECG: {e}")
+    elif kind == "medicion":
+        aplicar_medicion(payload["patient_id"], payload["activa"], payload.get("window_seconds"))
+
+async def rabbitmq_consumer():
+    """Consumidor de RabbitMQ con reconexión y espera exponencial"""
+    await run_with_backoff(consumir_rabbitmq, "consumidor RabbitMQ")
 
 async def send_raspberry_config(user_config):
-    """Enviar configuración a Raspberry Pi de forma asíncrona"""
+    """Enviar configuración a Raspberry Pi por el publicador persistente (con confirmación)"""
     try:
-        credentials = pika.PlainCredentials(RABBITMQ_USER, RABBITMQ_PASSWORD)
-        parameters = pika.ConnectionParameters(host=RABBITMQ_HOST, credentials=credentials)
-        connection = pika.BlockingConnection(parameters)
-        channel = connection.channel()
-        
-        message = json.dumps(user_config)
-        channel.basic_publish(
-            exchange=EXCHANGE,
-            routing_key="user_config",
-            body=message,
-            properties=pika.BasicProperties(delivery_mode=2)
-        )
-        logger.info(f"Configuración enviada a Raspberry Pi: {message}")
-        connection.close()
+        await publish_config(user_config)
+        logger.info(f"Configuración enviada a Raspberry Pi: {user_config}")
     except Exception as e:
-        logger.error(f"Error enviando configuración: {e}")
+        logger.error(f"Error enviando configuración: {e!r}")
+
+@app.get("/metrics")
+def get_metrics():
+    """Métricas de Prometheus de este worker"""
+    return metrics_response()
+
+@app.get("/buffers")
+def get_buffer_stats():
+    """Memoria y muestras acumuladas por paciente en la ventana actual"""
+    return buffer_stats()
+
+@app.get("/live/{patient_id}")
+def get_live_patient_aggregate(patient_id: int):
+    """Promedios parciales de la ventana en curso de un paciente"""
+    aggregate = get_live_aggregate(patient_id)
+    if aggregate is None:
+        raise HTTPException(status_code=404, detail="No hay medición en curso para este paciente")
+    return aggregate
+
+@app.get("/connections")
+def get_connection_stats():
+    """Profundidad de cola, envíos y descartes de cada WebSocket conectado"""
+    return estadisticas_conexiones()
 
 @app.websocket("/ws/sensores")
 async def websocket_endpoint(websocket: WebSocket):
@@ -223,9 +269,10 @@ async def websocket_endpoint(websocket: WebSocket):
         user_id = data.get("user_id")
         rol = data.get("rol")  # "paciente" o "doctor"
         
-        if user_id:
-            user_ws_map[str(user_id)] = websocket
-        clients.add(websocket)
+        conexion = register_client(websocket, user_id, rol)
+        # Un paciente recibe automáticamente sus propios signos vitales
+        if user_id and rol == "paciente":
+            subscribe(websocket, [user_id])
         
         logger.info(f"Cliente conectado: user_id={user_id}, rol={rol}")
         
@@ -235,9 +282,36 @@ async def websocket_endpoint(websocket: WebSocket):
             try:
                 data = json.loads(msg)
                 
-                if data.get("action") == "start":
+                if data.get("action") == "subscribe":
+                    # Recibir los signos vitales solo de los pacientes indicados
+                    solicitados = data.get("patient_ids", [])
+                    permitidos = await pacientes_permitidos(user_id, solicitados)
+                    subscribe(websocket, permitidos)
+                    conexion.encolar(json.dumps({
+                        "type": "subscribed",
+                        "patient_ids": permitidos,
+                        "denied": [int(pid) for pid in solicitados if int(pid) not in permitidos]
+                    }))
+                    
+                elif data.get("action") == "unsubscribe":
+                    unsubscribe(websocket, data.get("patient_ids"))
+                    
+                elif data.get("action") == "ecg_subscribe":
+                    # ECG en frames binarios, decimado a la frecuencia que el cliente puede dibujar
+                    permitidos = await pacientes_permitidos(user_id, data.get("patient_ids", []))
+                    subscribe_ecg(websocket, permitidos, data.get("rate"), data.get("format", "int16"))
+                    conexion.encolar(json.dumps({
+                        "type": "ecg_subscribed",
+                        "patient_ids": permitidos
+                    }))
+                    
+                elif data.get("action") == "ecg_unsubscribe":
+                    unsubscribe_ecg(websocket, data.get("patient_ids"))
+                    
+                elif data.get("action") == "start":
                     patient_id = data["patient_id"]
-                    medicion_activa[patient_id] = True
+                    await set_medicion_activa(patient_id, True, data.get("window_seconds"))
+                    subscribe(websocket, await pacientes_permitidos(user_id, [patient_id]))
                     
                     # Enviar configuración al Raspberry Pi
                     user_config = {
@@ -248,7 +322,7 @@ async def websocket_endpoint(websocket: WebSocket):
                     }
                     await send_raspberry_config(user_config)
                     
-                    await websocket.send_text(json.dumps({
+                    conexion.encolar(json.dumps({
                         "type": "info",
                         "message": f"Medición iniciada para paciente {patient_id}"
                     }))
@@ -256,7 +330,7 @@ async def websocket_endpoint(websocket: WebSocket):
                     
                 elif data.get("action") == "stop":
                     patient_id = data["patient_id"]
-                    medicion_activa[patient_id] = False
+                    await set_medicion_activa(patient_id, False)
                     
                     # Enviar configuración de stop al Raspberry Pi
                     user_config = {
@@ -267,12 +341,33 @@ async def websocket_endpoint(websocket: WebSocket):
                     }
                     await send_raspberry_config(user_config)
                     
-                    await websocket.send_text(json.dumps({
+                    conexion.encolar(json.dumps({
                         "type": "info",
                         "message": f"Medición detenida para paciente {patient_id}"
                     }))
                     logger.info(f"Medición detenida para paciente {patient_id}")
                     
+                elif data.get("action") in ("start_many", "stop_many"):
+                    # Iniciar o detener varios pacientes a la vez (p. ej. una sala completa)
+                    activa = data["action"] == "start_many"
+                    patient_ids = data.get("patient_ids", [])
+                    configs = []
+                    for patient_id in patient_ids:
+                        await set_medicion_activa(patient_id, activa, data.get("window_seconds") if activa else None)
+                        configs.append({
+                            "patient_id": int(patient_id),
+                            "doctor_id": data.get("doctor_id"),
+                            "timestamp": time.time(),
+                            "action": "start" if activa else "stop"
+                        })
+                    fallidas = await publish_configs(configs)
+                    
+                    conexion.encolar(json.dumps({
+                        "type": "info",
+                        "message": f"Medición {'iniciada' if activa else 'detenida'} para {len(configs) - len(fallidas)} pacientes",
+                        "failed_patient_ids": [config["patient_id"] for config in fallidas]
+                    }))
+                    
                 elif data.get("action") == "doctor_config":
                     # Nueva acción para configuración de doctor
                     doctor_id = data.get("doctor_id")
@@ -291,13 +386,16 @@ async def websocket_endpoint(websocket: WebSocket):
                         await send_raspberry_config(doctor_config)
                         logger.info(f"Configuración de doctor enviada: doctor_id={doctor_id}, monitored_patient={patient_id}")
                         
-                        await websocket.send_text(json.dumps({
+                        conexion.encolar(json.dumps({
                             "type": "info",
                             "message": f"Configuración de doctor enviada para monitorear paciente {patient_id}"
                         }))
                         
             except json.JSONDecodeError:
                 logger.error("Error: Mensaje JSON inválido recibido")
+            except ValueError as e:
+                # Parámetros inválidos del cliente (p. ej. window_seconds no permitida)
+                conexion.encolar(json.dumps({"type": "error", "message": str(e)}))
             except Exception as e:
                 logger.error(f"Error procesando mensaje WebSocket: {e}")
                 
@@ -306,28 +404,52 @@ async def websocket_endpoint(websocket: WebSocket):
     except Exception as e:
         logger.error(f"Error en WebSocket: {e}")
     finally:
-        # Limpiar cliente desconectado
-        clients.discard(websocket)
-        if user_id and str(user_id) in user_ws_map:
-            del user_ws_map[str(user_id)]
+        # Limpiar cliente desconectado y sus suscripciones
+        unregister_client(websocket)
 
 @app.on_event("startup")
 async def startup_event():
     # Guardar referencia al event loop principal
     global main_loop
-    main_loop = asyncio.get_event_loop()
+    main_loop = asyncio.get_running_loop()
+    
+    # La ingesta escribe systolic/diastolic: el esquema debe tenerlas aunque la API no haya arrancado
+    await asyncio.to_thread(ensure_blood_pressure_columns, engine)
+    # Los expedientes guardados por la ingesta actualizan vital_rollup en la misma transacción
+    await asyncio.to_thread(rollupService.asegurar_tabla, engine)
     
     # Configurar el callback de notificación para sensoresService
-    set_notification_callback(add_message_to_queue)
+    set_notification_callback(add_message_to_queue, add_messages_to_queue)
+    
+    # Bus de fan-out: mensajes y estado de medición compartidos entre workers
+    await bus.start(procesar_evento_bus)
+    
+    # Con INGEST_WORKERS > 0 los mensajes se reparten por paciente entre varios procesos
+    # Los mensajes de RabbitMQ se confirman cuando el escritor guarda sus muestras
+    set_commit_callback(confirmar_entregas)
+    set_reject_callback(rechazar_entregas)
+    if ingestService.INGEST_ENABLED:
+        ingestService.start_ingest_pool(add_messages_to_queue, confirmar_entregas, rechazar_entregas)
+    
+    # Pool de canales para publicar configuración a los dispositivos
+    start_publisher()
     
     # Iniciar el sender de WebSocket
     asyncio.create_task(websocket_sender())
     
-    # Iniciar el consumidor de RabbitMQ en un hilo separado
-    threading.Thread(target=rabbitmq_consumer, daemon=True).start()
+    # Solo los workers con INGEST_ENABLED consumen los topics de sensores
+    if ingestService.INGEST_ENABLED:
+        asyncio.create_task(rabbitmq_consumer())
+    else:
+        logger.warning("Ingesta desactivada en este worker (INGEST_ENABLED=false): no consume los topics de sensores")
     
-    logger.info("Servicios iniciados correctamente")
+    logger.info(f"Servicios iniciados correctamente (worker={WORKER_ID}, ingesta={ingestService.INGEST_ENABLED})")
 
 @app.on_event("shutdown")
 async def shutdown_event():
-    logger.info("Cerrando servicios...")
\ No newline at end of file
+    logger.info("Cerrando servicios...")
+    # Persistir las muestras crudas que sigan en el buffer
+    ingestService.stop_ingest_pool()
+    flush_sensor_data()
+    await close_publisher()
+    await bus.close()
\ No newline at end of file